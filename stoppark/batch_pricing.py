@@ -0,0 +1,143 @@
+# coding=utf-8
+"""
+Vectorized pricing of many tickets at once, e.g. to find out what all cars inside would pay now.
+
+Functions of this module repeat FixedTariff.calc and DynamicTariff.calc (including zero time and
+maximum per day) using NumPy arrays, so they give exactly the same prices, units and paid time.
+Time is handled as int64 microseconds, so there are no rounding errors either.
+
+Beginnings should be given as datetime64[us] array, e.g. read directly into one: converting a list of datetime
+objects takes far longer than pricing itself (about 0.2 s against a few milliseconds for 50000 tickets).
+
+NumPy is optional: when it's not installed Tariff.calc_many prices tickets one by one using Tariff.calc.
+"""
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+MICROSECONDS = 10 ** 6
+HOUR = 60 * 60 * MICROSECONDS
+DAY = 24 * HOUR
+
+
+def columns(prices, units, paid_times):
+    """
+    @return: tuple of price, units and paid time arrays, or the same lists when NumPy is not available
+    """
+    if numpy is None:
+        return prices, units, paid_times
+    return (numpy.array(prices, dtype=numpy.int64), numpy.array(units, dtype=numpy.int64),
+            numpy.array(paid_times, dtype='timedelta64[us]'))
+
+
+def timestamps(begins, end):
+    """
+    @param begins: datetime64 array, or sequence of datetime, which is much slower to convert
+    @param end: datetime
+    @return: tuple of int64 array and int64, microseconds
+    """
+    begins = numpy.asarray(begins, dtype='datetime64[us]').astype(numpy.int64)
+    return begins, numpy.datetime64(end, 'us').astype(numpy.int64)
+
+
+def calc_units(delta, free_time, divisor):
+    """
+    Vectorized Tariff.calc_units.
+    @param delta: int64 array, microseconds
+    @param free_time: int, seconds
+    @param divisor: int, seconds per unit
+    @return: int64 array
+    """
+    free = int(free_time * MICROSECONDS)
+    units = -((free - delta) // (divisor * MICROSECONDS))  # ceil of (delta - free) / divisor
+    return numpy.where(delta < free, 0, units)
+
+
+def pivots(begins, zero_time):
+    """
+    @return: int64 array, the first zero time not earlier than every beginning, microseconds
+    """
+    hour, minute = zero_time
+    pivot = begins // DAY * DAY + (hour * 60 + minute) * 60 * MICROSECONDS + begins % MICROSECONDS
+    return numpy.where(pivot < begins, pivot + DAY, pivot)
+
+
+def fixed(tariff, begins, end):
+    """
+    Vectorized FixedTariff.calc.
+    @return: tuple of price, units and paid time arrays
+    """
+    begins, end = timestamps(begins, end)
+    delta = end - begins
+    free = int(tariff.free_time * MICROSECONDS)
+    divisor = tariff.DIVISORS[tariff.interval]
+
+    if tariff.interval == tariff.DAILY and tariff.zero_time:
+        pivot = pivots(begins, tariff.zero_time)
+        units = calc_units(end - pivot, tariff.free_time, divisor)
+        extra = (delta > free) & (pivot - begins > free)
+        paid_time = units * divisor * MICROSECONDS + numpy.where(extra, pivot - begins, 0)
+        units += extra
+    else:
+        units = calc_units(delta, tariff.free_time, divisor)
+        paid_time = units * divisor * MICROSECONDS
+    paid_time = numpy.where((units == 0) | (paid_time < delta), delta, paid_time)
+
+    price = units * tariff.cost
+    if tariff.interval == tariff.HOURLY and tariff.max_per_day is not None:
+        cost_per_day = min(tariff.max_per_day, tariff.cost * 24)
+        capped = cost_per_day * (units // 24) + numpy.minimum((units % 24) * tariff.cost, tariff.max_per_day)
+        price = numpy.where(price > tariff.max_per_day, capped, price)
+    return price, units, paid_time.astype('timedelta64[us]')
+
+
+def hours_price(prefix_sums, hours, skip):
+    """
+    Vectorized DynamicTariff.hours_price.
+    """
+    prefix = numpy.asarray(prefix_sums, dtype=numpy.int64)
+    n = len(prefix) - 1
+    skip = numpy.minimum(skip, n)
+    head = n - skip
+    first = prefix[skip + numpy.minimum(hours, head)] - prefix[skip]
+    rest = numpy.maximum(hours - head, 0)
+    wrapped = prefix[n] - prefix[skip] + (rest // n) * prefix[n] + prefix[rest % n]
+    return numpy.where(hours <= head, first, wrapped)
+
+
+def dynamic_price(tariff, units, skip=0):
+    """
+    Vectorized DynamicTariffResult.total_price.
+    """
+    cost_per_day = tariff.cost_per_day
+    return cost_per_day * (units // 24) + numpy.minimum(cost_per_day,
+                                                        hours_price(tariff.prefix_sums, units % 24, skip))
+
+
+def dynamic(tariff, begins, end):
+    """
+    Vectorized DynamicTariff.calc.
+    @return: tuple of price, units and paid time arrays
+    """
+    begins, end = timestamps(begins, end)
+    delta = end - begins
+    free = int(tariff.free_time * MICROSECONDS)
+    divisor = tariff.DIVISORS[tariff.HOURLY]
+
+    if tariff.zero_time is not None:
+        pivot = pivots(begins, tariff.zero_time)
+        units = calc_units(end - pivot, tariff.free_time, divisor)
+        price = dynamic_price(tariff, units)
+        extra = (delta > free) & (pivot - begins > free)
+        extra_units = numpy.where(extra, calc_units(numpy.minimum(end, pivot) - begins, tariff.free_time, divisor), 0)
+        skip = 24 + (begins - pivot) // HOUR  # 24 - ceil of hours till zero time
+        price += numpy.where(extra, dynamic_price(tariff, extra_units, skip), 0)
+        units += extra_units
+    else:
+        units = calc_units(delta, tariff.free_time, divisor)
+        price = dynamic_price(tariff, units)
+
+    paid_time = units * divisor * MICROSECONDS
+    paid_time = numpy.where(paid_time < delta, delta, paid_time)
+    return price, units, paid_time.astype('timedelta64[us]')
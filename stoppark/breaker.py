@@ -0,0 +1,92 @@
+# coding=utf-8
+"""
+Circuit breaker of remote database.
+
+When remote database is unavailable, every exchange lasts until connection timeout expires, so terminals and
+cashier would wait for it again and again. After FAILURE_THRESHOLD consecutive connection failures breaker opens
+and DB fails fast: remote requests raise CircuitOpen (a socket.error, so callers fall back to local data the same
+way they do on any connection failure) without touching network.
+
+Open breaker is probed in background by CircuitBreaker.run every PROBE_INTERVAL: it becomes half-open,
+a single probe request is sent and breaker either closes or opens again.
+Failures, that remote database reports explicitly (FAIL responses), mean that it's available, so they don't count.
+"""
+from gevent import socket, sleep
+
+
+class CircuitOpen(socket.error):
+    pass
+
+
+class CircuitBreaker(object):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    FAILURE_THRESHOLD = 3  # consecutive failures
+    PROBE_INTERVAL = 5  # seconds
+
+    def __init__(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self.listeners = []
+
+    def subscribe(self, listener):
+        """
+        @param listener: callable, that is called with new state whenever state changes
+        """
+        self.listeners.append(listener)
+
+    def set_state(self, state):
+        if state == self.state:
+            return
+        self.state = state
+        for listener in self.listeners:
+            listener(state)
+
+    def check(self):
+        """
+        @raise CircuitOpen: when requests should not be sent to remote database
+        """
+        if self.state != self.CLOSED:
+            raise CircuitOpen('remote database is unavailable')
+
+    def success(self):
+        self.failures = 0
+        self.set_state(self.CLOSED)
+
+    def failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.FAILURE_THRESHOLD:
+            self.set_state(self.OPEN)
+
+    def reset(self):
+        """
+        Closes breaker, e.g. when remote database address changes.
+        """
+        self.success()
+
+    def probe(self, request):
+        """
+        @param request: callable, that performs a single exchange with remote database
+        @return: bool, whether breaker is closed after probe
+        """
+        self.set_state(self.HALF_OPEN)
+        try:
+            request()
+        except socket.error as e:
+            print 'Probe failed:', e.__class__.__name__, e
+            self.failure()
+            return False
+        self.success()
+        return True
+
+    def run(self, request):
+        """
+        Probes open breaker in background, this method never returns.
+        @param request: callable, that performs a single exchange with remote database
+        """
+        while True:
+            sleep(self.PROBE_INTERVAL)
+            if self.state == self.OPEN:
+                self.probe(request)
@@ -3,6 +3,7 @@ from PyQt4.QtCore import QObject, pyqtSlot, pyqtProperty
 from datetime import datetime, date
 from tariff import Tariff
 from payment import Payment
+from rows import CARD
 from config import DATETIME_FORMAT, DATE_FORMAT, DATE_USER_FORMAT
 from i18n import language
 _ = language.ugettext
@@ -76,16 +77,12 @@ class CardPayment(Payment):
             'price': self.result.price
         }
 
-    CARD_QUERY = ('update card set DTreg="%s",DTend="%s", TarifType=%i, TarifPrice=%i*100, TarifSumm=%i*100 '
-                  'where CardID="%s"')
+    CARD_QUERY = 'update card set DTreg=?,DTend=?, TarifType=?, TarifPrice=?*100, TarifSumm=?*100 where CardID=?'
 
     def execute(self, db):
         args = (self.result.begin.strftime(DATE_FORMAT), self.result.end.strftime(DATE_FORMAT),
                 self.tariff.id, self.result.cost, self.result.price, self.card.sn)
-        ret = db.query(self.CARD_QUERY % args) is None
-        if not ret:
-            return ret
-
+        db.write(self.CARD_QUERY, args, local=True)
         return db.generate_payment(self.db_payment_args)
 
     def check(self, db):
@@ -161,17 +158,8 @@ class Card(QObject):
         if response is False:
             return False
         try:
-            fields = response[0]
-            assert(len(fields) >= 19)
-            return Card(fields, apb=apb)
-        except (TypeError, AssertionError, IndexError, ValueError):
-            return None
-
-    @staticmethod
-    def parse_date(value):
-        try:
-            return datetime.strptime(value, DATE_FORMAT).date()
-        except ValueError:
+            return Card(response[0], apb=apb)
+        except (TypeError, IndexError, ValueError):
             return None
 
     @staticmethod
@@ -183,30 +171,37 @@ class Card(QObject):
         ])
 
     def __init__(self, fields, apb=False):
+        """
+        @param fields: list of card table fields
+        @raise ValueError: when fields are incomplete or incorrect
+        """
         QObject.__init__(self)
         self.apb = apb
         self.payments = []
 
+        record = CARD.record(fields)
+        if record.id is None or record.Type is None or record.Status is None:
+            raise ValueError('Card %s has no id, type or status' % (record.CardID,))
         self.fields = fields
 
-        self.id = int(fields[1])
-        self.type = int(fields[2])
-        self.sn = fields[3]
-        self.date_reg = self.parse_date(fields[4])
-        self.date_end = self.parse_date(fields[5])
-        self.date_in = fields[6]
-        self.date_out = fields[7]
-        self.drive_name = fields[8]
-        self.drive_sname = fields[9]
-        self.drive_fname = fields[10]
-        self.drive_phone = fields[11]
-        self.number = fields[12].decode('utf8', errors='replace') if fields[12] != 'None' else u'?'
-        self.make = fields[13].decode('utf8', errors='replace') if fields[13] != 'None' else u'?'
-        self.color = fields[14]
-        self.status = int(fields[15])
-        self.tariff_type = int(fields[16]) if fields[16] != 'None' else None
-        self.tariff_price = fields[17]
-        self.tariff_sum = fields[18]
+        self.id = record.id
+        self.type = record.Type
+        self.sn = record.CardID
+        self.date_reg = record.DTreg
+        self.date_end = record.DTend
+        self.date_in = record.DTIn
+        self.date_out = record.DTOut
+        self.drive_name = record.Name
+        self.drive_sname = record.SName
+        self.drive_fname = record.FName
+        self.drive_phone = record.Phone
+        self.number = record.GosNom if record.GosNom is not None else u'?'
+        self.make = record.Model if record.Model is not None else u'?'
+        self.color = record.Color
+        self.status = record.Status
+        self.tariff_type = record.TarifType
+        self.tariff_price = record.TarifPrice
+        self.tariff_sum = record.TarifSumm
 
     def check(self, direction):
         if self.type not in self.ALLOWED_TYPE:
@@ -248,10 +243,15 @@ class Card(QObject):
                                self.drive_name.decode('utf8', errors='replace')[0:1],
                                self.drive_sname.decode('utf8', errors='replace')[0:1])
 
+    MOVED_QUERY = {
+        True: 'update card set status = ?, DTIn = ? where CardID = ?',
+        False: 'update card set status = ?, DTOut = ? where CardID = ?'
+    }
+
     def moved(self, db, addr, inside):
         status = Card.INSIDE if inside else Card.OUTSIDE
-        datetime_update = ('DTIn = "%s"' if inside else 'DTOut = "%s"') % (datetime.now().strftime(DATETIME_FORMAT))
-        db.query('update card set status = %i, %s where CardID = "%s"' % (status, datetime_update, self.sn))
+        args = (status, datetime.now().strftime(DATETIME_FORMAT), self.sn)
+        db.write(self.MOVED_QUERY[inside], args, local=True)
         return db.generate_pass_event(addr, inside, self.sn)
 
 
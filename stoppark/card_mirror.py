@@ -0,0 +1,127 @@
+# coding=utf-8
+"""
+Local mirror of remote card table.
+
+Gate access decisions must not depend on remote database round-trip time, so cards are looked up
+in memory index of local card table. Index is shared by nobody: every DB instance owns its own mirror,
+which reloads index from local database only when card table generation changes.
+
+Local card table is kept up to date by CardMirror.run, that receives remote cards and applies only
+the difference between them and local ones. When remote database keeps change log (see change_feed module),
+only cards reported by change feed are received, otherwise all of them are received periodically.
+Card status changes are written locally and sent to remote database through outbox,
+so until outbox is empty remote cards are older than local ones and difference is not applied.
+"""
+from gevent import socket
+from gevent.event import Event
+
+
+class CardMirror(object):
+    SYNC_INTERVAL = 60  # seconds
+    RETRY_INTERVAL = 5  # seconds, used when difference cannot be applied because of pending remote writes
+
+    def __init__(self, local):
+        """
+        @param local: db.LocalDB
+        """
+        self.local = local
+        self.index = {}
+        self.generation = None
+        self.changes = None  # set of CardID changed remotely since the last sync, None means all cards
+        self.wakeup = Event()
+
+    def refresh(self):
+        generation = self.local.card_generation()
+        if generation != self.generation:
+            self.index = {fields[3]: list(fields) for fields in self.local.get_cards()}
+            self.generation = generation
+
+    def get(self, sn):
+        """
+        @param sn: str, CardID
+        @return: list of card fields or None when there is no such card in mirror
+        """
+        self.refresh()
+        return self.index.get(sn)
+
+    def add(self, fields):
+        """
+        Adds card, that has been received from remote database before mirror noticed it.
+        Existing cards are not replaced: they may have local changes, that are not sent yet.
+        """
+        self.local.add_card(fields)
+
+    def changed(self, keys):
+        """
+        Change feed listener.
+        @param keys: set of CardID of remotely changed cards, None when any card may have changed
+        @return: True, changes are kept until sync applies them
+        """
+        self.postpone(keys)
+        self.wakeup.set()
+        return True
+
+    def postpone(self, keys):
+        """
+        Keeps changes to be applied by the next sync.
+        """
+        self.changes = None if keys is None or self.changes is None else self.changes | keys
+
+    def diff(self, remote, keys=None):
+        """
+        @param remote: iterable of remote card fields lists
+        @param keys: set of CardID, that remote cards have been received for, None when all of them have been
+        @return: tuple of list of new or changed cards and list of CardID of removed ones
+        """
+        self.refresh()
+        changed = []
+        seen = set()
+        for fields in remote:
+            if len(fields) < self.local.CARD_FIELDS:
+                continue
+            fields = fields[:self.local.CARD_FIELDS]
+            sn = fields[3]
+            seen.add(sn)
+            if self.index.get(sn) != fields:
+                changed.append(fields)
+        removed = [sn for sn in (self.index if keys is None else keys) if sn in self.index and sn not in seen]
+        return changed, removed
+
+    def sync(self, db, keys=None):
+        """
+        Receives remote cards and applies their difference with local ones.
+        @param db: db.DB
+        @param keys: set of CardID of cards to be received, None to receive all of them
+        @return: bool, whether local cards are up to date
+        @raise socket.error when remote database is unavailable
+        """
+        if keys is None:
+            remote = db.rows('select * from card')
+        elif keys:
+            remote = db.rows('select * from card where CardID in (%s)' % (','.join(('?',) * len(keys)),),
+                             tuple(keys))
+        else:
+            return True
+        changed, removed = self.diff(remote, keys)
+        if not changed and not removed:
+            return True
+        print 'Card mirror: %i changed, %i removed' % (len(changed), len(removed))
+        return self.local.update_cards(changed, removed)
+
+    def run(self, db):
+        while True:
+            if not db.feed.active:
+                self.changes = None
+            changes, self.changes = self.changes, set()
+            self.wakeup.clear()
+            try:
+                synced = self.sync(db, changes)
+            except socket.error:
+                synced = None
+            if not synced:
+                self.postpone(changes)
+
+            if db.feed.active:
+                self.wakeup.wait(None if synced else self.RETRY_INTERVAL)
+            else:
+                self.wakeup.wait(self.RETRY_INTERVAL if synced is False else self.SYNC_INTERVAL)
@@ -0,0 +1,104 @@
+# coding=utf-8
+"""
+Change feed of remote database.
+
+Remote database keeps change_log table, that triggers of Tariff, Config, terminal and card tables append
+(table name, row key) to whenever their rows change (see fake_db_server for its schema).
+ChangeFeed polls that log every POLL_INTERVAL using cursor, the last seen id, so usual poll is a single
+short request with empty response, while tables themselves are only transferred when they have changed,
+and only their changed rows when listener can fetch them by key (see card_mirror module).
+
+Listeners are called with set of changed keys of their table, or with None, when any row may have changed:
+that happens once cursor is (re)started, since changes made before it are unknown.
+Listener returns whether it has applied changes. Cursor moves on anyway, but table, which listener has failed,
+is notified again with None by the next poll, until it succeeds.
+Remote database without change log is detected by FAIL response to cursor query and feed stays inactive,
+so consumers keep polling tables periodically (see ChangeFeed.active). Once cursor is started, failed poll
+is simply retried with the same cursor, so a transient error neither loses changes nor reloads tables.
+After MAX_FAILURES consecutive failed polls change log is considered gone and feed becomes inactive.
+"""
+from gevent import socket, sleep
+from protocol import FAIL
+
+
+class ChangeFeed(object):
+    POLL_INTERVAL = 1  # seconds
+    INACTIVE_INTERVAL = 600  # seconds, remote database without change log is checked for it again that late
+    BATCH_SIZE = 500  # changes per poll
+    MAX_FAILURES = 5  # consecutive failed polls, that make feed inactive
+
+    CURSOR_QUERY = 'select coalesce(max(id), 0) from change_log'
+    CHANGES_QUERY = 'select id, TableName, RowKey from change_log where id > ? order by id limit ?'
+
+    def __init__(self, db):
+        """
+        @param db: db.DB
+        """
+        self.db = db
+        self.cursor = None
+        self.active = False  # whether remote database keeps change log
+        self.failures = 0  # consecutive failed polls
+        self.listeners = {}  # table -> list of listeners
+        self.stale = set()  # tables, which listeners have failed, they are notified with None by the next poll
+
+    def subscribe(self, table, listener):
+        """
+        @param table: str, table name in remote database
+        @param listener: callable, that accepts set of changed keys or None and returns whether it has applied them
+        """
+        self.listeners.setdefault(table, []).append(listener)
+
+    def notify(self, table, keys):
+        applied = [listener(keys) for listener in self.listeners.get(table, [])]
+        if all(applied):
+            self.stale.discard(table)
+        else:
+            self.stale.add(table)
+
+    def poll(self):
+        """
+        Receives changes made since the last poll and notifies listeners about them.
+        @return: bool, whether remote database keeps change log
+        @raise socket.error: when remote database is unavailable, cursor is kept, so no change is lost
+        """
+        if self.cursor is None:
+            status, rows = self.db.request(self.CURSOR_QUERY)
+            if status == FAIL:
+                return False
+            self.cursor = int(rows[0][0])
+            for table in self.listeners:
+                self.notify(table, None)
+            return True
+
+        status, rows = self.db.request(self.CHANGES_QUERY, (self.cursor, self.BATCH_SIZE))
+        if status == FAIL:
+            print 'Change feed poll failed, cursor:', self.cursor
+            self.failures += 1
+            if self.failures < self.MAX_FAILURES:
+                return True
+            self.failures = 0
+            self.cursor = None
+            return False
+        self.failures = 0
+
+        changes = {}
+        for change_id, table, key in rows:
+            changes.setdefault(table, set()).add(key)
+            self.cursor = int(change_id)
+        for table in self.stale:
+            changes[table] = None
+        for table, keys in changes.items():
+            self.notify(table, keys)
+        return True
+
+    def run(self):
+        """
+        Polls change log in background, this method never returns.
+        """
+        while True:
+            try:
+                self.active = self.poll()
+                interval = self.POLL_INTERVAL if self.active else self.INACTIVE_INTERVAL
+            except socket.error:
+                interval = self.POLL_INTERVAL
+            sleep(interval)
@@ -13,6 +13,8 @@ if not os.path.exists(stoppark_dir):
 
 u2py.config.db_filename = os.path.join(stoppark_dir, 'db')
 db_filename = u2py.config.db_filename
+db_busy_timeout = 5  # seconds
+latency_filename = os.path.join(stoppark_dir, 'latency')
 
 if sys.platform == 'linux2':
     u2py.config.reader_path = [
@@ -4,6 +4,8 @@ from PyQt4.QtCore import pyqtSignal
 from PyQt4.QtGui import QWidget, QDialog
 from datetime import datetime
 from config import DATETIME_FORMAT_USER
+from latency import latency
+from quotes import quotes
 from flickcharm import FlickCharm
 from keyboard import Keyboard
 import stoppark
@@ -42,6 +44,8 @@ class Config(QWidget):
         self.wicd = None
         self.ui.setupNetworkConnection.clicked.connect(self.setup_network_connection)
 
+        self.ui.updateLatency.clicked.connect(self.update_latency)
+
         self.ui.apbState.stateChanged.connect(lambda state: self.option_changed.emit('apb', str(state)))
         self.ui.manualTicketPrint.stateChanged.connect(lambda state: self.option_changed.emit('ticket.manual_print',
                                                                                               str(state)))
@@ -74,6 +78,9 @@ class Config(QWidget):
         self.ui.testDisplay.setText(_('Test display'))
         self.ui.apbTitle.setText(_('Antipassback'))
         self.ui.apbState.setText(_('Enable'))
+        self.ui.latencyTitle.setText(_('Database latency'))
+        self.ui.latencyReport.setText(_('Press Update to show database request latency.'))
+        self.ui.updateLatency.setText(_('Update'))
 
         self.ui.manualTicketPrintTitle.setText(_('Manual ticket print'))
         self.ui.manualTicketPrint.setText(_('Enable'))
@@ -135,6 +142,10 @@ class Config(QWidget):
         self.option_changed.emit('db.ip', self.ui.dbIP.text())
         self.ui.setDBIPHelp.setText(_('Update: %s') % (datetime.now().strftime(DATETIME_FORMAT_USER)))
 
+    def update_latency(self):
+        report = latency.report() or _('There were no database requests yet.')
+        self.ui.latencyReport.setText(report + '\n' + quotes.report())
+
     def test_display(self):
         self.terminals.test_display()
         self.ui.testDisplayResult.setText(_('Update: %s') % (datetime.now().strftime(DATETIME_FORMAT_USER)))
@@ -1,14 +1,29 @@
 ﻿# coding=utf-8
 from PyQt4.QtCore import pyqtSignal, QObject
-from gevent import socket
+from gevent import socket, spawn, joinall
+from gevent.event import Event
+from pool import ConnectionPool
+from card_mirror import CardMirror
+from change_feed import ChangeFeed
+from tariff_cache import TariffCache
+from free_places import FreePlaces
+from local_writer import LocalWriter
+from breaker import CircuitBreaker, CircuitOpen
+from deadlines import deadline, expired, bind, DeadlineExceeded
+from endpoints import Endpoints
+from protocol import NONE, FAIL, QueryFailed, inline, encode_params, decode_params
+from itertools import chain
 from datetime import datetime
-from time import clock as measurement
+from time import time
+from latency import latency, statement_name, Histogram
 from ticket import Ticket
 from card import Card
-from tariff import Tariff
-from config import db_filename, DATETIME_FORMAT
+from config import db_filename, db_busy_timeout, DATETIME_FORMAT
 import sqlite3
+from uuid import uuid4
 from collections import namedtuple
+from contextlib import contextmanager
+from threading import Lock, RLock, local as thread_local
 from i18n import language
 _ = language.ugettext
 
@@ -16,18 +31,105 @@ _ = language.ugettext
 TerminalData = namedtuple('TerminalData', ['title', 'notify', 'option'])
 
 
-def measure(f):
-    def wrapper(*args, **kw):
-        begin = measurement()
-        ret = f(*args, **kw)
-        elapsed = measurement() - begin
-        print elapsed, args, ret
-        return ret
+class OptionStore(object):
+    """
+    In-memory copy of opt table.
+    It is shared by all LocalDB instances of the same database file, no matter which thread they belong to,
+    so option changes made through one of them are immediately visible through others.
+    """
 
-    return wrapper
+    def __init__(self):
+        self.lock = Lock()
+        self.options = None
+        self.listeners = []
 
+    def load(self, conn):
+        with self.lock:
+            if self.options is None:
+                self.options = dict(row for row in conn.execute('select key,value from opt'))
+            return self.options
+
+    def set(self, local, key, value):
+        """
+        Writes option through to database and notifies listeners when its value has changed.
+        @param local: LocalDB, that option is written through
+        """
+        options = self.load(local.conn)
+        with self.lock:
+            changed = options.get(key) != value
+            with local.transaction() as c:
+                cursor = c.cursor()
+                cursor.execute('update opt set value=? where key=?', (value, key))
+                if cursor.rowcount == 0:
+                    c.execute('insert into opt(key,value) values(?,?)', (key, value))
+            options[key] = value
+            listeners = list(self.listeners)
+
+        if changed:
+            for listener in listeners:
+                listener(key, value)
+
+
+class ConnectionManager(object):
+    """
+    Connections to a single local database file, shared by all LocalDB instances of this file.
 
-FREE_PLACES_UPDATE_INTERVAL = 5
+    Every thread gets its own connection, so readers of different threads never wait for each other in WAL mode.
+    Writes are serialized by writer lock, so threads of this process queue for it instead of failing
+    with "database is locked", and busy timeout covers writers of other connections to the same file
+    (e.g. QSqlDatabase of terminal configuration dialog).
+    In-memory database exists only within a single connection, so it's shared by all threads.
+    """
+    CHECKPOINT_PAGES = 256  # WAL is checkpointed into database after that many pages (1 MB by default) are written
+    JOURNAL_SIZE_LIMIT = 4 * 1024 * 1024  # bytes, WAL file is truncated to that size after checkpoint
+
+    def __init__(self, filename, busy_timeout=db_busy_timeout):
+        """
+        @param filename: str, sqlite database filename or :memory:
+        @param busy_timeout: float, seconds, how long writer waits for lock held by other connection
+        """
+        self.filename = filename
+        self.busy_timeout = busy_timeout
+        self.writer = RLock()
+        self.local = thread_local()
+        self.shared = None
+
+    def connect(self):
+        memory = self.filename == ':memory:'
+        conn = sqlite3.connect(self.filename, timeout=self.busy_timeout, isolation_level='DEFERRED',
+                               check_same_thread=not memory)
+        conn.row_factory = sqlite3.Row
+        conn.text_factory = str
+        if not memory:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA wal_autocheckpoint=%i' % (self.CHECKPOINT_PAGES,))
+            conn.execute('PRAGMA journal_size_limit=%i' % (self.JOURNAL_SIZE_LIMIT,))
+        return conn
+
+    def connection(self):
+        """
+        @return: sqlite3.Connection of current thread
+        """
+        if self.filename == ':memory:':
+            with self.writer:
+                if self.shared is None:
+                    self.shared = self.connect()
+                return self.shared
+
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = self.connect()
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """
+        Holds writer lock while connection of current thread executes write transaction.
+        Transaction is committed when block completes and rolled back when it raises exception.
+        """
+        with self.writer:
+            with self.connection() as c:
+                yield c
 
 
 class LocalDB(object):
@@ -136,35 +238,127 @@ class LocalDB(object):
         key text,
         value text
     );
+
+    create table if not exists outbox (
+        id integer primary key,
+        key text unique,
+        query text,
+        params text default '',
+        created text default (datetime(current_timestamp, 'localtime'))
+    );
+
+    create table if not exists card (
+        Card text,
+        id text,
+        Type text,
+        CardID text primary key,
+        DTreg text,
+        DTend text,
+        DTIn text,
+        DTOut text,
+        Name text,
+        SName text,
+        FName text,
+        Phone text,
+        GosNom text,
+        Model text,
+        Color text,
+        Status text,
+        TarifType text,
+        TarifPrice text,
+        TarifSumm text
+    );
+
+    create table if not exists card_generation (
+        id integer primary key,
+        generation integer
+    );
+    insert or ignore into card_generation(id, generation) values(0, 0);
+
+    create trigger if not exists card_insert after insert on card
+    begin
+        update card_generation set generation = generation + 1;
+    end;
+
+    create trigger if not exists card_update after update on card
+    begin
+        update card_generation set generation = generation + 1;
+    end;
+
+    create trigger if not exists card_delete after delete on card
+    begin
+        update card_generation set generation = generation + 1;
+    end;
+
+    create table if not exists event_counter (
+        EventName text,
+        Direction text,
+        card integer,
+        count integer,
+        primary key (EventName, Direction, card)
+    );
+    insert or ignore into event_counter
+        select EventName, Direction, Card is not null, count(*) from events group by 1, 2, 3;
+
+    create trigger if not exists event_counter_insert after insert on events
+    begin
+        insert or ignore into event_counter values(new.EventName, new.Direction, new.Card is not null, 0);
+        update event_counter set count = count + 1
+            where EventName = new.EventName and Direction = new.Direction and card = (new.Card is not null);
+    end;
+
+    create table if not exists payment_total (
+        id integer primary key,
+        summa integer
+    );
+    insert or ignore into payment_total(id, summa) select 0, coalesce(sum(Summa), 0) from payment;
+
+    create trigger if not exists payment_total_insert after insert on payment
+    begin
+        update payment_total set summa = summa + coalesce(new.Summa, 0);
+    end;
     """
 
+    option_stores = {}  # database filename -> OptionStore
+    option_stores_lock = Lock()
+    connection_managers = {}  # database filename -> ConnectionManager
+    connection_managers_lock = Lock()
+    writers = {}  # database filename -> LocalWriter
+    writers_lock = Lock()
+
     INIT_CONFIG_QUERY = ('insert into config(id,PlaceNum,FreeTime,'
                          'UserStr1,UserStr2,UserStr3,UserStr4,'
                          'UserStr5,UserStr6,UserStr7,UserStr8) '
                          'values(null,100,15,?,?,?,?,?,?,?,?)')
 
     def __init__(self, filename=None, initialize=False):
-        sqlite3.enable_shared_cache(True)
-
         if filename is None:
             filename = db_filename
 
         self.filename = filename
-        self.conn = sqlite3.connect(self.filename, isolation_level='DEFERRED')
-        self.conn.row_factory = sqlite3.Row
-        self.conn.text_factory = str
 
-        self.free_places_update_time = None
+        if self.filename == ':memory:':
+            self.options = OptionStore()
+            self.connections = ConnectionManager(self.filename)
+            self.writer = LocalWriter(self)
+        else:
+            with LocalDB.option_stores_lock:
+                self.options = LocalDB.option_stores.setdefault(self.filename, OptionStore())
+            with LocalDB.connection_managers_lock:
+                self.connections = LocalDB.connection_managers.setdefault(self.filename,
+                                                                          ConnectionManager(self.filename))
+            with LocalDB.writers_lock:
+                self.writer = LocalDB.writers.setdefault(self.filename, LocalWriter(self))
 
         if initialize:
             self.initialize()
 
     def initialize(self):
-        with self.conn as c:
+        with self.transaction() as c:
             c.executescript(LocalDB.script)
 
         if self.query('select count(*) from config')[0][0] == 0:
-            with self.conn as c:
+            with self.transaction() as c:
                 default_strings = _('CARD-SYSTEMS\n'
                                     'Kyiv\n'
                                     'Peremohy ave, 123\n'
@@ -180,72 +374,213 @@ class LocalDB(object):
 
     def set_option(self, key, value):
         print 'set_option', key, value
-        with self.conn as c:
-            cursor = c.cursor()
-            cursor.execute('update opt set value=? where key=?', (value, key))
-            if cursor.rowcount == 0:
-                c.execute('insert into opt(key,value) values(?,?)', (key, value))
+        self.options.set(self, key, value)
 
     def option(self, key):
-        with self.conn as c:
-            for row in c.execute('select value from opt where key=?', (key,)):
-                return row[0]
+        return self.options.load(self.conn).get(key)
 
     def all_options(self):
-        with self.conn as c:
-            return c.execute('select key,value from opt')
+        return self.options.load(self.conn).items()
+
+    def subscribe_options(self, listener):
+        """
+        @param listener: callable, that accepts key and value of option, which value has changed.
+                         It's called from the thread, which changed option.
+        """
+        with self.options.lock:
+            self.options.listeners.append(listener)
 
-    def get_db_addr(self):
-        return self.option('db.ip'), 101
+    DB_PORT = 101
+
+    def get_db_addrs(self):
+        """
+        @return: list of (host, port) tuples of remote database endpoints listed in db.ip option,
+                 the first one is primary (see endpoints module)
+        """
+        hosts = [host.strip() for host in self.option('db.ip').split(',')]
+        return [(host, self.DB_PORT) for host in hosts if host] or [('', self.DB_PORT)]
 
     def session_begin(self, card):
-        with self.conn as c:
+        with self.transaction() as c:
             c.execute('insert into session(sn, operator, access) values(?,?,?)', (card.sn, card.fio, card.access))
 
     def session(self):
-        with self.conn as c:
-            for row in c.execute('select sn,operator,access,begin,end from session '
-                                 'where id=(select max(id) from session)'):
-                return row
+        for row in self.conn.execute('select sn,operator,access,begin,end from session '
+                                     'where id=(select max(id) from session)'):
+            return row
 
     def session_end(self):
-        with self.conn as c:
+        self.flush()
+        with self.transaction() as c:
             c.execute('delete from payment')
             c.execute('delete from events')
+            c.execute('delete from event_counter')
+            c.execute('update payment_total set summa = 0')
             c.execute('update session set end=datetime(current_timestamp, "localtime")'
                       'where id=(select max(id) from session)')
 
+    def event_count(self, name, direction, card=False):
+        """
+        Session counters are kept by triggers on events table, so they don't depend on its size.
+        @param name: str, EventName
+        @param direction: str, Direction
+        @param card: bool, whether only events with Card should be counted
+        @return: int, amount of events of current session
+        """
+        return self.query('select coalesce(sum(count), 0) from event_counter '
+                          'where EventName = ? and Direction = ? and card >= ?', (name, direction, int(card)))[0][0]
+
+    def payment_sum(self):
+        """
+        @return: int, sum of payments of current session, in units of currency
+        """
+        return self.query('select summa/100 from payment_total')[0][0]
+
+    @property
+    def conn(self):
+        """
+        sqlite3.Connection of current thread, it should be used only for reading, see transaction.
+        """
+        return self.connections.connection()
+
     def connection(self):
         return self.conn
 
-    def query(self, q, *args):
-        cursor = self.conn.execute(q, *args)
+    def transaction(self):
+        """
+        @return: context manager, that provides connection of current thread for a single write transaction
+        """
+        return self.connections.transaction()
+
+    def flush(self):
+        """
+        Commits statements, that are pending in background writer, see local_writer module.
+        @return: bool, whether all of them have been committed
+        """
+        return self.writer.flush()
+
+    def query(self, q, params=(), flush=False):
+        """
+        @param flush: bool, whether statements pending in background writer should be committed first,
+                      so that result reflects them. It costs a commit, so reads of gate path don't do it.
+        """
+        if flush:
+            self.flush()
+        cursor = self.conn.execute(q, params)
         return [row for row in cursor]
 
-    def update_free_places(self, free_places):
-        with self.conn as c:
-            c.execute('update GStatus set PlaceFree=?', (free_places,))
-            self.free_places_update_time = measurement()
+    def execute(self, statements):
+        """
+        Executes given statements within a single transaction.
+        @param statements: list of (statement, parameters) tuples
+        """
+        with self.transaction() as c:
+            for q, params in statements:
+                c.execute(q, params)
 
-    def get_free_places(self):
-        if self.free_places_update_time is None:
-            return 0, False
+    def outbox_append(self, statements, local=False):
+        """
+        Appends statements to outbox, every one of them with its own unique idempotency key.
+        @param statements: list of (statement, parameters) tuples to be executed remotely
+        @param local: bool, whether statements should also be executed locally within the same transaction
+        """
+        with self.transaction() as c:
+            self.write_batches(c, [(statements, local, True)])
+
+    @staticmethod
+    def write_batches(c, batches):
+        """
+        Executes batches within transaction of given connection.
+        @param c: sqlite3.Connection, that holds write transaction
+        @param batches: list of (statements, local, outbox) tuples, see LocalWriter.append
+        """
+        for statements, local, outbox in batches:
+            if local:
+                for q, params in statements:
+                    c.execute(q, params)
+            if outbox:
+                c.executemany('insert into outbox(key, query, params) values(?,?,?)',
+                              [(uuid4().hex, q, encode_params(params)) for q, params in statements])
+
+    def outbox_head(self, limit):
+        """
+        @return: list of (id, key, statement, encoded parameters) rows, see protocol.decode_params
+        """
+        return self.query('select id, key, query, params from outbox order by id limit ?', (limit,))
+
+    def outbox_remove(self, last_id):
+        with self.transaction() as c:
+            c.execute('delete from outbox where id <= ?', (last_id,))
+
+    def outbox_size(self):
+        return self.query('select count(*) from outbox')[0][0]
+
+    CARD_FIELDS = 19
+
+    def card_generation(self):
+        """
+        Generation of card table, that changes after every modification of it, no matter which connection made it.
+        @return: int
+        """
+        return self.query('select generation from card_generation')[0][0]
 
-        return (self.query('select PlaceFree from GStatus')[0][0],
-                measurement() - self.free_places_update_time < FREE_PLACES_UPDATE_INTERVAL)
+    def get_cards(self):
+        return self.query('select * from card')
+
+    def add_card(self, fields):
+        with self.transaction() as c:
+            c.execute('insert or ignore into card values(%s)' % (','.join(('?',) * self.CARD_FIELDS),),
+                      fields[:self.CARD_FIELDS])
+
+    def update_cards(self, changed, removed):
+        """
+        Applies difference between remote and local cards.
+        Nothing is applied while outbox has pending statements, since remote cards do not reflect them yet.
+        @param changed: list of card fields lists, that are new or differ from local ones
+        @param removed: list of CardID of cards, that do not exist remotely anymore
+        @return: bool, whether difference has been applied
+        """
+        self.flush()
+        with self.transaction() as c:
+            c.executemany('replace into card values(%s)' % (','.join(('?',) * self.CARD_FIELDS),),
+                          [fields[:self.CARD_FIELDS] for fields in changed])
+            c.executemany('delete from card where CardID = ?', [(sn,) for sn in removed])
+            # checked after writing, when transaction already holds write lock, so no statement can sneak in
+            if c.execute('select count(*) from outbox').fetchone()[0]:
+                c.rollback()
+                return False
+        return True
+
+    def outbox_sum(self, q):
+        """
+        @param q: str, statement with a single numeric parameter
+        @return: int, sum of parameters of given statement over outbox, i.e. not replayed remotely yet
+        """
+        return sum(decode_params(params)[0] for params, in self.query('select params from outbox where query = ?',
+                                                                       (q,)))
+
+    def get_free_places(self):
+        return self.query('select PlaceFree from GStatus')[0][0]
 
     def update_terminals(self, terminals):
-        with self.conn as c:
+        """
+        @param terminals: iterable of (id, title) pairs, it is consumed only once,
+                          so it can be a generator that produces rows as they arrive from remote database.
+                          Rows are received before transaction begins, so other threads don't wait for them.
+        """
+        terminals = [tuple(t) for t in terminals]
+        ids = [t[0] for t in terminals]
+
+        with self.transaction() as c:
             c.executemany('insert into terminal_view(id, title) values(?,?)', terminals)
-            c.execute('delete from terminal where id not in (%s)' % (','.join(('?',) * len(terminals)),),
-                      [t[0] for t in terminals])
+            c.execute('delete from terminal where id not in (%s)' % (','.join(('?',) * len(ids)),), ids)
 
     def get_terminals(self):
         return self.query('select id,title,notify,option from terminal where display = 1')
 
     def update_tariffs(self, tariffs):
         try:
-            with self.conn as c:
+            with self.transaction() as c:
                 c.execute('delete from tariffs')
                 c.executemany('insert into tariffs values(?,?,?,?,?,?,?,?)', tariffs)
         except sqlite3.OperationalError as e:
@@ -260,7 +595,7 @@ class LocalDB(object):
         return self.query('select * from tariffs')
 
     def update_config(self, config):
-        with self.conn as c:
+        with self.transaction() as c:
             c.execute(('update config set Config=?,id=?,PlaceNum=?,FreeTime=?,PayTime=?,'
                       'TarifName1=?,TarifName2=?,TarifName3=?,TarifName4=?,'
                       'UserStr1=?,UserStr2=?,UserStr3=?,UserStr4=?,'
@@ -279,55 +614,311 @@ class LocalDB(object):
 
 class DB(QObject):
     free_places_update = pyqtSignal(int)
+    breaker_state = pyqtSignal(str)
 
     STRINGS_UPDATE_INTERVAL = 60  # seconds
+    TARIFFS_MAX_AGE = 60  # seconds
+    GATHER_TIMEOUT = 10  # seconds
 
     def __init__(self, notify=None, initialize_local_db=False, parent=None):
         QObject.__init__(self, parent)
 
         self.local = LocalDB(initialize=initialize_local_db)
-        self.addr = self.local.get_db_addr()
+        self.endpoints = Endpoints(self.local.get_db_addrs())
+        self.addr = self.endpoints.primary
+        self.pool = ConnectionPool()
+        self.cards = CardMirror(self.local)
+        self.feed = ChangeFeed(self)
+        self.feed.subscribe('card', self.cards.changed)
+        self.tariffs = TariffCache()
+        self.free_places = FreePlaces(self)
+        self.free_places.subscribe(self.free_places_update.emit)
+        self.breaker = CircuitBreaker()
+        self.breaker.subscribe(self.breaker_changed)
         self.notify = notify
+        self.written = Event()
+
+    def breaker_changed(self, state):
+        self.breaker_state.emit(state)
+        if not self.notify:
+            return
+        if state == CircuitBreaker.OPEN and self.breaker.failures == CircuitBreaker.FAILURE_THRESHOLD:
+            self.notify(_("Database Error"), _("Central database is unavailable, local data is used"))
+        elif state == CircuitBreaker.CLOSED:
+            self.notify(_("Notification"), _("Connection to central database is restored"))
+
+    @contextmanager
+    def remote(self):
+        """
+        Guards a single exchange with remote database by circuit breaker (see breaker module).
+        Timeouts caused by caller's own deadline (see deadlines module) don't mean that remote database
+        is unavailable, so they are not counted as failures.
+        @raise CircuitOpen: when breaker is open, exchange is not performed in that case
+        """
+        self.breaker.check()
+        try:
+            yield
+        except QueryFailed:
+            self.breaker.success()
+            raise
+        except socket.error as e:
+            if not (isinstance(e, DeadlineExceeded) or isinstance(e, socket.timeout) and expired()):
+                self.breaker.failure()
+            raise
+        self.breaker.success()
+
+    def probe(self):
+        """
+        Request, that is used to probe remote database, when it has been unavailable.
+        """
+        self.pool.request(self.addr, self.FREE_PLACES_QUERY)
 
-    @measure
-    def query(self, q, local=False):
+    @staticmethod
+    def describe(q, params=()):
+        """
+        @return: unicode, statement with its parameters, that can be shown to user
+        """
+        return (inline(q, params) if params else q).decode('utf8', errors='replace')
+
+    def query(self, q, params=(), local=False, budget=None, hedged=False):
         """
         This is a base function for communication with remote database.
-        @param q: str, query to be executed remotely
+        @param q: str, statement to be executed remotely, with '?' placeholders for its parameters
+        @param params: tuple of statement parameters
         @param local: bool, this argument defines whether given query will be duplicated on local database
+        @param budget: float, seconds, that query may take, e.g. deadlines.GATE.
+                       It can only shorten deadline of the caller, None means no additional limit.
+        @param hedged: bool, whether read-only query can be served by replicas (see endpoints module).
         @return: None when database returned correct NONE response
                  False when there was an error during database communication or error during query execution
                        Those cases are being explicitly notified using self.notify
                  list of string lists when database reponded with some data
         """
         if local:
-            with self.local.connection() as c:
-                c.execute(q)
+            self.local.writer.append([(q, params)], outbox=False)
 
+        begin = time()
         try:
-            s = socket.create_connection(self.addr, timeout=20)
-            s.send(q)
-            answer = s.recv(1024)
+            with deadline(budget):
+                status, rows = self.request(q, params, hedged)
+        except CircuitOpen:
+            return False
         except socket.error as e:
+            latency.record(statement_name(q), time() - begin, Histogram.outcome(e))
             print e.__class__.__name__, e
             if self.notify:
-                self.notify(_("Database Error"), q.decode('utf8', errors='replace'))
+                self.notify(_("Database Error"), self.describe(q, params))
             return False
 
-        if answer == 'FAIL':
-            self.notify(_("Query Error"), q.decode('utf8', errors='replace'))
+        latency.record(statement_name(q), time() - begin, Histogram.ERROR if status == FAIL else Histogram.OK)
+        if status == FAIL:
+            if self.notify:
+                self.notify(_("Query Error"), self.describe(q, params))
             return False
-        if answer == 'NONE':
+        if status == NONE:
             return None
 
-        return [line.split('|') for line in answer.split('\n')]
+        return rows
+
+    def request(self, q, params=(), hedged=False):
+        """
+        Low-level counterpart of query, that doesn't handle errors.
+        Hedged requests are guarded by health of every replica instead of circuit breaker.
+        @return: (status, rows) tuple
+        @raise socket.error
+        """
+        if hedged and len(self.endpoints) > 1:
+            return self.endpoints.hedge(lambda addr: self.pool.request(addr, q, params))
+        with self.remote():
+            return self.pool.request(self.addr, q, params)
+
+    def rows(self, q, params=()):
+        """
+        Streaming counterpart of query: remote rows are yielded as soon as they arrive.
+        NONE response yields nothing.
+        Errors are notified the same way query does it and then raised as socket.error,
+        so consumer can discard partially processed result.
+        @param q: str, statement to be executed remotely
+        @param params: tuple of statement parameters
+        """
+        begin = time()
+        outcome = Histogram.OK
+        try:
+            with self.remote(), self.pool.response(self.addr, q, params) as response:
+                if response.status == FAIL:
+                    raise QueryFailed(q)
+                if response.status == NONE:
+                    return
+                for row in response:
+                    yield row
+        except CircuitOpen:
+            outcome = None  # nothing has been sent
+            raise
+        except socket.error as e:
+            outcome = Histogram.outcome(e)
+            print e.__class__.__name__, e
+            if self.notify:
+                title = _("Query Error") if isinstance(e, QueryFailed) else _("Database Error")
+                self.notify(title, self.describe(q, params))
+            raise
+        finally:
+            if outcome is not None:
+                latency.record(statement_name(q), time() - begin, outcome)
+
+    def query_many(self, statements, local=False):
+        """
+        Executes several statements using a single exchange with remote database.
+        When remote database does not support batches, statements are executed one by one.
+        @param statements: list of (statement, parameters) tuples to be executed remotely
+        @param local: bool, this argument defines whether given queries will be duplicated on local database
+        @return: list of results, one per statement, every one of them is the same as query would return for it
+        """
+        if local:
+            self.local.writer.append(statements, outbox=False)
+
+        try:
+            results = self.request_many(statements)
+        except socket.error as e:
+            print e.__class__.__name__, e
+            if self.notify:
+                self.notify(_("Database Error"), u'\n'.join(self.describe(q, params) for q, params in statements))
+            return [False] * len(statements)
+
+        ret = []
+        for (q, params), (status, rows) in zip(statements, results):
+            if status == FAIL:
+                if self.notify:
+                    self.notify(_("Query Error"), self.describe(q, params))
+                ret.append(False)
+            else:
+                ret.append(None if status == NONE else rows)
+        return ret
+
+    def request_many(self, statements, keys=None, acknowledge=None):
+        """
+        Low-level counterpart of query_many, that doesn't handle errors.
+        @param statements: list of (statement, parameters) tuples
+        @param keys: list of idempotency keys, one per statement
+        @param acknowledge: callable, that is called with amount of leading statements, that have been executed,
+                            as soon as they are: once for a batch, after every statement when they are sent one by one
+        @return: list of (status, rows) tuples, one per statement
+        @raise socket.error
+        """
+        if keys is None:
+            keys = [None] * len(statements)
+        statements = [(q, params, key) for (q, params), key in zip(statements, keys)]
+
+        begin = time()
+        try:
+            with self.remote():
+                results = self.pool.request_many(self.addr, statements)
+                if results is not None:
+                    if acknowledge:
+                        acknowledge(len(results))
+                else:
+                    results = []
+                    for q, params, key in statements:
+                        results.append(self.pool.request(self.addr, q, params, key))
+                        if acknowledge:
+                            acknowledge(len(results))
+        except CircuitOpen:
+            raise
+        except socket.error as e:
+            latency.record('batch', time() - begin, Histogram.outcome(e))
+            raise
+
+        failed = any(status == FAIL for status, rows in results)
+        latency.record('batch', time() - begin, Histogram.ERROR if failed else Histogram.OK)
+        return results
+
+    def write_many(self, statements, local=False):
+        """
+        Schedules statements for execution on remote database without waiting for it.
+        Statements are stored in local outbox, that is replayed in background (see outbox module),
+        so this method only depends on local database. Outbox is the only copy of statements until they are
+        replayed, so they are committed before this method returns, together with writes pending
+        in background writer (see local_writer module).
+        @param statements: list of (statement, parameters) tuples to be executed remotely
+        @param local: bool, this argument defines whether given queries will be duplicated on local database
+        @return: bool, whether statements have been stored in outbox
+                 Failures are explicitly notified using self.notify
+        """
+        writer = self.local.writer
+        committed = writer.commit(statements, local)
+        if self.notify:
+            if writer.failed:
+                self.notify(_("Database Error"),
+                            _("Local database write failed, %i statements are kept for retry") % (writer.failed_size(),))
+            if not committed:
+                self.notify(_("Database Error"), u'\n'.join(self.describe(q, params) for q, params in statements))
+        if not committed:
+            return False
+        self.written.set()
+        return True
+
+    def write(self, q, params=(), local=False):
+        return self.write_many([(q, params)], local)
+
+    def gather(self, *calls, **kw):
+        """
+        Executes independent calls concurrently, every one of them in its own greenlet and so using
+        its own pooled connection, so together they cost a single round trip to remote database.
+        Calls inherit deadline of the caller.
+        @param calls: callables without arguments, usually DB methods
+        @param timeout: float, seconds, deadline for all calls together
+        @return: list of results of calls in the same order.
+                 Calls that have not completed before deadline are killed and their result is False,
+                 the same as DB methods return when remote database is unavailable.
+        """
+        timeout = kw.pop('timeout', self.GATHER_TIMEOUT)
+        greenlets = [spawn(bind(call)) for call in calls]
+        joinall(greenlets, timeout=timeout)
+
+        results = []
+        expired = 0
+        for greenlet in greenlets:
+            if not greenlet.ready():
+                greenlet.kill()
+                results.append(False)
+                expired += 1
+            elif not greenlet.successful():
+                raise greenlet.exception
+            else:
+                results.append(greenlet.value)
+
+        if expired and self.notify:
+            self.notify(_("Database Error"), _("%i of %i requests did not complete in time") % (expired, len(calls)))
+        return results
+
+    @staticmethod
+    def non_empty(rows):
+        """
+        Helper for streamed results, that have to be ignored when remote database returns nothing.
+        @param rows: iterator of rows
+        @return: iterator of the same rows or None when there are no rows
+        """
+        first = next(rows, None)
+        if first is not None:
+            return chain([first], rows)
 
     def get_card(self, sn):
+        """
+        Looks card up in local mirror, remote database is only queried for cards that mirror doesn't know yet.
+        @return: card.Card, None when there is no such card, False when remote database is unavailable
+        """
         apb = self.local.option('apb') == '2'
-        return Card.create(self.query('select * from card where CardID = "%s"' % (sn,)), apb=apb)
+        fields = self.cards.get(sn)
+        if fields is not None:
+            return Card.create([fields], apb=apb)
+
+        response = self.query('select * from card where CardID = ?', (sn,), hedged=True)
+        card = Card.create(response, apb=apb)
+        if card:
+            self.cards.add(response[0])
+        return card
 
     def get_ticket(self, bar):
-        return Ticket.create(self.query('select * from ticket where bar = "%s"' % (bar,)))
+        return Ticket.create(self.query('select * from ticket where bar = ?', (bar,), hedged=True))
 
     def get_terminals(self):
         return {
@@ -338,39 +929,87 @@ class DB(QObject):
         }
 
     def update_terminals(self):
-        ret = self.query('select terminal_id,title from terminal')
-        if ret:
-            self.local.update_terminals(ret)
+        """
+        @return: bool, whether terminals have been received from remote database
+        """
+        try:
+            terminals = self.non_empty(self.rows('select terminal_id,title from terminal'))
+            if terminals:
+                self.local.update_terminals(terminals)
+            return True
+        except socket.error:
+            return False
 
-    def get_tariffs(self):
+    def update_tariffs(self):
+        """
+        Receives tariffs from remote database, local ones are used when it's unavailable.
+        @return: bool, whether tariffs have been received from remote database
+        """
+        rows = self.query('select * from Tariff', hedged=True)
         free_time = self.get_free_time()
-        ret = self.query('select * from Tariff')
-        if ret:
-            self.local.update_tariffs(ret)
-        return filter(lambda x: x is not None, [Tariff.create(t, free_time) for t in self.local.get_tariffs()])
+        if rows:
+            if self.tariffs.update(rows, free_time):
+                self.local.update_tariffs(rows)
+            return True
+        self.tariffs.update(self.local.get_tariffs(), free_time)
+        return False
+
+    def get_tariffs(self, max_age=TARIFFS_MAX_AGE):
+        """
+        @param max_age: int, seconds, cached tariffs that have been checked for changes not earlier than that
+                        are returned without querying remote database
+        @return: list of tariff.Tariff, the same objects are returned until tariffs change
+        """
+        if not self.tariffs.fresh(max_age, self.get_free_time()):
+            self.update_tariffs()
+        return self.tariffs.tariffs
 
     def get_total_places(self):
         ret = self.query('select PlaceNum from config')
         return int(ret[0][0]) if ret else ret
 
-    def update_free_places(self, diff):
-        self.query('update GStatus set PlaceFree = PlaceFree + %i' % (diff,), local=True)
-        free_places, _ = self.local.get_free_places()
-        self.free_places_update.emit(free_places)
+    FREE_PLACES_QUERY = 'select PlaceFree from GStatus'
+
+    def accept_free_places(self, answer):
+        """
+        Stores amount of free places from remote database response locally.
+        @param answer: result of FREE_PLACES_QUERY execution
+        @return: int, amount of free places including changes that are not flushed yet
+                 or None when answer is incorrect
+        """
+        try:
+            free_places = int(answer[0][0])
+        except (IndexError, KeyError, ValueError, TypeError) as e:
+            print 'Incorrect response:', e.__class__.__name__, e
+            return None
+        self.free_places.refresh(free_places)
+        return self.free_places.get()
 
     def get_free_places(self):
-        free_places, valid = self.local.get_free_places()
-        if not valid:
-            answer = self.query('select PlaceFree from GStatus')
-            if answer is False:
-                return free_places
-            try:
-                free_places = int(answer[0][0])
-                self.local.update_free_places(free_places)
-                self.free_places_update.emit(free_places)
-            except (IndexError, KeyError, ValueError, TypeError) as e:
-                print 'Incorrect response:', e.__class__.__name__, e
-        return free_places
+        """
+        @return: int, amount of free places, remote database is queried only when local value is outdated
+        """
+        if not self.free_places.fresh():
+            answer = self.query(self.FREE_PLACES_QUERY)
+            if answer is not False:
+                self.accept_free_places(answer)
+        return self.free_places.get()
+
+    def register_passes(self, addr, in_count, out_count):
+        """
+        Generates pass events for cars that moved through terminal and adjusts free places counter.
+        Pass events are written to outbox at once, while changes of counter by all terminals are accumulated
+        and written as a single delta (see free_places module), so counter is broadcast to terminals once
+        per flush instead of once per pass.
+        @param addr: int, terminal address
+        @param in_count: int, amount of cars that moved inside
+        @param out_count: int, amount of cars that moved outside
+        """
+        statements = [self.pass_event_query(addr, inside=False)] * out_count
+        statements += [self.pass_event_query(addr, inside=True)] * in_count
+        if statements:
+            self.write_many(statements, local=True)
+            self.free_places.add(out_count - in_count)
 
     reasons = {
         1: _('manual').encode('utf8', errors='replace'),
@@ -387,24 +1026,40 @@ class DB(QObject):
         now = datetime.now().strftime(DATETIME_FORMAT)
 
         args = (event_name, now, addr, reason)
-        return self.query('insert into events values("Event",NULL,"%s","%s",%i,"","%s", \
-                          (select PlaceFree from GStatus),"","")' % args, local=True)
+        return self.write('insert into events values("Event",NULL,?,?,?,"",?,'
+                          '(select PlaceFree from GStatus),"","")', args, local=True)
 
-    PASS_QUERY = ('insert into events values("Event",NULL,"{0}","%s",%i,"%s","",\
-                  (select PlaceFree from GStatus),%s,"")'.format(_('pass').encode('utf8', errors='replace')))
+    PASS_QUERY = 'insert into events values("Event",NULL,?,?,?,?,"",(select PlaceFree from GStatus),?,"")'
+    PASS_NAME = _('pass').encode('utf8', errors='replace')
 
-    def generate_pass_event(self, addr, inside, sn=None):
+    def pass_event_query(self, addr, inside, sn=None):
+        """
+        @return: tuple of statement and its parameters
+        """
         direction_name = (_('inside') if inside else _('outside')).encode('utf8', errors='replace')
         now = datetime.now().strftime(DATETIME_FORMAT)
-        args = (now, addr, direction_name, '"%s"' % (sn,) if sn else 'null')
+        return self.PASS_QUERY, (self.PASS_NAME, now, addr, direction_name, sn or None)
 
-        return self.query(self.PASS_QUERY % args, local=True)
+    def generate_pass_event(self, addr, inside, sn=None):
+        q, params = self.pass_event_query(addr, inside, sn)
+        return self.write(q, params, local=True)
 
     def update_config(self):
-        self.addr = self.local.get_db_addr()
+        """
+        @return: bool, whether config has been received from remote database
+        """
+        addrs = self.local.get_db_addrs()
+        if addrs != self.endpoints.addrs:
+            for addr in set(self.endpoints.addrs) - set(addrs):
+                self.pool.discard(addr)
+            self.endpoints = Endpoints(addrs)
+            if self.endpoints.primary != self.addr:
+                self.addr = self.endpoints.primary
+                self.breaker.reset()
         response = self.query('select * from Config')
         if response:
             self.local.update_config(response)
+        return response is not False
 
     def get_config_strings(self):
         return self.local.get_config_strings()
@@ -418,16 +1073,17 @@ class DB(QObject):
                                   'STOP-Park\n'
                                   '<hr />\n') + u'\n'.join(self.get_config_strings()[:4]) + u'\n<hr /></c>\n'
 
-    PAYMENT_QUERY = 'insert into Payment values(NULL, "{payment}", {tariff}, {console}, "{operator}", \
-                     "{now}", "{id}", {status}, {tariff}, {cost}*100, {units}, "{begin}", "{end}", {price}*100)'
+    PAYMENT_QUERY = 'insert into Payment values(NULL, ?, ?, ?, ?, ?, ?, ?, ?, ?*100, ?, ?, ?, ?*100)'
 
     def generate_payment(self, db_payment_args):
         session = self.local.session()
         operator = session[1] if session is not None else '?'
         now = datetime.now().strftime(DATETIME_FORMAT)
 
-        return self.query(self.PAYMENT_QUERY.format(console=0, operator=operator, status=Ticket.PAID,
-                                                    now=now, **db_payment_args), local=True) is None
+        a = db_payment_args
+        params = (a['payment'], a['tariff'], 0, operator, now, a['id'], Ticket.PAID, a['tariff'], a['cost'],
+                  a['units'], str(a['begin']), str(a['end']), a['price'])
+        return self.write(self.PAYMENT_QUERY, params, local=True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,84 @@
+# coding=utf-8
+"""
+Deadlines of remote database requests.
+
+Requests differ in how long their callers can wait: a car is waiting at gate while access is being checked,
+cashier is waiting for ticket or payment, and nobody is waiting for background synchronization.
+Caller sets a budget for everything it does using deadline context manager, and every remote exchange
+started within it (no matter how deeply nested, e.g. get_free_places called by TerminalCounters) gets
+socket timeout limited by the time left. Nested deadlines can only make the budget shorter.
+
+Deadline belongs to current greenlet, greenlets that do some work on behalf of it should be started
+with bind, so they inherit it. Without deadline requests use default timeout of connection pool.
+"""
+from gevent import socket
+from gevent.local import local
+from contextlib import contextmanager
+from time import time
+
+GATE = 0.3  # seconds, access check at terminal
+CASHIER = 5  # seconds, operations of cashier
+BACKGROUND = None  # background synchronization is limited by connection pool timeout only
+
+_context = local()
+
+
+class DeadlineExceeded(socket.timeout):
+    pass
+
+
+def current():
+    """
+    @return: float, absolute deadline of current greenlet or None when there is no deadline
+    """
+    return getattr(_context, 'deadline', None)
+
+
+@contextmanager
+def deadline(budget):
+    """
+    @param budget: float, seconds, that can be spent within block, or None for no additional limit
+    """
+    previous = current()
+    value = time() + budget if budget is not None else None
+    if value is None or (previous is not None and previous < value):
+        value = previous
+    _context.deadline = value
+    try:
+        yield
+    finally:
+        _context.deadline = previous
+
+
+def remaining(default):
+    """
+    @param default: float, seconds, timeout to be used when there is no deadline
+    @return: float, seconds left before deadline, but not more than default
+    @raise DeadlineExceeded: when deadline has already passed
+    """
+    value = current()
+    if value is None:
+        return default
+    left = value - time()
+    if left <= 0:
+        raise DeadlineExceeded('deadline exceeded')
+    return min(left, default)
+
+
+def expired():
+    value = current()
+    return value is not None and time() >= value
+
+
+def bind(f):
+    """
+    @param f: callable, that will be executed in another greenlet
+    @return: callable, that executes f with deadline of current greenlet
+    """
+    value = current()
+
+    def wrapper(*args, **kw):
+        _context.deadline = value
+        return f(*args, **kw)
+
+    return wrapper
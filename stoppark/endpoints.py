@@ -0,0 +1,131 @@
+# coding=utf-8
+"""
+Replicas of remote database.
+
+Option db.ip may list several addresses of remote database separated by commas. The first one is primary:
+every write and ordinary query is sent to it and it's guarded by circuit breaker (see breaker module).
+The rest are replicas, that can only serve reads.
+
+Health and latency of every endpoint are tracked by Endpoints. Reads, that a car or cashier is waiting for
+(access checks, tickets, tariffs), are hedged: request is sent to the fastest healthy endpoint and when it
+doesn't respond within HEDGE_DELAY (or fails), the same request is sent to the next one. The first response wins,
+the other request is cancelled. So a single slow or unavailable endpoint doesn't slow reads down.
+Endpoint, that has failed FAILURE_THRESHOLD times in a row, is not used for RETRY_INTERVAL.
+"""
+from gevent import socket, spawn, wait, GreenletExit
+from time import time
+from deadlines import expired, bind
+from breaker import CircuitOpen
+
+
+class Endpoint(object):
+    SMOOTHING = 0.2  # weight of the latest latency in moving average
+    FAILURE_THRESHOLD = 3  # consecutive failures
+    RETRY_INTERVAL = 5  # seconds
+
+    def __init__(self, addr):
+        self.addr = addr
+        self.latency = None  # seconds, moving average, None until the first response
+        self.failures = 0
+        self.failed_at = None
+
+    def __repr__(self):
+        return 'Endpoint(%r, latency=%r, failures=%i)' % (self.addr, self.latency, self.failures)
+
+    def success(self, seconds):
+        self.failures = 0
+        self.measure(seconds)
+
+    def measure(self, seconds):
+        if self.latency is None:
+            self.latency = seconds
+        else:
+            self.latency += self.SMOOTHING * (seconds - self.latency)
+
+    def failure(self):
+        self.failures += 1
+        self.failed_at = time()
+
+    def available(self, now=None):
+        if self.failures < self.FAILURE_THRESHOLD:
+            return True
+        return (now or time()) - self.failed_at >= self.RETRY_INTERVAL
+
+
+class Endpoints(object):
+    HEDGE_DELAY = 0.1  # seconds
+
+    def __init__(self, addrs):
+        """
+        @param addrs: list of (host, port) tuples, the first one is primary
+        """
+        self.endpoints = [Endpoint(addr) for addr in addrs]
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    @property
+    def addrs(self):
+        return [endpoint.addr for endpoint in self.endpoints]
+
+    @property
+    def primary(self):
+        return self.endpoints[0].addr
+
+    def ordered(self):
+        """
+        @return: list of available endpoints, the fastest first.
+                 Endpoints without known latency go first, so they are measured.
+        """
+        now = time()
+        available = [endpoint for endpoint in self.endpoints if endpoint.available(now)]
+        return sorted(available, key=lambda endpoint: endpoint.latency or 0)
+
+    @staticmethod
+    def attempt(endpoint, request):
+        begin = time()
+        try:
+            result = request(endpoint.addr)
+        except GreenletExit:
+            # request, that has lost the race, has taken at least that long
+            endpoint.measure(time() - begin)
+            raise
+        except socket.error as e:
+            # timeout caused by caller's own deadline says nothing about endpoint
+            if not (isinstance(e, socket.timeout) and expired()):
+                endpoint.failure()
+            raise
+        endpoint.success(time() - begin)
+        return result
+
+    def hedge(self, request):
+        """
+        Performs read using at most two endpoints, the second one is only used when the first one
+        doesn't respond within HEDGE_DELAY or fails.
+        @param request: callable, that accepts address of endpoint and performs exchange with it
+        @return: result of the first successful request
+        @raise socket.error: error of the last request, when every one of them failed
+        @raise CircuitOpen: when there are no available endpoints
+        """
+        candidates = self.ordered()[:2]
+        if not candidates:
+            raise CircuitOpen('remote database replicas are unavailable')
+
+        pending = [spawn(bind(self.attempt), candidates[0], request)]
+        if len(candidates) > 1:
+            pending[0].join(self.HEDGE_DELAY)
+            if not pending[0].successful():
+                pending.append(spawn(bind(self.attempt), candidates[1], request))
+
+        try:
+            while True:
+                done = [greenlet for greenlet in pending if greenlet.ready()] or wait(pending, count=1)
+                greenlet = done[0]
+                pending.remove(greenlet)
+                if greenlet.successful():
+                    return greenlet.value
+                if not pending:
+                    raise greenlet.exception
+        finally:
+            for greenlet in pending:
+                greenlet.kill()
@@ -5,9 +5,12 @@ from gevent import spawn, sleep, get_hub
 from gevent.queue import Queue
 from safe_socket import SafeSocket
 from report import Report
+from outbox import Outbox
+from latency import latency
 from db import DB, Ticket, Card
+from deadlines import deadline, CASHIER
 from datetime import datetime
-from config import DISPLAY_PEER, TICKET_PEER, CARD_PEER, PRINTER_PEER
+from config import DISPLAY_PEER, TICKET_PEER, CARD_PEER, PRINTER_PEER, latency_filename
 from i18n import language
 _ = language.ugettext
 
@@ -44,7 +47,8 @@ class TicketReader(object):
                 bar = match.group('bar')
                 if len(bar) < 18:
                     continue
-                self.handle_bar(bar, db)
+                with deadline(CASHIER):
+                    self.handle_bar(bar, db)
 
             buf = buf[last_index:]
 
@@ -89,7 +93,8 @@ class CardReader(object):
                 last_index = match.span()[1]
                 bar = match.group('sn')
 
-                self.handle_card(bar, db)
+                with deadline(CASHIER):
+                    self.handle_card(bar, db)
 
             buf = buf[last_index:]
 
@@ -154,6 +159,7 @@ class Executor(QObject):
     session_end = pyqtSignal()
     report = pyqtSignal(object)
     option_notification = pyqtSignal(str, str)
+    db_state = pyqtSignal(str)
 
     def __init__(self, parent=None):
         QObject.__init__(self, parent)
@@ -162,16 +168,56 @@ class Executor(QObject):
         self.db = None
         self.queue = None
         self._card = None
+        self.tariffs = None
+        self.outbox = Outbox()
 
         self.display_loop = DisplayLoop(DISPLAY_PEER)
         self.ticket_reader = TicketReader(TICKET_PEER, self.new_payable)
         self.card_reader = CardReader(CARD_PEER, self.new_payable, self.new_operator)
 
     def _tariff_updater(self):
+        """
+        Polls tariffs while remote database has no change log, see change_feed module.
+        """
         while True:
-            self.tariffs_updated.emit(self.db.get_tariffs())
+            if not self.db.feed.active:
+                self.emit_tariffs()
             sleep(60)
 
+    def emit_tariffs(self, force=False):
+        """
+        @param force: bool, whether tariffs should be emitted even when they have not changed
+        @return: bool, whether tariffs have been received from remote database, local ones are emitted otherwise
+        """
+        received = self.db.update_tariffs()
+        tariffs = self.db.tariffs.tariffs
+        if force or tariffs is not self.tariffs:
+            self.tariffs = tariffs
+            self.tariffs_updated.emit(tariffs)
+        return received
+
+    def _config_changed(self, keys):
+        if not self.db.update_config():
+            return False
+        # tariffs depend on free time, that is a part of config
+        return self.emit_tariffs()
+
+    def _terminals_changed(self, keys):
+        terminals = self.db.get_terminals()
+        received = self.db.update_terminals()
+        if self.db.get_terminals() != terminals:
+            self.emit_terminals_notification()
+        return received
+
+    @staticmethod
+    def _latency_exporter():
+        while True:
+            sleep(latency.EXPORT_INTERVAL)
+            try:
+                latency.export(latency_filename)
+            except IOError as e:
+                print 'Cannot export latency:', e
+
     def _async_processor(self):
         hub = get_hub()
         while True:
@@ -183,8 +229,20 @@ class Executor(QObject):
 
         self.queue = Queue()
         self.db = DB(notify=lambda title, msg: self.notify.emit(title, msg), initialize_local_db=True)
+        self.db.local.subscribe_options(self.option_notification.emit)
+        self.db.breaker_state.connect(self.db_state.emit)
 
         spawn(self._async_processor)
+        spawn(self.outbox, self.db)
+        self.db.feed.subscribe('Tariff', lambda keys: self.emit_tariffs())
+        self.db.feed.subscribe('Config', self._config_changed)
+        self.db.feed.subscribe('terminal', self._terminals_changed)
+
+        spawn(self.db.feed.run)
+        spawn(self._tariff_updater)
+        spawn(self.db.cards.run, self.db)
+        spawn(self.db.breaker.run, self.db.probe)
+        spawn(self._latency_exporter)
         spawn(self.ticket_reader, self.db)
         spawn(self.card_reader, self.db)
         spawn(self.display_loop)
@@ -201,11 +259,13 @@ class Executor(QObject):
 
             if action is not None:
                 if callable(action):
-                    action()
+                    with deadline(CASHIER):
+                        action()
             else:
                 #[greenlet.kill() for greenlet in greenlets]
                 break
 
+        self.db.local.flush()
         print 'reader loop completed'
 
     def start(self):
@@ -251,7 +311,7 @@ class Executor(QObject):
 
     @async
     def update_tariffs(self):
-        self.tariffs_updated.emit(self.db.get_tariffs())
+        self.emit_tariffs(force=True)
 
     def emit_terminals_notification(self):
         self.terminals_notification.emit(self.db.get_terminals())
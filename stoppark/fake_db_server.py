@@ -0,0 +1,370 @@
+# coding=utf-8
+"""
+Stand-in for the central database server, that can be used to test and benchmark panel on a single machine.
+
+It speaks the same protocol (see protocol module) and keeps its tables in sqlite database.
+Legacy mode imitates old servers: request lasts until client shuts down writing side of connection,
+response lasts until server closes connection. Otherwise server also understands framed requests,
+batches, prepared statements and idempotency keys.
+
+Changes of Tariff, Config, terminal and card tables are logged into change_log table by triggers,
+central database is expected to maintain the same log for change feed (see change_feed module).
+
+Latency, its jitter and failures can be injected into every response, e.g.:
+    python fake_db_server.py --db /tmp/central.db --seed --latency 0.05 --jitter 0.02 --fail-rate 0.01
+and then 127.0.0.1 can be set as DB server IP in Config tab.
+"""
+from gevent import sleep
+from gevent.server import StreamServer
+from protocol import Stream, NONE, FAIL, LENGTH_PREFIX, BATCH_PREFIX, PREPARE_PREFIX, EXECUTE_PREFIX, CHUNK_SIZE
+from protocol import ProtocolError, ConnectionClosed, encode_request, decode_params
+from random import random, uniform
+import sqlite3
+import socket
+import re
+
+PORT = 101
+
+
+class FakeDBServer(object):
+    script = """
+    create table if not exists ticket (
+        Ticket text default "Ticket",
+        id integer primary key,
+        bar text unique,
+        typetarif integer,
+        pricetarif text,
+        summ integer,
+        summdopl integer,
+        timein text,
+        timeout text,
+        TimeCount text,
+        timedopl text,
+        status integer
+    );
+    create table if not exists card (
+        Card text default "Card",
+        id integer primary key,
+        Type integer,
+        CardID text unique,
+        DTreg text,
+        DTend text,
+        DTIn text,
+        DTOut text,
+        Name text,
+        SName text,
+        FName text,
+        Phone text,
+        GosNom text,
+        Model text,
+        Color text,
+        Status integer,
+        TarifType integer,
+        TarifPrice integer,
+        TarifSumm integer
+    );
+    create table if not exists Tariff (
+        id integer primary key,
+        name text,
+        type integer,
+        interval integer,
+        cost text,
+        zerotime text,
+        maxperday text,
+        note text
+    );
+    create table if not exists Config (
+        Config text default "Config",
+        id integer primary key,
+        PlaceNum integer,
+        FreeTime integer,
+        PayTime text,
+        TarifName1 text,
+        TarifName2 text,
+        TarifName3 text,
+        TarifName4 text,
+        UserStr1 text,
+        UserStr2 text,
+        UserStr3 text,
+        UserStr4 text,
+        UserStr5 text,
+        UserStr6 text,
+        UserStr7 text,
+        UserStr8 text
+    );
+    create table if not exists GStatus (
+        id integer primary key,
+        PlaceFree integer
+    );
+    create table if not exists events (
+        event text not null default "Event",
+        id integer primary key,
+        EventName text,
+        DateTime text,
+        Terminal integer,
+        Direction text,
+        Reason text,
+        FreePlaces integer,
+        Card text,
+        GosNom text
+    );
+    create table if not exists Payment (
+        id integer primary key,
+        payment text,
+        type integer,
+        kassa integer,
+        operator text,
+        DTime text,
+        TalonID text,
+        Status integer,
+        TarifType integer,
+        Tarif integer,
+        TarifKol integer,
+        DTIn text,
+        DTOut text,
+        Summa integer
+    );
+    create table if not exists terminal (
+        terminal_id integer primary key,
+        title text
+    );
+    create table if not exists executed_key (
+        key text primary key
+    );
+    create table if not exists change_log (
+        id integer primary key autoincrement,
+        TableName text,
+        RowKey text
+    );
+    create trigger if not exists Tariff_insert_log after insert on Tariff begin
+        insert into change_log(TableName, RowKey) values('Tariff', new.id);
+    end;
+    create trigger if not exists Tariff_update_log after update on Tariff begin
+        insert into change_log(TableName, RowKey) values('Tariff', old.id);
+        insert into change_log(TableName, RowKey) select 'Tariff', new.id where new.id is not old.id;
+    end;
+    create trigger if not exists Tariff_delete_log after delete on Tariff begin
+        insert into change_log(TableName, RowKey) values('Tariff', old.id);
+    end;
+    create trigger if not exists Config_insert_log after insert on Config begin
+        insert into change_log(TableName, RowKey) values('Config', new.id);
+    end;
+    create trigger if not exists Config_update_log after update on Config begin
+        insert into change_log(TableName, RowKey) values('Config', old.id);
+        insert into change_log(TableName, RowKey) select 'Config', new.id where new.id is not old.id;
+    end;
+    create trigger if not exists Config_delete_log after delete on Config begin
+        insert into change_log(TableName, RowKey) values('Config', old.id);
+    end;
+    create trigger if not exists terminal_insert_log after insert on terminal begin
+        insert into change_log(TableName, RowKey) values('terminal', new.terminal_id);
+    end;
+    create trigger if not exists terminal_update_log after update on terminal begin
+        insert into change_log(TableName, RowKey) values('terminal', old.terminal_id);
+        insert into change_log(TableName, RowKey) select 'terminal', new.terminal_id where new.terminal_id is not old.terminal_id;
+    end;
+    create trigger if not exists terminal_delete_log after delete on terminal begin
+        insert into change_log(TableName, RowKey) values('terminal', old.terminal_id);
+    end;
+    create trigger if not exists card_insert_log after insert on card begin
+        insert into change_log(TableName, RowKey) values('card', new.CardID);
+    end;
+    create trigger if not exists card_update_log after update on card begin
+        insert into change_log(TableName, RowKey) values('card', old.CardID);
+        insert into change_log(TableName, RowKey) select 'card', new.CardID where new.CardID is not old.CardID;
+    end;
+    create trigger if not exists card_delete_log after delete on card begin
+        insert into change_log(TableName, RowKey) values('card', old.CardID);
+    end;
+    """
+
+    seed_script = """
+    insert or ignore into Config values("Config", 1, 100, 15, "None", "Hourly", "Daily", "Once", "Monthly",
+        "CARD-SYSTEMS", "Kyiv", "Peremohy ave, 123", "(+380 44) 284 0888", "", "", "", "");
+    insert or ignore into GStatus values(0, 100);
+    insert or ignore into Tariff values(1, "Hourly", 1, 1, "10", "None", "None", "");
+    insert or ignore into Tariff values(2, "Dynamic", 2, 1, "5 10 15 20", "None", "100", "");
+    insert or ignore into Tariff values(3, "Monthly subscription", 6, 3, "300", "None", "None", "");
+    insert or ignore into terminal values(1, "Entry");
+    insert or ignore into terminal values(2, "Exit");
+    insert or ignore into card values("Card", 1, 2, "E7008D750C", "14-01-01", "30-12-31", "None", "None",
+        "Ivan", "Ivanovich", "Ivanov", "None", "AA0001AA", "None", "None", 5, 3, 30000, 30000);
+    insert or ignore into card values("Card", 2, 3, "2A00D146C0", "14-01-01", "30-12-31", "None", "None",
+        "Petr", "Petrovich", "Petrov", "None", "None", "None", "None", 5, NULL, NULL, NULL);
+    """
+
+    KEY = re.compile(r'^/\*key:(?P<key>[^*]+)\*/ ')
+
+    def __init__(self, filename=':memory:', legacy=False, latency=0, jitter=0, fail_rate=0, drop_rate=0,
+                 seed=False):
+        """
+        @param filename: str, sqlite database to keep tables in
+        @param legacy: bool, whether server should imitate legacy servers
+        @param latency: float, seconds, delay of every response
+        @param jitter: float, seconds, maximum random deviation of delay
+        @param fail_rate: float, probability of responding FAIL to statement without executing it
+        @param drop_rate: float, probability of closing connection instead of responding to request
+        @param seed: bool, whether tables should be filled with sample data
+        """
+        self.legacy = legacy
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_rate = fail_rate
+        self.drop_rate = drop_rate
+        self.requests = 0
+
+        self.conn = sqlite3.connect(filename)
+        self.conn.text_factory = str
+        self.conn.executescript(self.script)
+        if seed:
+            self.conn.executescript(self.seed_script)
+        self.conn.commit()
+
+        self.server = None
+
+    @staticmethod
+    def field(value):
+        return 'None' if value is None else str(value)
+
+    def execute(self, q, params=(), key=None):
+        """
+        Executes statement and makes response payload for it.
+        Changes are not committed, so several statements can be executed within a single transaction.
+        @return: str
+        """
+        if key is None and not self.legacy:
+            match = self.KEY.match(q)
+            if match:
+                key = match.group('key')
+
+        if self.fail_rate and random() < self.fail_rate:
+            return FAIL
+        try:
+            if key is not None and self.conn.execute('select 1 from executed_key where key = ?', (key,)).fetchone():
+                return NONE
+            rows = self.conn.execute(q, params).fetchall()
+            if key is not None:
+                self.conn.execute('insert into executed_key values(?)', (key,))
+        except sqlite3.Error as e:
+            print 'FAIL', e, q, params
+            return FAIL
+
+        if not rows:
+            return NONE
+        return '\n'.join('|'.join(self.field(value) for value in row) for row in rows)
+
+    def execute_payload(self, payload, prepared):
+        """
+        @param payload: str, a single framed request
+        @param prepared: dict, handle -> statement template, prepared on current connection
+        @return: str, response payload
+        """
+        if payload.startswith(PREPARE_PREFIX):
+            handle, q = payload[1:].split('\n', 1)
+            prepared[handle] = q
+            return NONE
+        if payload.startswith(EXECUTE_PREFIX):
+            header, params = payload[1:].split('\n', 1)
+            handle, _, key = header.partition(':')
+            if handle not in prepared:
+                return FAIL
+            return self.execute(prepared[handle], decode_params(params), key or None)
+        return self.execute(payload)
+
+    def respond(self, sock, payload):
+        self.delay()
+        self.conn.commit()
+        sock.sendall(payload if self.legacy else encode_request(payload))
+
+    def delay(self):
+        delay = self.latency + (uniform(-self.jitter, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            sleep(delay)
+
+    @staticmethod
+    def read_frame(stream):
+        length = stream.read_header(LENGTH_PREFIX)
+        if length is None:
+            return None
+        data = ''
+        while len(data) < length:
+            chunk = stream.read(min(CHUNK_SIZE, length - len(data)))
+            if chunk == '':
+                raise ProtocolError('connection closed in the middle of request')
+            data += chunk
+        return data
+
+    def handle(self, sock, addr):
+        stream = Stream(sock)
+        prepared = {}
+        try:
+            while True:
+                payload = None if self.legacy else self.read_frame(stream)
+                raw = payload is None
+                if raw:
+                    # raw request lasts until client shuts down writing side
+                    payload = ''
+                    chunk = stream.read(CHUNK_SIZE)
+                    while chunk:
+                        payload += chunk
+                        chunk = stream.read(CHUNK_SIZE)
+
+                self.requests += 1
+                if self.drop_rate and random() < self.drop_rate:
+                    break
+
+                if payload.startswith(BATCH_PREFIX) and not self.legacy:
+                    batch = Stream(None)
+                    batch.unread(payload)
+                    count = batch.read_header(BATCH_PREFIX)
+                    responses = [self.execute_payload(self.read_frame(batch), prepared) for _ in range(count)]
+                    self.delay()
+                    self.conn.commit()
+                    sock.sendall('%s%i\n%s' % (BATCH_PREFIX, count, ''.join(encode_request(r) for r in responses)))
+                else:
+                    self.respond(sock, self.execute_payload(payload, prepared))
+
+                if raw:
+                    break
+        except ConnectionClosed:
+            pass
+        except (socket.error, ProtocolError, ValueError) as e:
+            print 'Connection error:', e.__class__.__name__, e
+        finally:
+            sock.close()
+
+    def start(self, host='127.0.0.1', port=PORT):
+        """
+        Starts serving in background.
+        @return: int, port server listens at
+        """
+        self.server = StreamServer((host, port), self.handle)
+        self.server.start()
+        return self.server.server_port
+
+    def stop(self):
+        if self.server is not None:
+            self.server.stop()
+            self.server = None
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description='Stand-in for the central database server.')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=PORT)
+    parser.add_argument('--db', default=':memory:', help='sqlite database file')
+    parser.add_argument('--seed', action='store_true', help='fill tables with sample data')
+    parser.add_argument('--legacy', action='store_true', help='imitate server without protocol extensions')
+    parser.add_argument('--latency', type=float, default=0, help='response delay, seconds')
+    parser.add_argument('--jitter', type=float, default=0, help='maximum random deviation of delay, seconds')
+    parser.add_argument('--fail-rate', type=float, default=0, help='probability of FAIL response')
+    parser.add_argument('--drop-rate', type=float, default=0, help='probability of dropped connection')
+    args = parser.parse_args()
+
+    server = FakeDBServer(args.db, legacy=args.legacy, latency=args.latency, jitter=args.jitter,
+                          fail_rate=args.fail_rate, drop_rate=args.drop_rate, seed=args.seed)
+    server.server = StreamServer((args.host, args.port), server.handle)
+    print 'Serving at %s:%i' % (args.host, args.port)
+    server.server.serve_forever()
@@ -0,0 +1,95 @@
+# coding=utf-8
+"""
+Free places counter of a single DB instance.
+
+Every pass through a terminal changes amount of free places. Pass events themselves are written to outbox
+right away, but instead of sending every change of the counter to remote database and broadcasting it
+to all terminals, changes are accumulated in memory and flushed at most once per FLUSH_INTERVAL
+as a single delta statement, that is sent to remote database through outbox.
+
+In-memory value is authoritative for this panel. It's refreshed from remote database only when it's older than
+UPDATE_INTERVAL. Remote value doesn't include deltas, that are still pending in outbox, nor deltas, that are not
+flushed yet, so both are added to it. Refreshed value is written locally through the same background writer
+as deltas, so later deltas are applied on top of it.
+"""
+from gevent import spawn_later
+from time import time
+
+
+class FreePlaces(object):
+    FLUSH_INTERVAL = 0.5  # seconds
+    UPDATE_INTERVAL = 5  # seconds
+    DELTA_QUERY = 'update GStatus set PlaceFree = PlaceFree + ?'
+    VALUE_QUERY = 'update GStatus set PlaceFree = ?'
+
+    def __init__(self, db):
+        """
+        @param db: db.DB, that flushed statements are written through
+        """
+        self.db = db
+        self.value = None
+        self.update_time = None
+        self.delta = 0
+        self.flusher = None
+        self.listeners = []
+        self.notified = None
+
+    def subscribe(self, listener):
+        """
+        @param listener: callable, that is called with amount of free places when it changes
+        """
+        self.listeners.append(listener)
+
+    def notify(self):
+        if self.value == self.notified:
+            return
+        self.notified = self.value
+        for listener in self.listeners:
+            listener(self.value)
+
+    def get(self):
+        """
+        @return: int, amount of free places known to this panel, it doesn't touch remote database
+        """
+        if self.value is None:
+            self.value = self.db.local.get_free_places()
+        return self.value
+
+    def fresh(self):
+        return self.update_time is not None and time() - self.update_time < self.UPDATE_INTERVAL
+
+    def refresh(self, remote):
+        """
+        @param remote: int, amount of free places received from remote database
+        """
+        local = self.db.local
+        local.flush()  # deltas committed by writer meanwhile are in outbox then
+        remote += local.outbox_sum(self.DELTA_QUERY)
+        local.writer.append([(self.VALUE_QUERY, (remote,))], outbox=False)
+        self.value = remote + self.delta
+        self.update_time = time()
+        self.notify()
+
+    def add(self, delta):
+        """
+        Changes amount of free places and schedules flush.
+        @param delta: int, change of amount of free places
+        """
+        self.value = self.get() + delta
+        self.delta += delta
+        if self.flusher is None:
+            self.flusher = spawn_later(self.FLUSH_INTERVAL, self.flush)
+
+    def flush(self):
+        """
+        Writes accumulated delta locally and schedules it for remote execution.
+        @return: bool, whether anything has been written
+        """
+        self.flusher = None
+        delta, self.delta = self.delta, 0
+        if not delta:
+            return False
+
+        self.db.write(self.DELTA_QUERY, (delta,), local=True)
+        self.notify()
+        return True
@@ -2,6 +2,7 @@
 from PyQt4 import uic
 from PyQt4.QtGui import QWidget, QApplication, QIcon, QSystemTrayIcon, QDialog
 from executor import Executor
+from breaker import CircuitBreaker
 from login import LoginDialog, LogoffDialog
 from db import Card
 from ticket import Ticket
@@ -75,6 +76,7 @@ class Main(QWidget):
         executor.session_end.connect(self.end_session)
 
         executor.option_notification.connect(self.handle_option)
+        executor.db_state.connect(self.handle_db_state)
         self.ui.config.option_changed.connect(executor.set_option)
 
         self.ui.config.terminals_changed.connect(executor.notify_terminals)
@@ -130,6 +132,17 @@ class Main(QWidget):
             self.ui.printTicket.setEnabled(value == '2')
         self.ui.config.handle_option(key, value)
 
+    def handle_db_state(self, state):
+        """
+        Shows whether central database is available in window title and tray icon tooltip.
+        @param state: str, state of circuit breaker of remote database, see breaker module
+        """
+        title = _('Stop-Park')
+        if state != CircuitBreaker.CLOSED:
+            title = u'%s - %s' % (title, _('central database is unavailable'))
+        self.setWindowTitle(title)
+        self.notifier.setToolTip(title)
+
     def update_terminals(self, terminals=None):
         if terminals is None:
             terminals = {}
@@ -118,8 +118,9 @@ class TerminalEntries(Structure):
         This method executes terminal_get_entries command and processes its result.
         Result processing includes:
         + checking stp_* flags and either issuing appropriate configuration command to device or notifying operator.
-        + adjusting free places counter using provided database and generating pass events for it.
-        + broadcasting information about free places to all terminals in network.
+        + adjusting free places counter using provided database and generating pass events for it
+          (both are sent to remote database as a single batch, that accumulates passes of all terminals;
+          information about free places is broadcast to all terminals in network when batch is flushed).
         """
         if terminal_get_entries(terminal, self.addr, self):
             return False
@@ -138,18 +139,10 @@ class TerminalEntries(Structure):
         if self.stp_paper_no:
             notify(_('Notification'), _('No paper at terminal %i') % (self.addr,))
 
-        free_places_diff = self.out_count - self.in_count
-        if free_places_diff:
-            db.update_free_places(free_places_diff)
-            TerminalCounters(db).set(terminal, 0xFF)
-        elif not self.stp_places:
-            TerminalCounters(db).set(terminal, self.addr)
-
-        for i in range(self.out_count):
-            db.generate_pass_event(self.addr, inside=False)
+        db.register_passes(self.addr, self.in_count, self.out_count)
 
-        for i in range(self.in_count):
-            db.generate_pass_event(self.addr, inside=True)
+        if not self.stp_places:
+            TerminalCounters(db).set(terminal, self.addr)
 
         return True
 
@@ -299,7 +292,7 @@ class TerminalBarcode(DumpableStructure):
                 TerminalState('auto', 'out_open').set(terminal, self.addr, db)
                 TerminalMessage(_('BAR Access permitted.')).set(terminal, self.addr)
             else:
-                notify(_('BAR Access denied.'), u'%s' % (ticket.bar,))
+                notify(_('BAR Access denied.'), u'%s' % (ticket.bar if ticket else self.code,))
                 TerminalMessage(_('BAR Access denied.')).set(terminal, self.addr)
 
         if self.status == self.BAR_LEFT and self.time < self.LEAVE_TIMEOUT:
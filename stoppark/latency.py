@@ -0,0 +1,161 @@
+# coding=utf-8
+"""
+Latency statistics of remote database requests.
+
+Latencies are recorded into log-linear histograms (the same layout HdrHistogram uses):
+values below SUB_BUCKETS microseconds are counted exactly, larger values are counted with relative error
+of 1/SUB_BUCKETS at most, no matter how large they are. So histogram takes constant memory and time per value,
+while its percentiles are precise enough to tell slow requests from fast ones.
+
+Requests are grouped by name of their statement (see statement_name), along with counters of errors and timeouts.
+Histograms are shared by DB instances of all threads and can be exported to a file or shown to user.
+"""
+from gevent.socket import timeout
+from threading import Lock
+from time import time
+import re
+
+SUB_BUCKET_BITS = 6
+SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+
+def bucket_of(value):
+    """
+    @param value: int, microseconds
+    @return: int, index of histogram bucket that counts given value
+    >>> [bucket_of(v) for v in (0, 63, 64, 65, 127, 128, 131, 132)]
+    [0, 63, 64, 64, 95, 96, 96, 97]
+    """
+    if value < SUB_BUCKETS:
+        return value
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    return SUB_BUCKETS + (shift - 1) * (SUB_BUCKETS / 2) + (value >> shift) - SUB_BUCKETS / 2
+
+
+def bucket_range(index):
+    """
+    @return: tuple of the lowest and the highest values counted by bucket with given index
+    >>> [bucket_range(i) for i in (63, 64, 95, 96)]
+    [(63, 63), (64, 65), (126, 127), (128, 131)]
+    """
+    if index < SUB_BUCKETS:
+        return index, index
+    shift = (index - SUB_BUCKETS) / (SUB_BUCKETS / 2) + 1
+    mantissa = (index - SUB_BUCKETS) % (SUB_BUCKETS / 2) + SUB_BUCKETS / 2
+    return mantissa << shift, ((mantissa + 1) << shift) - 1
+
+
+class Histogram(object):
+    OK = 'ok'
+    ERROR = 'error'
+    TIMEOUT = 'timeout'
+
+    @staticmethod
+    def outcome(error):
+        """
+        @param error: socket.error, that request failed with
+        """
+        return Histogram.TIMEOUT if isinstance(error, timeout) else Histogram.ERROR
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.max = 0
+
+    def record(self, seconds, outcome=OK):
+        value = max(0, int(seconds * 1000000))
+        index = bucket_of(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.max = max(self.max, value)
+        if outcome == self.ERROR:
+            self.errors += 1
+        elif outcome == self.TIMEOUT:
+            self.timeouts += 1
+
+    def percentile(self, p):
+        """
+        @param p: float, percentile in range [0, 100]
+        @return: float, seconds, the highest value, that is equivalent to the value at given percentile
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, int(round(p / 100.0 * self.count)))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(bucket_range(index)[1], self.max) / 1000000.0
+        return self.max / 1000000.0
+
+    def __str__(self):
+        return 'n=%i p50=%.1fms p99=%.1fms max=%.1fms errors=%i timeouts=%i' % (
+            self.count, self.percentile(50) * 1000, self.percentile(99) * 1000, self.max / 1000.0,
+            self.errors, self.timeouts)
+
+
+STATEMENT_NAME = re.compile(r'^\s*(select|insert|update|delete|replace)\b(?:.*?\b(?:from|into))?\s+(\w+)',
+                            re.IGNORECASE | re.DOTALL)
+
+
+def statement_name(q):
+    """
+    Normalizes statement to a name, that is shared by all statements of the same kind.
+    >>> statement_name('select * from card where CardID = ?')
+    'select card'
+    >>> statement_name('update ticket set timeout=?, status = status | ? where bar = ?')
+    'update ticket'
+    >>> statement_name('insert into Payment values(NULL, ?)')
+    'insert payment'
+    >>> statement_name('vacuum')
+    'other'
+    """
+    match = STATEMENT_NAME.match(q)
+    if match is None:
+        return 'other'
+    return '%s %s' % (match.group(1).lower(), match.group(2).lower())
+
+
+class Latency(object):
+    EXPORT_INTERVAL = 60  # seconds
+
+    def __init__(self):
+        self.lock = Lock()
+        self.histograms = {}
+        self.since = time()
+
+    def record(self, name, seconds, outcome=Histogram.OK):
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.record(seconds, outcome)
+
+    def report(self):
+        """
+        @return: str, one line per request name
+        """
+        with self.lock:
+            return '\n'.join('%s: %s' % (name, self.histograms[name]) for name in sorted(self.histograms))
+
+    def export(self, filename):
+        with self.lock:
+            since = self.since
+        with open(filename, 'w') as f:
+            f.write('# since %s\n' % (since,))
+            f.write(self.report() + '\n')
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+            self.since = time()
+
+
+latency = Latency()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,115 @@
+# coding=utf-8
+"""
+Background writer of local database.
+
+Local copies of remote data (query results, free places counter) don't need to be committed before caller
+continues: every commit costs an fsync, which terminal polling loop should not wait for. Writer accumulates them
+and commits everything appended within FLUSH_INTERVAL (or as soon as BATCH_SIZE statements are pending)
+as a single transaction from its own thread. Groups, that fail, are kept and retried by the next flush.
+
+Statements queued in outbox (payments, events) are the only copy of them until they are replayed, so they are
+committed by caller itself (see commit) together with everything appended before, within the same transaction.
+
+Writer is shared by all LocalDB instances of the same database file, so flush is a barrier for every thread:
+after it returns, everything appended before is committed. Plain local reads don't flush, so they may miss writes
+of the last FLUSH_INTERVAL. Readers, that must see them (reports, session end, card mirror sync), flush first.
+"""
+from threading import Condition, Lock, Thread
+from time import time
+import sqlite3
+
+
+class LocalWriter(object):
+    FLUSH_INTERVAL = 0.1  # seconds
+    BATCH_SIZE = 100  # statements
+
+    def __init__(self, local):
+        """
+        @param local: db.LocalDB, that writes are committed through
+        """
+        self.local = local
+        self.condition = Condition()
+        self.flush_lock = Lock()  # flushes are committed one by one in order of appending
+        self.pending = []
+        self.size = 0
+        self.failed = []  # groups, that have failed, they are retried by the next flush
+        self.thread = None
+
+    def append(self, statements, local=True, outbox=True):
+        """
+        @param statements: list of (statement, parameters) tuples
+        @param local: bool, whether statements should be executed locally
+        @param outbox: bool, whether statements should be appended to outbox
+        """
+        with self.condition:
+            self.pending.append((statements, local, outbox))
+            self.size += len(statements)
+            if self.thread is None:
+                self.thread = Thread(target=self.run, name='LocalWriter')
+                self.thread.daemon = True
+                self.thread.start()
+            if self.size >= self.BATCH_SIZE:
+                self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.pending:
+                    self.condition.wait()
+                deadline = time() + self.FLUSH_INTERVAL
+                while self.size < self.BATCH_SIZE and time() < deadline:
+                    self.condition.wait(deadline - time())
+            self.flush()
+
+    def flush(self):
+        """
+        Commits everything, that has been appended before call.
+        @return: bool, whether everything has been committed, groups that have failed are kept for retry
+        """
+        self.commit()
+        return not self.failed
+
+    def commit(self, statements=(), local=True, outbox=True):
+        """
+        Commits given statements right away, together with everything, that has been appended before call.
+        Unlike appended groups, given statements are not kept for retry when they fail.
+        @param statements: list of (statement, parameters) tuples
+        @param local: bool, whether statements should be executed locally
+        @param outbox: bool, whether statements should be appended to outbox
+        @return: bool, whether given statements have been committed
+        """
+        with self.flush_lock:
+            with self.condition:
+                pending, self.pending, self.size = self.pending, [], 0
+            pending, self.failed = self.failed + pending, []
+            batch = (statements, local, outbox)
+            batches = pending + [batch] if statements else pending
+            if not batches:
+                return True
+
+            try:
+                with self.local.transaction() as c:
+                    self.local.write_batches(c, batches)
+                return True
+            except sqlite3.Error as e:
+                print 'Local batch failed:', e.__class__.__name__, e
+
+            # batch is retried group by group, so a single bad statement does not take others with it
+            committed = True
+            for group in batches:
+                try:
+                    with self.local.transaction() as c:
+                        self.local.write_batches(c, [group])
+                except sqlite3.Error as e:
+                    print 'Local write failed:', e.__class__.__name__, e, group
+                    if group is batch:
+                        committed = False
+                    else:
+                        self.failed.append(group)
+            return committed
+
+    def failed_size(self):
+        """
+        @return: int, amount of statements, that are kept for retry
+        """
+        return sum(len(statements) for statements, local, outbox in self.failed)
@@ -6,6 +6,7 @@ from interface import TerminalCounters, TerminalStrings, TerminalTime, TerminalM
 from interface import ReaderError
 from PyQt4.QtCore import QObject, pyqtSignal
 from db import DB
+from deadlines import deadline, GATE
 from threading import Thread
 from i18n import language
 _ = language.ugettext
@@ -25,7 +26,10 @@ def device_loop(terminal, mainloop, addr, data):
             processors.append(TerminalBarcode(addr))
 
         for p in processors:
-            failure = 0 if p.process(terminal, mainloop.db, notify) else (failure + 1)
+            # car is waiting at terminal, so remote database is not waited for longer than GATE,
+            # access is checked using local data or denied after that
+            with deadline(GATE):
+                failure = 0 if p.process(terminal, mainloop.db, notify) else (failure + 1)
             s = 4 if failure > 2 else 0.3
             mainloop.state.emit(addr, 'active' if failure <= 2 else 'inactive')
             sleep(s)
@@ -68,6 +72,8 @@ class Mainloop(QObject):
         self.db = DB(notify=lambda title, msg: self.notify.emit(title, msg))
 
         self.queue = Queue()
+        self.db.free_places.subscribe(lambda free_places: self.update_counters())
+        spawn(self.db.breaker.run, self.db.probe)
         self.ready.emit(True, self.devices)
 
         greenlets = self.spawn_device_greenlets(terminal, self.devices)
@@ -78,7 +84,8 @@ class Mainloop(QObject):
             command = self.queue.get()
 
             if callable(command):
-                command(terminal)
+                with deadline(GATE):
+                    command(terminal)
             else:
                 [greenlet.kill() for greenlet in greenlets]
                 break
@@ -104,7 +111,11 @@ class Mainloop(QObject):
     def update_config(self, addr=0xFF):
         self.queue.put(lambda terminal: TerminalTime().set(terminal, addr))
         self.queue.put(lambda terminal: TerminalStrings(self.db).set(terminal, addr))
-        self.queue.put(lambda terminal: TerminalCounters(self.db).set(terminal, addr))
+        self.update_counters(addr)
+
+    def update_counters(self, addr=0xFF):
+        if self.queue:
+            self.queue.put(lambda terminal: TerminalCounters(self.db).set(terminal, addr))
 
     def terminal_open(self, addr):
         self.queue.put(lambda terminal: TerminalState('man', 'open').set(terminal, addr, self.db))
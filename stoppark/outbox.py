@@ -0,0 +1,76 @@
+# coding=utf-8
+"""
+Store-and-forward delivery of remote writes.
+
+DB.write and DB.write_many append statements to outbox table of local database and return immediately.
+Outbox replays them to remote database in background, in the order they have been written,
+sending consecutive statements as a single batch when remote database supports batches.
+
+Every statement is sent along with its idempotency key (see protocol module), but only servers, that support
+batches, are relied on to honour keys: batch is executed within a single transaction and its keys are remembered,
+while server without batches cannot execute it at all. So batch, which result has been lost together
+with connection, is simply sent again. Legacy servers ignore keys, so statements are sent to them one by one
+and every statement leaves outbox as soon as it's acknowledged. Only the statement, which response has been lost,
+may be executed twice then.
+When remote database is unavailable, replay is postponed using exponential backoff.
+Statements rejected by remote database (FAIL) are reported and dropped, since retrying them
+would block every write behind them.
+"""
+from gevent import socket, sleep
+from protocol import FAIL, decode_params
+from i18n import language
+_ = language.ugettext
+
+
+class Outbox(object):
+    BATCH_SIZE = 32
+    POLL_INTERVAL = 1  # seconds, writes made by DB instances from other threads are noticed that late
+    MIN_BACKOFF = 1  # seconds
+    MAX_BACKOFF = 60  # seconds
+
+    def __init__(self):
+        self.backoff = 0
+        self.failing = False
+
+    def replay(self, db):
+        """
+        Sends the oldest outbox statements to remote database.
+        @param db: db.DB
+        @return: int, amount of statements that left outbox
+        @raise socket.error when remote database is unavailable
+        """
+        head = db.local.outbox_head(self.BATCH_SIZE)
+        if not head:
+            return 0
+
+        statements = [(q, decode_params(params)) for _, _, q, params in head]
+        results = db.request_many(statements, [key for _, key, _, _ in head],
+                                  acknowledge=lambda count: db.local.outbox_remove(head[count - 1][0]))
+        for (_, key, _, _), (q, params), (status, rows) in zip(head, statements, results):
+            if status == FAIL:
+                print 'Outbox statement rejected:', key, q, params
+                if db.notify:
+                    db.notify(_("Query Error"), db.describe(q, params))
+        return len(head)
+
+    def postpone(self, db, error):
+        print 'Outbox replay postponed:', error.__class__.__name__, error
+        if not self.failing and db.notify:
+            db.notify(_("Database Error"), _("Remote writes are postponed, %i pending") % (db.local.outbox_size(),))
+        self.failing = True
+        self.backoff = min(self.MAX_BACKOFF, self.backoff * 2) if self.backoff else self.MIN_BACKOFF
+
+    def __call__(self, db):
+        while True:
+            db.written.clear()
+            try:
+                replayed = self.replay(db)
+            except socket.error as e:
+                self.postpone(db, e)
+                sleep(self.backoff)
+                continue
+
+            self.backoff = 0
+            self.failing = False
+            if replayed < self.BATCH_SIZE:
+                db.written.wait(self.POLL_INTERVAL)
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 from PyQt4 import uic
-from PyQt4.QtCore import QObject, pyqtSignal, pyqtSlot, QUrl
+from PyQt4.QtCore import QObject, QTimer, pyqtSignal, pyqtSlot, QUrl
 from PyQt4.QtGui import QWidget, QDialog
 from PyQt4.QtDeclarative import QDeclarativeView
+from datetime import datetime
+from math import ceil
 from keyboard import TicketInput
 from once_payable import OncePayable
+from tariff_adapter import AdaptedTariffs
 from i18n import language
 _ = language.ugettext
 
@@ -20,14 +23,21 @@ class Payments(QWidget):
     payment_initiated = pyqtSignal(QObject)
     payment_completed = pyqtSignal()
 
+    MAX_REFRESH_DELAY = 24 * 60 * 60  # seconds
+
     def __init__(self, parent=None):
         QWidget.__init__(self, parent)
 
         self.tariffs = None
+        self.adapted = AdaptedTariffs()
         self.payment = None
         self.payable = None
         self.accept_payable = True
 
+        self.refresh_timer = QTimer(self)
+        self.refresh_timer.setSingleShot(True)
+        self.refresh_timer.timeout.connect(self.refresh_payable)
+
         self.ui = uic.loadUiType('payments.ui')[0]()
         self.ui.setupUi(self)
         self.localize()
@@ -53,6 +63,7 @@ class Payments(QWidget):
 
     def end_session(self):
         self.accept_payable = False
+        self.refresh_timer.stop()
         self.ui.progress.setVisible(False)
         self.ui.pay.setEnabled(False)
         self.ui.keyboard.setEnabled(False)
@@ -74,7 +85,7 @@ class Payments(QWidget):
             self.ready_to_accept()
         else:
             self.tariffs = tariffs
-            self.ui.tariffs.rootObject().set_tariffs_with_payable(self.tariffs, self.payable)
+            self.ui.tariffs.rootObject().set_tariffs_with_payable(self.adapted(self.tariffs), self.payable)
 
     def ready_to_accept(self):
         if self.payable:
@@ -84,7 +95,7 @@ class Payments(QWidget):
         self.ui.keyboard.setEnabled(True)
 
         self.payable = OncePayable()
-        self.ui.tariffs.rootObject().set_tariffs_with_payable(self.tariffs, self.payable)
+        self.ui.tariffs.rootObject().set_tariffs_with_payable(self.adapted(self.tariffs), self.payable)
         self.accept_payable = True
 
     def ready_to_pay(self):
@@ -105,11 +116,30 @@ class Payments(QWidget):
         self.ui.cancel.setEnabled(True)
         self.ui.keyboard.setEnabled(False)
 
-        self.ui.tariffs.rootObject().set_tariffs_with_payable(self.tariffs, self.payable)
+        self.ui.tariffs.rootObject().set_tariffs_with_payable(self.adapted(self.tariffs), self.payable)
+
+    def schedule_refresh(self, payment):
+        """
+        Payable is re-priced (and customer display is updated) only when price of selected payment changes.
+        @param payment: payment.Payment or None
+        """
+        self.refresh_timer.stop()
+        change = getattr(payment, 'next_price_change', None) if payment and payment.enabled else None
+        if change is not None:
+            delay = min((change - datetime.now()).total_seconds(), self.MAX_REFRESH_DELAY)
+            self.refresh_timer.start(max(0, int(ceil(delay * 1000))))
+
+    def refresh_payable(self):
+        """
+        Re-prices payable with the same tariffs, so tariff selected by cashier stays selected.
+        """
+        if self.payable is not None and self.ui.tariffs.isEnabled():
+            self.ui.tariffs.rootObject().refresh_payments()
 
     def handle_payment(self, payment):
         payment = payment.toPyObject()
         print 'handle_payment', payment
+        self.schedule_refresh(payment)
         if payment:
             self.payment = payment
             self.ui.pay.setEnabled(payment.enabled)
@@ -125,6 +155,7 @@ class Payments(QWidget):
         self.ready_to_accept()
 
     def pay(self):
+        self.refresh_timer.stop()
         self.payment_initiated.emit(self.payment)
         self.ui.pay.setEnabled(False)
         self.ui.cancel.setEnabled(False)
@@ -0,0 +1,367 @@
+"""
+This module keeps connections to the remote database open between queries.
+
+Every DB instance owns its own ConnectionPool, so there is one pool per thread (and per gevent hub).
+Connections are grouped by remote address, so changing the database address in config simply makes
+the pool start a new group, while the old one is dropped with ConnectionPool.discard.
+
+A connection is checked out by a greenlet for the duration of a single exchange and nobody else
+can use it until that exchange is over: other greenlets (and nested exchanges of the same greenlet,
+e.g. a query issued while rows of another one are still being streamed) either receive
+an idle connection or open a new one.
+
+Connection can only be reused when remote database frames its responses (see protocol module).
+Until some address proves to do so, requests to it are sent in raw form and connection is closed after them.
+
+Statements with parameters are prepared once per connection to addresses that frame their responses.
+When remote database turns out not to support prepared statements, their parameters are inlined instead.
+
+Socket timeout of a checked out connection is limited by deadline of the current greenlet (see deadlines module).
+Socket timeout only limits every single send or recv, while exchange may take several of them
+(prepare, rows streamed in chunks), so the whole exchange is additionally limited by gevent.Timeout
+when there is a deadline.
+"""
+from gevent import socket, Timeout
+from select import select
+from contextlib import contextmanager
+from time import time
+from protocol import Stream, Response, ProtocolError, ConnectionClosed, NONE, BATCH_PREFIX, MAX_RESPONSE_SIZE
+from protocol import encode_request, encode_batch, encode_prepare, encode_execute, inline, keyed
+from deadlines import remaining, current, DeadlineExceeded
+
+
+class Connection(object):
+    """
+    Single socket to the remote database along with bookkeeping required by ConnectionPool.
+    """
+
+    def __init__(self, addr, timeout):
+        self.addr = addr
+        self.timeout = timeout
+        self.sock = None
+        self.stream = None
+        self.uses = 0
+        self.last_used = None
+        self.prepared = {}  # statement template -> handle
+        self.connect()
+
+    def connect(self):
+        self.close()
+        self.sock = socket.create_connection(self.addr, timeout=self.timeout)
+        self.stream = Stream(self.sock)
+        self.uses = 0
+        self.last_used = time()
+        self.prepared = {}
+
+    def settimeout(self, timeout):
+        """
+        @param timeout: float, seconds, timeout of every following socket operation
+        """
+        self.timeout = timeout
+        if self.sock is not None:
+            self.sock.settimeout(timeout)
+
+    @property
+    def closed(self):
+        return self.sock is None
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except socket.error:
+                pass
+            self.sock = None
+            self.stream = None
+
+    def alive(self):
+        """
+        Health check for idle connections.
+        Idle connection must not have anything to read: readable socket means either closed
+        connection (recv will return '') or some garbage left from previous exchange.
+        Both cases make this connection unusable.
+        Plain select with zero timeout is used here on purpose: it never switches greenlets,
+        so pool bookkeeping stays atomic from the point of view of other greenlets.
+        @return: bool
+        """
+        if self.sock is None:
+            return False
+        try:
+            readable, _, _ = select([self.sock], [], [], 0)
+        except (socket.error, ValueError):
+            return False
+        return not readable
+
+    def prepare(self, q, max_size=MAX_RESPONSE_SIZE):
+        """
+        Prepares statement template on this connection.
+        Statements can only be prepared when remote side is known to understand framed requests.
+        @param q: str, statement template
+        @return: bool, whether remote side has prepared statement
+        """
+        handle = len(self.prepared) + 1
+        self.sock.sendall(encode_request(encode_prepare(handle, q)))
+        response = Response(self.stream, max_size).start()
+        list(response)
+        self.uses += 1
+        self.last_used = time()
+        if not response.delimited:
+            raise ProtocolError('prepare response must be delimited')
+
+        if response.status != NONE:
+            return False
+        self.prepared[q] = handle
+        return True
+
+    def payload(self, q, params=(), key=None):
+        """
+        @return: str, request payload that executes statement with given parameters
+        """
+        if q in self.prepared:
+            return encode_execute(self.prepared[q], params, key)
+        if params:
+            q = inline(q, params)
+        return keyed(q, key) if key else q
+
+    def request(self, q, params=(), key=None, framed=False, max_size=MAX_RESPONSE_SIZE):
+        """
+        Sends statement and starts receiving response to it.
+        @param q: str, statement to be executed remotely
+        @param params: tuple of statement parameters
+        @param key: str, idempotency key of statement
+        @param framed: bool, whether remote side is known to understand framed requests
+        @param max_size: int, maximum allowed size of response
+        @return: protocol.Response with known status
+        """
+        payload = self.payload(q, params, key)
+        if framed:
+            self.sock.sendall(encode_request(payload))
+        else:
+            self.sock.sendall(payload)
+            self.sock.shutdown(socket.SHUT_WR)
+        response = Response(self.stream, max_size).start()
+        self.uses += 1
+        self.last_used = time()
+        return response
+
+    def request_many(self, statements, max_size=MAX_RESPONSE_SIZE):
+        """
+        Sends several statements as a single batch and receives all responses to them.
+        Batches can only be sent to remote side that is known to understand framed requests.
+        @param statements: list of (statement, parameters, key) tuples to be executed remotely
+        @param max_size: int, maximum allowed size of every response
+        @return: list of (status, rows) tuples, one per statement
+                 None when remote side does not support batches
+        """
+        self.sock.sendall(encode_request(encode_batch([self.payload(*s) for s in statements])))
+        count = self.stream.read_header(BATCH_PREFIX)
+        self.uses += 1
+        self.last_used = time()
+
+        if count is None:
+            response = Response(self.stream, max_size).start()
+            list(response)
+            if not response.delimited:
+                self.close()
+            return None
+
+        if count != len(statements):
+            raise ProtocolError('batch of %i statements got %i responses' % (len(statements), count))
+
+        results = []
+        for _ in statements:
+            response = Response(self.stream, max_size).start()
+            rows = list(response)
+            if not response.delimited:
+                raise ProtocolError('batch response must be delimited')
+            results.append((response.status, rows))
+        return results
+
+
+class ConnectionPool(object):
+    CONNECT_TIMEOUT = 20  # seconds
+    MAX_IDLE = 4  # connections per address
+    IDLE_TIMEOUT = 60  # seconds
+
+    def __init__(self, timeout=CONNECT_TIMEOUT, max_idle=MAX_IDLE, idle_timeout=IDLE_TIMEOUT):
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.idle = {}  # addr -> list of idle connections, most recently used at the end
+        self.framed = set()  # addresses known to frame their responses
+        self.unbatched = set()  # addresses known not to support batches
+        self.prepares = set()  # addresses known to support prepared statements
+        self.unprepared = set()  # addresses known not to support prepared statements
+
+    def evict(self, now=None):
+        """
+        Closes connections that have been idle for too long or became unusable.
+        """
+        if now is None:
+            now = time()
+        for addr, connections in self.idle.items():
+            keep = []
+            for conn in connections:
+                if now - conn.last_used < self.idle_timeout and conn.alive():
+                    keep.append(conn)
+                else:
+                    conn.close()
+            if keep:
+                self.idle[addr] = keep
+            else:
+                del self.idle[addr]
+
+    def checkout(self, addr, timeout=None):
+        """
+        @param timeout: float, seconds, socket timeout of connection, pool timeout is used by default
+        """
+        if timeout is None:
+            timeout = self.timeout
+        self.evict()
+        connections = self.idle.get(addr, [])
+        while connections:
+            conn = connections.pop()
+            if conn.alive():
+                conn.settimeout(timeout)
+                return conn
+            conn.close()
+        return Connection(addr, timeout)
+
+    def checkin(self, conn):
+        if conn.closed:
+            return
+        connections = self.idle.setdefault(conn.addr, [])
+        connections.append(conn)
+        while len(connections) > self.max_idle:
+            connections.pop(0).close()
+
+    @contextmanager
+    def connection(self, addr):
+        """
+        Checks out connection to the given address for exclusive use by the current greenlet.
+        Connection is returned to pool when block completes normally and closed when it raises.
+        @raise deadlines.DeadlineExceeded: when deadline of the current greenlet has already passed
+                                           or passes before block completes
+        """
+        timeout = remaining(self.timeout)
+        conn = self.checkout(addr, timeout)
+        limit = Timeout.start_new(timeout, DeadlineExceeded('deadline exceeded')) if current() is not None else None
+        try:
+            yield conn
+        except BaseException:
+            conn.close()
+            raise
+        finally:
+            if limit is not None:
+                limit.cancel()
+            self.checkin(conn)
+
+    @staticmethod
+    def attempt(conn, exchange):
+        """
+        Executes exchange using given connection.
+        When reused connection turns out to be closed by remote side, exchange is retried once
+        using a fresh connection, since there is no way to detect that before sending query.
+        Nothing is retried once some response has been received or when remote side simply does not respond
+        in time: query may have already been executed remotely.
+        @param conn: Connection
+        @param exchange: callable, that accepts connection and performs exchange using it
+        @return: result of exchange
+        """
+        uses = conn.uses
+        try:
+            return exchange(conn)
+        except socket.error as e:
+            stale = not isinstance(e, (socket.timeout, ProtocolError)) or isinstance(e, ConnectionClosed)
+            if not (uses and conn.uses == uses and stale):
+                raise
+        conn.connect()
+        return exchange(conn)
+
+    def prepare(self, conn, statements, max_size=MAX_RESPONSE_SIZE):
+        """
+        Prepares templates of statements with parameters, that are not prepared on given connection yet.
+        Statements that cannot be prepared are sent with inlined parameters.
+        @param conn: Connection
+        @param statements: list of (statement, parameters, key) tuples
+        """
+        addr = conn.addr
+        if addr not in self.framed or addr in self.unprepared:
+            return
+        for q, params, key in statements:
+            if not params or q in conn.prepared:
+                continue
+            if conn.prepare(q, max_size):
+                self.prepares.add(addr)
+            elif addr not in self.prepares:
+                # unlike a single incorrect template, this means that remote side has no prepared statements at all
+                self.unprepared.add(addr)
+                return
+
+    @contextmanager
+    def response(self, addr, q, params=(), key=None, max_size=MAX_RESPONSE_SIZE):
+        """
+        Executes a single exchange using pooled connection and provides its response.
+        Connection is closed afterwards when response has not been read completely or cannot be reused.
+        @param addr: tuple, (host, port) of remote database
+        @param q: str, statement to be executed remotely
+        @param params: tuple of statement parameters
+        @param key: str, idempotency key of statement
+        @param max_size: int, maximum allowed size of response
+        """
+        def exchange(c):
+            self.prepare(c, [(q, params, key)], max_size)
+            return c.request(q, params, key, framed, max_size)
+
+        with self.connection(addr) as conn:
+            framed = addr in self.framed
+            response = self.attempt(conn, exchange)
+
+            if response.delimited:
+                self.framed.add(addr)
+            elif framed:
+                # remote side has been replaced by one that does not understand framed requests
+                self.framed.discard(addr)
+
+            yield response
+
+            if not (response.complete and response.delimited):
+                conn.close()
+
+    def request(self, addr, q, params=(), key=None, max_size=MAX_RESPONSE_SIZE):
+        """
+        Executes a single exchange and reads its response completely.
+        @return: tuple of response status and list of rows
+        """
+        with self.response(addr, q, params, key, max_size) as response:
+            return response.status, list(response)
+
+    def request_many(self, addr, statements, max_size=MAX_RESPONSE_SIZE):
+        """
+        Executes several statements within a single exchange.
+        @param statements: list of (statement, parameters, key) tuples
+        @return: list of (status, rows) tuples, one per statement
+                 None when batch cannot be executed by remote side, so statements have to be executed one by one.
+        """
+        if addr not in self.framed or addr in self.unbatched:
+            return None
+
+        def exchange(c):
+            self.prepare(c, statements, max_size)
+            return c.request_many(statements, max_size)
+
+        with self.connection(addr) as conn:
+            results = self.attempt(conn, exchange)
+            if results is None:
+                self.unbatched.add(addr)
+            return results
+
+    def discard(self, addr=None):
+        """
+        Closes idle connections to the given address or to all addresses when addr is None.
+        Connections currently checked out are not affected.
+        """
+        for key in self.idle.keys():
+            if addr is None or key == addr:
+                for conn in self.idle.pop(key):
+                    conn.close()
@@ -0,0 +1,328 @@
+"""
+This module implements wire format of remote database protocol.
+
+Request is a query string. It can be sent in two ways:
+1. Framed: '#<length>\\n' header followed by exactly <length> bytes of query.
+   Connection stays open after response and can be used for subsequent requests.
+2. Raw: query bytes followed by shutting down writing side of connection.
+   This is the only way legacy database servers understand, so it is used until
+   server proves that it supports framing by sending a delimited response.
+
+Response payload is either NONE, FAIL or a set of rows separated by '\\n' with fields separated by '|'.
+Payload end is determined by one of the following:
+1. Length prefix: payload is preceded with '#<length>\\n' header.
+2. Terminator: payload is followed by a single TERMINATOR byte. This is used by servers that stream
+   rows without knowing total length in advance.
+3. Close: there is neither of above and payload lasts until remote side closes connection.
+   Such connections cannot be reused.
+
+Several statements can be sent as a single framed request (batch), which payload is '%<count>\\n' header
+followed by <count> framed statements. Server executes them in order within a single transaction
+and responds with the same header followed by <count> delimited responses, one per statement.
+Server that does not support batches responds with a single response (usually FAIL) instead.
+
+Statement may start with '/*key:<key>*/' comment, that carries its idempotency key.
+Servers, that support batches, remember keys of executed statements and do not execute statement
+with the same key twice. Since it's a regular SQL comment, legacy servers simply execute such statements,
+so keys cannot be relied on until server has proven to support batches.
+
+Statements are templates with '?' placeholders for their parameters. Template can be prepared once
+per connection with '$<handle>\\n<template>' request, where handle is a number chosen by client.
+Server responds with NONE when statement is prepared and FAIL when it is not (that's also what
+servers without prepared statements support respond with). Prepared statement is executed
+with '@<handle>[:<key>]\\n<parameters>' request (see encode_params), which can also be a part of batch.
+Every other request contains plain SQL with parameters inlined as literals (see inline).
+"""
+from gevent import socket
+import re
+
+NONE = 'NONE'
+FAIL = 'FAIL'
+ROWS = 'ROWS'
+
+LENGTH_PREFIX = '#'
+BATCH_PREFIX = '%'
+PREPARE_PREFIX = '$'
+EXECUTE_PREFIX = '@'
+TERMINATOR = '\x00'
+
+CHUNK_SIZE = 4096
+MAX_HEADER_SIZE = 32
+MAX_RESPONSE_SIZE = 4 * 1024 * 1024
+
+
+class ProtocolError(socket.error):
+    pass
+
+
+class ConnectionClosed(ProtocolError):
+    """
+    Remote side closed connection before sending anything.
+    """
+    pass
+
+
+class ResponseTooLarge(ProtocolError):
+    pass
+
+
+class QueryFailed(ProtocolError):
+    """
+    Remote database responded with FAIL.
+    """
+    pass
+
+
+def encode_request(q):
+    """
+    >>> encode_request('select * from card')
+    '#18\\nselect * from card'
+    """
+    return '%s%i\n%s' % (LENGTH_PREFIX, len(q), q)
+
+
+def keyed(q, key):
+    """
+    >>> keyed('delete from ticket', 'abc')
+    '/*key:abc*/ delete from ticket'
+    """
+    return '/*key:%s*/ %s' % (key, q)
+
+
+def encode_batch(payloads):
+    """
+    >>> encode_batch(['select 1', 'select 2'])
+    '%2\\n#8\\nselect 1#8\\nselect 2'
+    """
+    return '%s%i\n%s' % (BATCH_PREFIX, len(payloads), ''.join(encode_request(q) for q in payloads))
+
+
+def literal(value):
+    """
+    >>> literal(None), literal(12), literal(1.5), literal('a"b')
+    ('NULL', '12', '1.5', '"a""b"')
+    """
+    if value is None:
+        return 'NULL'
+    if isinstance(value, (int, long, float)):
+        return repr(value).rstrip('L')
+    return '"%s"' % (str(value).replace('"', '""'),)
+
+
+PLACEHOLDER = re.compile(r'\?')
+
+
+def inline(q, params):
+    """
+    Substitutes placeholders of statement template with literals of its parameters.
+    >>> inline('update card set status = ? where CardID = ?', (6, 'E7008D750C'))
+    'update card set status = 6 where CardID = "E7008D750C"'
+    """
+    params = iter(params)
+    try:
+        q = PLACEHOLDER.sub(lambda match: literal(next(params)), q)
+    except StopIteration:
+        raise ValueError('not enough parameters for statement: %s' % (q,))
+    if next(params, PLACEHOLDER) is not PLACEHOLDER:
+        raise ValueError('too many parameters for statement: %s' % (q,))
+    return q
+
+
+def encode_params(params):
+    """
+    Every parameter is encoded as its type letter followed by its value:
+    'n' for NULL, 'i<int>\\n', 'f<float>\\n' or 's<length>\\n<bytes>'.
+    >>> encode_params([None, 6, 0.5, 'abc'])
+    'ni6\\nf0.5\\ns3\\nabc'
+    """
+    encoded = []
+    for value in params:
+        if value is None:
+            encoded.append('n')
+        elif isinstance(value, (int, long)):
+            encoded.append('i%i\n' % (value,))
+        elif isinstance(value, float):
+            encoded.append('f%r\n' % (value,))
+        else:
+            value = str(value)
+            encoded.append('s%i\n%s' % (len(value), value))
+    return ''.join(encoded)
+
+
+def decode_params(data):
+    """
+    >>> decode_params(encode_params([None, 6, 0.5, 'a\\nb']))
+    (None, 6, 0.5, 'a\\nb')
+    """
+    params = []
+    position = 0
+    try:
+        while position < len(data):
+            kind = data[position]
+            if kind == 'n':
+                params.append(None)
+                position += 1
+                continue
+            end = data.index('\n', position)
+            value = data[position + 1:end]
+            position = end + 1
+            if kind == 'i':
+                params.append(int(value))
+            elif kind == 'f':
+                params.append(float(value))
+            elif kind == 's':
+                params.append(data[position:position + int(value)])
+                position += int(value)
+            else:
+                raise ValueError('unknown parameter type %r' % (kind,))
+    except ValueError as e:
+        raise ProtocolError('incorrect parameters: %s' % (e,))
+    if position != len(data):
+        raise ProtocolError('incorrect parameters: truncated string')
+    return tuple(params)
+
+
+def encode_prepare(handle, q):
+    """
+    >>> encode_prepare(1, 'delete from ticket where bar = ?')
+    '$1\\ndelete from ticket where bar = ?'
+    """
+    return '%s%i\n%s' % (PREPARE_PREFIX, handle, q)
+
+
+def encode_execute(handle, params, key=None):
+    """
+    >>> encode_execute(1, ['123'], key='abc')
+    '@1:abc\\ns3\\n123'
+    """
+    return '%s%i%s\n%s' % (EXECUTE_PREFIX, handle, ':' + key if key else '', encode_params(params))
+
+
+class Stream(object):
+    """
+    Socket wrapper that allows to return excessive data back to be read by the next consumer.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.pending = ''
+
+    def read(self, size):
+        if self.pending:
+            data, self.pending = self.pending[:size], self.pending[size:]
+            return data
+        return self.sock.recv(size)
+
+    def unread(self, data):
+        self.pending = data + self.pending
+
+    def read_header(self, prefix):
+        """
+        Reads '<prefix><number>\\n' header from stream, when stream starts with given prefix.
+        @return: int or None when there is no header in stream
+        """
+        data = self.read(CHUNK_SIZE)
+        if data == '':
+            raise ConnectionClosed('connection closed by remote database')
+        if not data.startswith(prefix):
+            self.unread(data)
+            return None
+        while '\n' not in data:
+            chunk = self.read(CHUNK_SIZE)
+            if chunk == '' or len(data) > MAX_HEADER_SIZE:
+                raise ProtocolError('incorrect frame header: %r' % (data[:MAX_HEADER_SIZE],))
+            data += chunk
+        header, rest = data[len(prefix):].split('\n', 1)
+        self.unread(rest)
+        try:
+            return int(header)
+        except ValueError:
+            raise ProtocolError('incorrect frame header: %r' % (header,))
+
+
+class Response(object):
+    """
+    Incremental reader of a single response.
+    After start, status is known and rows can be iterated as they arrive.
+    """
+
+    def __init__(self, stream, max_size=MAX_RESPONSE_SIZE):
+        self.stream = stream
+        self.max_size = max_size
+        self.buf = ''
+        self.size = 0
+        self.length = None
+        self.delimited = False
+        self.complete = False
+        self.status = None
+
+    def feed(self, data):
+        if self.length is not None:
+            rest = self.length - self.size
+            if len(data) >= rest:
+                self.stream.unread(data[rest:])
+                data = data[:rest]
+                self.complete = True
+        elif TERMINATOR in data:
+            data, extra = data.split(TERMINATOR, 1)
+            self.stream.unread(extra)
+            self.delimited = True
+            self.complete = True
+
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise ResponseTooLarge('response exceeds limit of %i bytes' % (self.max_size,))
+        self.buf += data
+
+    def read(self):
+        data = self.stream.read(CHUNK_SIZE)
+        if data == '':
+            if self.length is not None:
+                raise ProtocolError('connection closed in the middle of response')
+            self.complete = True
+        else:
+            self.feed(data)
+
+    def start(self):
+        """
+        Reads response header and its first line, which is enough to determine response status.
+        @return: self
+        """
+        self.length = self.stream.read_header(LENGTH_PREFIX)
+        if self.length is not None:
+            if self.length > self.max_size:
+                raise ResponseTooLarge('response of %i bytes exceeds limit of %i bytes' %
+                                       (self.length, self.max_size))
+            self.delimited = True
+            self.feed('')
+
+        while '\n' not in self.buf and not self.complete:
+            self.read()
+
+        if self.complete and self.buf in (NONE, FAIL):
+            self.status, self.buf = self.buf, ''
+        else:
+            self.status = ROWS
+        return self
+
+    def __iter__(self):
+        """
+        Yields rows of response as soon as they are completely received.
+        """
+        while True:
+            lines = self.buf.split('\n')
+            self.buf = lines.pop()
+            for line in lines:
+                yield line.split('|')
+            if self.complete:
+                break
+            self.read()
+
+        if self.buf:
+            line, self.buf = self.buf, ''
+            yield line.split('|')
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,76 @@
+# coding=utf-8
+"""
+Cache of tariff quotes.
+
+The same ticket is priced over and over: for every tariff whenever tariffs are shown to cashier,
+and once again when cashier switches tariffs. Quotes are kept in bounded LRU cache,
+so re-pricing of unchanged ticket is a dict lookup.
+
+Quotes are keyed by tariff id and version (its fields and free time) and beginning of interval.
+Units and price of interval only change right after its end passes a unit edge (see Tariff.unit_edges),
+so quote is served for any end from the one it has been calculated for up to the next unit edge.
+Served result is a copy moved to the actual end of interval (see TicketTariffResult.set_delta), so quotes give
+exactly what calc does. Cache is cleared whenever tariffs change (see tariff_cache module).
+Cache is shared by all threads, like latency statistics.
+"""
+from collections import OrderedDict
+from copy import copy
+from threading import Lock
+
+
+class QuoteCache(object):
+    CAPACITY = 1024  # quotes
+
+    def __init__(self, capacity=CAPACITY):
+        self.capacity = capacity
+        self.lock = Lock()
+        self.quotes = OrderedDict()  # key -> (end, next unit edge, result), the least recently used goes first
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.quotes)
+
+    def quote(self, tariff, begin, end):
+        """
+        @param tariff: tariff.Tariff
+        @param begin: datetime, beginning of calculation interval
+        @param end: datetime, end of calculation interval
+        @return: the same result as tariff.calc(begin, end) returns
+        """
+        key = (tariff.id, tariff.version, begin)
+        with self.lock:
+            quote = self.quotes.pop(key, None)
+            if quote is not None:
+                self.quotes[key] = quote
+                quoted_end, edge, result = quote
+                if quoted_end <= end <= edge:
+                    self.hits += 1
+                    result = copy(result)
+                    result.set_delta(end - begin)
+                    return result
+            self.misses += 1
+
+        result = tariff.calc(begin, end)
+        edge = next(tariff.unit_edges(begin, end))
+        with self.lock:
+            self.quotes[key] = (end, edge, result)
+            while len(self.quotes) > self.capacity:
+                self.quotes.popitem(last=False)
+        return copy(result)
+
+    def clear(self):
+        with self.lock:
+            self.quotes.clear()
+
+    def report(self):
+        """
+        @return: str
+        """
+        with self.lock:
+            total = self.hits + self.misses
+            return 'quotes: %i cached, %i hits, %i misses (%.1f%% hit rate)' % (
+                len(self.quotes), self.hits, self.misses, 100.0 * self.hits / total if total else 0)
+
+
+quotes = QuoteCache()
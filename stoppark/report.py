@@ -9,6 +9,7 @@ _ = language.ugettext
 class Report(object):
     def __init__(self, db):
         self.db = db
+        self.db.local.flush()
         self.begin = '?'
         session = self.db.local.session()
         if session is not None:
@@ -19,26 +20,15 @@ class Report(object):
                 pass
 
         self.header = self.db.get_check_header()
-        self.total_places = self.db.get_total_places()
-        self.free_places = self.db.get_free_places()
+        self.total_places, self.free_places = self.db.gather(self.db.get_total_places, self.db.get_free_places)
 
-        self.sum = db.local.query('select sum(summa)/100 from payment')[0][0]
-        if self.sum is None:
-            self.sum = 0
-        moved_in_query = ('select count(*) from events '
-                          'where Direction="%s" and EventName="%s"' %
-                          (_('inside').encode('utf8', errors='replace'),
-                           _('pass').encode('utf8', errors='replace')))
-        self.moved_in = db.local.query(moved_in_query)[0][0]
-        self.moved_out = db.local.query('select count(*) from events '
-                                        'where Direction="%s" and EventName="%s"' %
-                                        (_('outside').encode('utf8', errors='replace'),
-                                         _('pass').encode('utf8', errors='replace')))[0][0]
-        self.card_moved_out = db.local.query('select count(*) from events '
-                                             'where Direction="%s" and EventName="%s"'
-                                             'and Card is not null' %
-                                             (_('outside').encode('utf8', errors='replace'),
-                                              _('pass').encode('utf8', errors='replace')))[0][0]
+        self.sum = db.local.payment_sum()
+        name = _('pass').encode('utf8', errors='replace')
+        inside = _('inside').encode('utf8', errors='replace')
+        outside = _('outside').encode('utf8', errors='replace')
+        self.moved_in = db.local.event_count(name, inside)
+        self.moved_out = db.local.event_count(name, outside)
+        self.card_moved_out = db.local.event_count(name, outside, card=True)
         self.moved_out -= self.card_moved_out  # information about cards moving out is doubled in database
         self.ticket_moved_out = self.moved_out - self.card_moved_out
 
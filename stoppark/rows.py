@@ -0,0 +1,169 @@
+# coding=utf-8
+"""
+Typed records of remote database rows.
+
+Remote database responds with rows of strings, where NULL is represented by 'None'. Schema describes columns
+of a table and converts every row into a compact record once: numbers are parsed, text is decoded from utf8,
+NULL becomes None, and datetimes are parsed only when they are accessed for the first time.
+Column positions are known only to schemas, so Ticket, Card and Tariff refer to columns by name.
+
+>>> record = TICKET.record(['Ticket', '1', '102516091500000030', 'None', 'None', 'None', 'None',
+...                         '13-10-25 16:09:15', 'None', 'None', 'None', '1'])
+>>> record.bar, record.typetarif, record.status
+('102516091500000030', None, 1)
+>>> record.timein
+datetime.datetime(2013, 10, 25, 16, 9, 15)
+>>> record.timeout is None
+True
+"""
+from datetime import datetime
+from itertools import izip
+from config import DATETIME_FORMAT, DATE_FORMAT
+
+NULL = 'None'
+
+
+def raw(value):
+    return None if value == NULL else value
+
+
+def integer(value):
+    return None if value == NULL else int(value)
+
+
+def text(value):
+    return None if value == NULL else value.decode('utf8', errors='replace')
+
+
+def date(value):
+    """
+    @return: datetime.date or None, when value is NULL or has incorrect format
+    """
+    try:
+        return datetime.strptime(value, DATE_FORMAT).date()
+    except ValueError:
+        return None
+
+
+def timestamp(value):
+    return None if value == NULL else datetime.strptime(value, DATETIME_FORMAT)
+
+
+class Lazy(object):
+    """
+    Column converter, that is applied to column value only when it's accessed for the first time.
+    """
+    def __init__(self, convert):
+        self.convert = convert
+
+
+class LazyColumn(object):
+    """
+    Descriptor of lazily converted column, converted value replaces original string in record.
+    """
+    def __init__(self, slot, convert):
+        self.slot = slot
+        self.convert = convert
+
+    def __get__(self, record, owner):
+        if record is None:
+            return self
+        value = getattr(record, self.slot)
+        if isinstance(value, str):
+            value = self.convert(value)
+            setattr(record, self.slot, value)
+        return value
+
+
+class Record(object):
+    __slots__ = ('fields',)
+    converters = ()  # list of (attribute, converter) pairs in order of columns
+
+    def __init__(self, fields):
+        """
+        @param fields: list of column values as strings, they are kept as fields attribute
+        @raise ValueError: when there are not enough fields or some of them can't be converted
+        """
+        if len(fields) < len(self.converters):
+            raise ValueError('%s expects %i fields, got %i' % (self.__class__.__name__, len(self.converters),
+                                                                len(fields)))
+        self.fields = fields
+        for (attribute, convert), value in izip(self.converters, fields):
+            setattr(self, attribute, convert(value) if convert is not None else value)
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.fields)
+
+
+class Schema(object):
+    def __init__(self, table, columns):
+        """
+        @param table: str, table name
+        @param columns: list of (column name, converter) pairs in order of table columns,
+                        converter is a callable, Lazy instance or None for columns, that are kept as strings
+        """
+        self.table = table
+        self.columns = [name for name, _ in columns]
+
+        attributes = {'__slots__': (), 'converters': []}
+        slots = []
+        for name, convert in columns:
+            if isinstance(convert, Lazy):
+                slot = '_' + name
+                attributes[name] = LazyColumn(slot, convert.convert)
+                attributes['converters'].append((slot, None))
+            else:
+                slot = name
+                attributes['converters'].append((slot, convert))
+            slots.append(slot)
+        attributes['__slots__'] = tuple(slots)
+        self.record = type(table.capitalize() + 'Record', (Record,), attributes)
+
+
+TICKET = Schema('ticket', [
+    ('Ticket', None),
+    ('id', raw),
+    ('bar', None),
+    ('typetarif', integer),
+    ('pricetarif', raw),
+    ('summ', raw),
+    ('summdopl', raw),
+    ('timein', Lazy(timestamp)),
+    ('timeout', Lazy(timestamp)),
+    ('TimeCount', Lazy(timestamp)),
+    ('timedopl', Lazy(timestamp)),
+    ('status', integer),
+])
+
+CARD = Schema('card', [
+    ('Card', None),
+    ('id', integer),
+    ('Type', integer),
+    ('CardID', None),
+    ('DTreg', date),
+    ('DTend', date),
+    ('DTIn', None),
+    ('DTOut', None),
+    ('Name', None),
+    ('SName', None),
+    ('FName', None),
+    ('Phone', None),
+    ('GosNom', text),
+    ('Model', text),
+    ('Color', None),
+    ('Status', integer),
+    ('TarifType', integer),
+    ('TarifPrice', None),
+    ('TarifSumm', None),
+])
+
+TARIFF = Schema('tariff', [
+    ('id', integer),
+    ('name', text),
+    ('type', integer),
+    ('interval', integer),
+    ('cost', None),
+    ('zerotime', raw),
+    ('maxperday', integer),
+    ('note', text),
+])
@@ -1,10 +1,16 @@
 # coding=utf-8
-from PyQt4.QtCore import QObject, pyqtProperty, pyqtSlot
+"""
+Tariff engine.
+
+Tariffs are plain immutable Python objects, so they are cheap to create and can be used without Qt,
+e.g. by batch pricing jobs. QML gets tariffs wrapped into tariff_adapter.TariffAdapter.
+"""
 from math import ceil, floor
 from datetime import datetime, timedelta, date
 from calendar import monthrange
-from itertools import izip
 from config import DATE_USER_FORMAT
+from rows import TARIFF, Record
+from quotes import quotes
 from i18n import language
 
 _ = language.ugettext
@@ -23,11 +29,26 @@ _n('month', 'months', 1)
 DEFAULT_FREE_TIME = 15
 
 
-class Tariff(QObject):
+def zero_time_pivot(begin, zero_time):
+    """
+    @param begin: datetime
+    @param zero_time: tuple of hour and minute
+    @return: datetime, the first zero time not earlier than begin
+    """
+    pivot = begin.replace(hour=zero_time[0], minute=zero_time[1], second=0)
+    if pivot < begin:
+        pivot += timedelta(days=1)
+    return pivot
+
+
+class Tariff(object):
     """
     This is a base class for all tariffs in stoppark.
     Most Tariff-related constants are stored as class variables of this class.
+    Attributes of tariff can only be assigned once, when it's created.
     """
+    __slots__ = ('free_time', 'fields', 'version', 'id', 'title', 'type', 'interval', 'cost', 'zero_time',
+                 'max_per_day', 'note')
     HOURLY = 1
     DAILY = 2
     MONTHLY = 3
@@ -37,6 +58,7 @@ class Tariff(QObject):
         DAILY: 60 * 60 * 24,
         MONTHLY: 60 * 60 * 24 * 30  # TODO: sad, but month is not a fixed-time interval in our calendar
     }
+    MAX_STEADY_EDGES = 100  # price, that hasn't changed at that many unit edges in a row, never changes
 
     FIXED = 1
     DYNAMIC = 2
@@ -64,8 +86,8 @@ class Tariff(QObject):
     def create(response, free_time=None):
         """
         Initializes Tariff instance using response from remote database.
-        @param response: response from remote database query that fetches tariff information
-                         currently, it must be a list of string lists with a complete set of fields from Tariff table.
+        @param response: row of remote database query that fetches tariff information:
+                         rows.TARIFF record or list of strings with a complete set of fields from Tariff table.
         @return: Tariff descendant instance when all conditions have been met.
                  False when remote response is False
                  None when some condition was not satisfied during preliminary check.
@@ -76,8 +98,8 @@ class Tariff(QObject):
             free_time = DEFAULT_FREE_TIME
         free_time *= 60
         try:
-            assert (len(response) >= 8)
-            return Tariff.TYPES[int(response[2])](response, free_time=free_time)
+            record = response if isinstance(response, Record) else TARIFF.record(response)
+            return Tariff.TYPES[record.type](record, free_time=free_time)
         except (TypeError, AssertionError, IndexError, ValueError, KeyError) as e:
             return None
             #import sys
@@ -86,37 +108,47 @@ class Tariff(QObject):
             #    print line
 
     def __init__(self, fields, free_time=None):
-        QObject.__init__(self)
+        """
+        @param fields: rows.TARIFF record or list of Tariff table fields
+        @param free_time: int, seconds
+        """
         if free_time is None:
             free_time = DEFAULT_FREE_TIME * 60
         self.free_time = free_time
-        self.fields = fields
+        record = fields if isinstance(fields, Record) else TARIFF.record(fields)
+        self.fields = record.fields
+        self.version = (tuple(self.fields), free_time)
 
-        self._id = int(fields[0])
-        self._title = fields[1].decode('utf8', errors='replace')
+        self.id = record.id
+        self.title = record.name or u''
 
-        self._type = int(fields[2])
-        if self._type not in Tariff.TYPES.keys():
-            raise KeyError("There is no such tariff type: %i" % (self._type,))
+        self.type = record.type
+        if self.type not in Tariff.TYPES.keys():
+            raise KeyError("There is no such tariff type: %s" % (self.type,))
 
-        self._interval = int(fields[3])
-        if self._interval not in Tariff.DIVISORS.keys():
-            raise KeyError("There is no such interval: %i" % (self._interval,))
+        self.interval = record.interval
+        if self.interval not in Tariff.DIVISORS.keys():
+            raise KeyError("There is no such interval: %s" % (self.interval,))
 
         try:
-            self.cost = int(fields[4])
+            self.cost = int(record.cost)
         except ValueError:
-            self.cost = [int(i) for i in fields[4].split(' ')]
+            self.cost = tuple(int(i) for i in record.cost.split(' '))
 
-        if fields[5] not in ['None', '24:00']:
-            self.zero_time = [int(i, 10) for i in fields[5].split(':')]
+        if record.zerotime not in [None, '24:00']:
+            self.zero_time = tuple(int(i, 10) for i in record.zerotime.split(':'))
             if len(self.zero_time) != 2:
-                raise IndexError("Incorrect zero time: %s" % (fields[5]))
+                raise IndexError("Incorrect zero time: %s" % (record.zerotime,))
         else:
             self.zero_time = None
 
-        self.max_per_day = int(fields[6]) if fields[6] != 'None' else None
-        self._note = fields[7].decode('utf8', errors='replace')
+        self.max_per_day = record.maxperday
+        self.note = record.note or u''
+
+    def __setattr__(self, name, value):
+        if hasattr(self, name):
+            raise AttributeError("Tariff is immutable, %s cannot be changed" % (name,))
+        object.__setattr__(self, name, value)
 
     def calc_units(self, begin, end):
         """
@@ -135,26 +167,84 @@ class Tariff(QObject):
     def paid_time(self, units):
         return timedelta(seconds=units * Tariff.DIVISORS[self.interval])
 
-    #def __del__(self):
-    #    print '~Tariff'
-
-    @pyqtProperty(int, constant=True)
-    def id(self):
-        return self._id
+    def pivot(self, begin):
+        """
+        @return: datetime, zero time, since which units are counted anew, or None when tariff has no such time
+        """
+        return None
 
-    @pyqtProperty(str, constant=True)
-    def title(self):
-        return self._title
+    def unit_edges(self, begin, since):
+        """
+        Units of interval only change right after its end passes free time and then every unit,
+        counted from its beginning (until pivot) and then from pivot.
+        @param begin: datetime, beginning of calculation interval
+        @param since: datetime, the earliest edge
+        @return: generator of datetime, ascending
+        """
+        free = timedelta(seconds=self.free_time)
+        unit_seconds = Tariff.DIVISORS[self.interval]
+        pivot = self.pivot(begin)
+        for origin, until in ((begin, pivot), (pivot, None)) if pivot is not None else ((begin, None),):
+            edge = origin + free
+            if edge < since:
+                edge += timedelta(seconds=unit_seconds) * int(ceil((since - edge).total_seconds() / unit_seconds))
+            while until is None or edge < until:
+                yield edge
+                edge += timedelta(seconds=unit_seconds)
+
+    def breakpoints(self, begin, now):
+        """
+        Schedule of price changes of interval, that is priced by calc, as its end goes on.
+        @param begin: datetime, beginning of calculation interval
+        @param now: datetime, the earliest end of calculation interval
+        @return: generator of (datetime, int) tuples, the time right after which price changes and new price.
+                 It stops once price doesn't change any more, e.g. when tariff costs nothing.
+        """
+        price = self.calc(begin, now).price
+        steady = 0
+        for edge in self.unit_edges(begin, now):
+            next_price = self.calc(begin, edge + timedelta(microseconds=1)).price
+            if next_price == price:
+                steady += 1
+                if steady >= self.MAX_STEADY_EDGES:
+                    return
+                continue
+            steady = 0
+            price = next_price
+            yield edge, price
+
+    def next_price_change(self, begin, now):
+        """
+        @param begin: datetime, beginning of calculation interval
+        @param now: datetime, current end of calculation interval
+        @return: datetime, the time right after which price of interval changes, or None when it never changes
+        """
+        for edge, _price in self.breakpoints(begin, now):
+            return edge
+        return None
 
-    @pyqtProperty(int, constant=True)
-    def type(self):
-        return self._type
+    def quote(self, begin, end):
+        """
+        Cached calc, see quotes module.
+        @param begin: datetime, beginning of calculation interval
+        @param end: datetime, end of calculation interval
+        """
+        return quotes.quote(self, begin, end)
 
-    @pyqtProperty(int, constant=True)
-    def interval(self):
-        return self._interval
+    def calc_many(self, begins, end):
+        """
+        Prices many tickets at once, tariffs that can be priced by batch_pricing override this method.
+        @param begins: sequence of datetime or datetime64[us] array, beginnings of calculation intervals.
+                       Arrays are the fast path, see batch_pricing module.
+        @param end: datetime, common end of calculation intervals
+        @return: tuple of price, units and paid time sequences, one item per beginning, the same as calc returns.
+                 They are NumPy arrays (paid time is timedelta64[us]) when NumPy is available, lists otherwise.
+        """
+        import batch_pricing  # NumPy is only loaded when many tickets are priced
+        results = [self.calc(begin, end) for begin in begins]
+        return batch_pricing.columns([r.price for r in results], [r.units for r in results],
+                                     [r.paid_time for r in results])
 
-    @pyqtSlot(int, bool, result=str)
     def interval_str_check(self, units, include_number=False):
         if self.type == Tariff.ONCE:
             interval_base = ('unit_', 'units_')
@@ -168,8 +258,6 @@ class Tariff(QObject):
         extra = u'%i ' % (units,) if include_number else u''
         return extra + _n(*(interval_base + (units,)))
 
-
-    @pyqtSlot(int, bool, result=str)
     def interval_str(self, units, include_number=False):
         if self.type == Tariff.ONCE:
             interval_base = ('unit', 'units')
@@ -183,25 +271,14 @@ class Tariff(QObject):
         extra = u'%i ' % (units,) if include_number else u''
         return extra + _n(*(interval_base + (units,)))
 
-    @pyqtProperty(str, constant=True)
-    def note(self):
-        return self._note
-
-    @pyqtProperty(str, constant=True)
+    @property
     def cost_info_check(self):
         return _('$%(cost)s/%(interval)s') % {
             'cost': self.cost if isinstance(self.cost, int) else ','.join([str(c) for c in self.cost[:3]]) + '...',
             'interval': self.interval_str_check(1)
         }
 
-    @pyqtProperty(str, constant=True)
-    def cost_info(self):
-        return _('$%(cost)s/%(interval)s') % {
-            'cost': self.cost if isinstance(self.cost, int) else ','.join([str(c) for c in self.cost[:3]]) + '...',
-            'interval': self.interval_str(1)
-        }
-
-    @pyqtProperty(str, constant=True)
+    @property
     def cost_info(self):
         return _('$%(cost)s/%(interval)s') % {
             'cost': self.cost if isinstance(self.cost, int) else ','.join([str(c) for c in self.cost[:3]]) + '...',
@@ -212,14 +289,14 @@ class Tariff(QObject):
     def cost_db(self):
         return str(self.cost * 100) if isinstance(self.cost, int) else ''
 
-    @pyqtProperty(str, constant=True)
+    @property
     def zero_time_info(self):
         if self.zero_time is not None:
             return _('Zero time: ') + ':'.join(['%02i' % (t,) for t in self.zero_time])
         else:
             return u''
 
-    @pyqtProperty(str, constant=True)
+    @property
     def max_per_day_info(self):
         return _('Max per day: $%i') % (self.max_per_day,) if self.max_per_day is not None else u''
 
@@ -235,9 +312,21 @@ class TicketTariffResult(object):
         self.hours = None
         self.minutes = None
         self.paid_time = None
+        self.units_time = None
         self.units = None
         self.price = None
 
+    def set_delta(self, delta):
+        """
+        Sets duration and paid time for interval of given length. Units and price are not changed,
+        so result can be moved to another end of interval, as long as it has the same units (see quotes module).
+        @param delta: datetime.timedelta, time interval, that is being paid for
+        """
+        self.days = delta.days
+        self.hours = int(floor(delta.seconds / 3600))
+        self.minutes = int(floor((delta.seconds % 3600) / 60))
+        self.paid_time = max(self.units_time, delta)
+
     @property
     def check_duration(self):
         return u'%i %s %i %s %i %s' % (self.days, _n('day_', 'days_', self.days),
@@ -279,15 +368,11 @@ class FixedTariffResult(TicketTariffResult):
         """
         super(FixedTariffResult, self).__init__()
 
-        self.days = delta.days
-        self.hours = int(floor(delta.seconds / 3600))
-        self.minutes = int(floor((delta.seconds % 3600) / 60))
         self.units = units
-        self.paid_time = tariff.paid_time(self.units) + (extra_time if extra_time is not None else timedelta(0))
+        self.units_time = tariff.paid_time(self.units) + (extra_time if extra_time is not None else timedelta(0))
         if extra_units is not None:
             self.units += extra_units
-        if self.units == 0 or self.paid_time < delta:
-            self.paid_time = delta
+        self.set_delta(delta)
         self.cost = tariff.cost
 
         self.price = self.units * tariff.cost
@@ -296,12 +381,15 @@ class FixedTariffResult(TicketTariffResult):
             self.price = cost_per_day * (self.units / 24)
             self.price += min((self.units % 24) * tariff.cost, tariff.max_per_day)
 
+    def set_delta(self, delta):
+        super(FixedTariffResult, self).set_delta(delta)
+        if self.units == 0:
+            self.paid_time = delta
+
 
 @Tariff.register(Tariff.FIXED)
 class FixedTariff(Tariff):
-    def __init__(self, fields, **kw):
-        Tariff.__init__(self, fields, **kw)
-        self.result_class = FixedTariffResult
+    __slots__ = ()
 
     def calc_basis(self, begin, end):
         return FixedTariffResult(self, *self.calc_units(begin, end))
@@ -316,49 +404,45 @@ class FixedTariff(Tariff):
         )) else {}
 
     def calc_daily_zero_time(self, begin, end):
-        pivot = begin.replace(hour=self.zero_time[0], minute=self.zero_time[1], second=0)
-        if pivot < begin:
-            pivot += timedelta(days=1)
+        pivot = self.pivot(begin)
         _, units = self.calc_units(pivot, end)
         return FixedTariffResult(self, end - begin, units, **self.calc_daily_zero_time_extra(begin, end, pivot))
 
+    def pivot(self, begin):
+        if self.interval == Tariff.DAILY and self.zero_time:
+            return zero_time_pivot(begin, self.zero_time)
+        return None
+
     def calc(self, begin, end):
         if self.interval == Tariff.DAILY and self.zero_time:
             return self.calc_daily_zero_time(begin, end)
         else:
             return self.calc_basis(begin, end)
 
+    def calc_many(self, begins, end):
+        import batch_pricing
+        if batch_pricing.numpy is None or not isinstance(self.cost, int):
+            return Tariff.calc_many(self, begins, end)
+        return batch_pricing.fixed(self, begins, end)
+
 
 class DynamicTariffResult(TicketTariffResult):
     @staticmethod
-    def cycle(lst, skip=0):
-        for i in lst[skip:]:
-            yield i
-        while True:
-            for i in lst:
-                yield i
-
-    def total_price(self, tariff, units, skip=0):
-        cost_per_day = sum(tariff.cost)
-        if tariff.max_per_day is not None:
-            cost_per_day = min(cost_per_day, tariff.max_per_day)
+    def total_price(tariff, units, skip=0):
+        cost_per_day = tariff.cost_per_day
         base = cost_per_day * (units / 24)
-        base += min(cost_per_day, sum(price for _, price in izip(xrange(units % 24), self.cycle(tariff.cost, skip))))
+        base += min(cost_per_day, tariff.hours_price(units % 24, skip))
         return base
 
     def __init__(self, tariff, delta, units, extra=None):
         super(DynamicTariffResult, self).__init__()
 
-        self.days = delta.days
-        self.hours = int(floor(delta.seconds / 3600))
-        self.minutes = int(floor((delta.seconds % 3600) / 60))
-        self.units = units + (extra[0] if extra is not None else 0)
-        self.paid_time = tariff.paid_time(self.units)
-        if self.paid_time < delta:
-            self.paid_time = delta
+        self.units = units + (extra[0] if extra else 0)
+        self.units_time = tariff.paid_time(self.units)
+        self.set_delta(delta)
 
         self.price = self.total_price(tariff, units)
-        if extra is not None:
+        if extra:
             self.price += self.total_price(tariff, *extra)
 
         self.cost = self.price  # this value goes to the database
@@ -369,11 +453,35 @@ class DynamicTariff(Tariff):
     """
     This tariff can only have hour interval.
     """
+    __slots__ = ('prefix_sums', 'cost_per_day')
 
     def __init__(self, fields, **kw):
         Tariff.__init__(self, fields, **kw)
         if self.interval != Tariff.HOURLY:
             raise ValueError("DynamicTariff can only be hourly.")
+        # prefix_sums[i] is the total cost of the first i hours of cost cycle
+        prefix_sums = [0]
+        for cost in (self.cost if isinstance(self.cost, tuple) else (self.cost,)):
+            prefix_sums.append(prefix_sums[-1] + cost)
+        self.prefix_sums = tuple(prefix_sums)
+        cost_per_day = prefix_sums[-1]
+        self.cost_per_day = min(cost_per_day, self.max_per_day) if self.max_per_day is not None else cost_per_day
+
+    def hours_price(self, hours, skip=0):
+        """
+        Cost of consecutive hours, that are priced by cost cycle starting at its skip-th hour.
+        Cycle starts over from its first hour once it's over.
+        @param hours: int
+        @param skip: int, hours of the first cycle, that are not paid for
+        @return: int
+        """
+        prefix = self.prefix_sums
+        n = len(prefix) - 1
+        skip = min(skip, n)
+        if hours <= n - skip:
+            return prefix[skip + hours] - prefix[skip]
+        hours -= n - skip
+        return prefix[n] - prefix[skip] + (hours / n) * prefix[n] + prefix[hours % n]
 
     def extra(self, begin, end, pivot):
         return (
@@ -384,20 +492,28 @@ class DynamicTariff(Tariff):
             (pivot - begin).total_seconds() > self.free_time
         )) else ()
 
+    def pivot(self, begin):
+        if self.zero_time is not None:
+            return zero_time_pivot(begin, self.zero_time)
+        return None
+
     def calc(self, begin, end):
         if self.zero_time is not None:
-            pivot = begin.replace(hour=self.zero_time[0], minute=self.zero_time[1], second=0)
-            if pivot < begin:
-                pivot += timedelta(days=1)
+            pivot = self.pivot(begin)
             _, units = self.calc_units(pivot, end)
             return DynamicTariffResult(self, end - begin, units, self.extra(begin, end, pivot))
         return DynamicTariffResult(self, *self.calc_units(begin, end))
 
+    def calc_many(self, begins, end):
+        import batch_pricing
+        if batch_pricing.numpy is None:
+            return Tariff.calc_many(self, begins, end)
+        return batch_pricing.dynamic(self, begins, end)
+
 
 @Tariff.register(Tariff.ONCE)
 class OnceTariff(Tariff):
-    def __init__(self, fields, **kw):
-        Tariff.__init__(self, fields, **kw)
+    __slots__ = ()
 
 
 class CardTariffResult(object):
@@ -454,9 +570,7 @@ class SubscriptionTariff(Tariff):
     >>> B.begin == month_begin, B.end == month_end + timedelta(days=days_in_month(month_end + timedelta(days=1)))
     (True, True)
     """
-
-    def __init__(self, fields, **kw):
-        Tariff.__init__(self, fields, **kw)
+    __slots__ = ()
 
     def calc(self, begin, end):
         today = date.today()
@@ -496,9 +610,7 @@ class PrepaidTariff(Tariff):
     >>> B.begin == month_begin, B.end == month_end, B.units == (month_end - today).days + 1
     (True, True, True)
     """
-
-    def __init__(self, fields, **kw):
-        Tariff.__init__(self, fields, **kw)
+    __slots__ = ()
 
     def calc(self, begin, end):
         today = date.today()
@@ -0,0 +1,90 @@
+# coding=utf-8
+"""
+QML adapter of tariffs.
+
+Tariffs (see tariff module) are plain Python objects, while QML can only access properties and slots of QObject.
+So tariffs are wrapped into TariffAdapter only when they are shown, in GUI thread.
+Any other attribute of adapter is the attribute of its tariff, so payables can be given either of them.
+"""
+from PyQt4.QtCore import QObject, pyqtProperty, pyqtSlot
+
+
+class TariffAdapter(QObject):
+    def __init__(self, tariff, parent=None):
+        """
+        @param tariff: tariff.Tariff
+        """
+        QObject.__init__(self, parent)
+        self.tariff = tariff
+
+    def __getattr__(self, name):
+        if name == 'tariff':  # not assigned yet
+            raise AttributeError(name)
+        return getattr(self.tariff, name)
+
+    @pyqtProperty(int, constant=True)
+    def id(self):
+        return self.tariff.id
+
+    @pyqtProperty(str, constant=True)
+    def title(self):
+        return self.tariff.title
+
+    @pyqtProperty(int, constant=True)
+    def type(self):
+        return self.tariff.type
+
+    @pyqtProperty(int, constant=True)
+    def interval(self):
+        return self.tariff.interval
+
+    @pyqtProperty(str, constant=True)
+    def note(self):
+        return self.tariff.note
+
+    @pyqtSlot(int, bool, result=str)
+    def interval_str_check(self, units, include_number=False):
+        return self.tariff.interval_str_check(units, include_number)
+
+    @pyqtSlot(int, bool, result=str)
+    def interval_str(self, units, include_number=False):
+        return self.tariff.interval_str(units, include_number)
+
+    @pyqtProperty(str, constant=True)
+    def cost_info_check(self):
+        return self.tariff.cost_info_check
+
+    @pyqtProperty(str, constant=True)
+    def cost_info(self):
+        return self.tariff.cost_info
+
+    @pyqtProperty(str, constant=True)
+    def zero_time_info(self):
+        return self.tariff.zero_time_info
+
+    @pyqtProperty(str, constant=True)
+    def max_per_day_info(self):
+        return self.tariff.max_per_day_info
+
+
+class AdaptedTariffs(object):
+    """
+    Adapters of the last shown tariffs list.
+    DB returns the same tariffs list until tariffs change (see tariff_cache module),
+    so adapters are only created once per tariff.
+    """
+    def __init__(self):
+        self.tariffs = None
+        self.adapters = None
+
+    def __call__(self, tariffs):
+        """
+        @param tariffs: list of tariff.Tariff or None
+        @return: list of TariffAdapter or None
+        """
+        if tariffs is None:
+            return None
+        if tariffs is not self.tariffs:
+            self.tariffs = tariffs
+            self.adapters = [TariffAdapter(tariff) for tariff in tariffs]
+        return self.adapters
@@ -0,0 +1,58 @@
+# coding=utf-8
+"""
+Cache of parsed tariffs.
+
+Tariffs are identified by digest of their rows (along with free time, which is used to parse them),
+so Tariff objects are only re-created and local tariffs table is only rewritten when tariffs have changed.
+Quotes of previous tariffs are dropped then as well.
+"""
+from hashlib import sha1
+from time import time
+from tariff import Tariff
+from quotes import quotes
+
+
+class TariffCache(object):
+    def __init__(self):
+        self.digest = None
+        self.free_time = None
+        self.tariffs = []
+        self.updated = None
+
+    @staticmethod
+    def digest_of(rows):
+        """
+        Rows from remote database and from local tariffs table produce the same digest for the same tariffs.
+        @param rows: list of tariff fields lists
+        @return: str
+        """
+        h = sha1()
+        for row in rows:
+            h.update('|'.join(str(field) for field in row))
+            h.update('\n')
+        return h.hexdigest()
+
+    def fresh(self, max_age, free_time):
+        """
+        @param max_age: int, seconds
+        @param free_time: int, minutes
+        @return: bool, whether cached tariffs can be used without checking for changes
+        """
+        return self.updated is not None and free_time == self.free_time and time() - self.updated < max_age
+
+    def update(self, rows, free_time):
+        """
+        @param rows: list of tariff fields lists
+        @param free_time: int, minutes
+        @return: bool, whether tariffs have changed
+        """
+        self.updated = time()
+        digest = self.digest_of(rows)
+        if digest == self.digest and free_time == self.free_time:
+            return False
+
+        self.tariffs = filter(lambda x: x is not None, [Tariff.create(t, free_time) for t in rows])
+        self.digest = digest
+        self.free_time = free_time
+        quotes.clear()
+        return True
@@ -4,15 +4,27 @@ from PyQt4.QtCore import Qt, QVariant, QSize, QEvent
 from PyQt4.QtGui import QDialog, QFont, QHeaderView, QStyledItemDelegate
 from PyQt4.QtGui import QApplication, QStyle, QStyleOptionViewItem, QColor
 from PyQt4.QtSql import QSqlTableModel, QSqlDatabase
-from config import db_filename
+from config import db_filename, db_busy_timeout
 from i18n import language
 _ = language.ugettext
 
 
-#noinspection PyCallByClass,PyTypeChecker
-QDB = QSqlDatabase.addDatabase("QSQLITE")
-QDB.setDatabaseName(db_filename)
-QDB.open()
+QDB = None
+
+
+def database():
+    """
+    Opens database connection on first use, so importing this module doesn't touch local database file.
+    @return: QSqlDatabase
+    """
+    global QDB
+    if QDB is None:
+        #noinspection PyCallByClass,PyTypeChecker
+        QDB = QSqlDatabase.addDatabase("QSQLITE")
+        QDB.setDatabaseName(db_filename)
+        QDB.setConnectOptions('QSQLITE_BUSY_TIMEOUT=%i' % (db_busy_timeout * 1000,))
+        QDB.open()
+    return QDB
 
 
 class CenteredCheckBoxDelegate(QStyledItemDelegate):
@@ -123,7 +135,7 @@ class TerminalConfig(QDialog):
         self.ui.setupUi(self)
         self.localize()
 
-        self.model = TerminalSqlTableModel(self, QDB)
+        self.model = TerminalSqlTableModel(self, database())
         self.model.setEditStrategy(QSqlTableModel.OnManualSubmit)
         self.model.setTable('terminal')
         self.model.select()
@@ -2,6 +2,22 @@ from unittest import TestCase
 from db import DB, LocalDB
 from collections import namedtuple
 from ticket import Ticket
+from card_mirror import CardMirror
+from free_places import FreePlaces
+from report import Report
+from protocol import decode_params
+from outbox import Outbox
+from pool import ConnectionPool
+from breaker import CircuitBreaker
+from fake_db_server import FakeDBServer
+from gevent import socket
+from gevent.event import Event
+from gevent import sleep
+from tempfile import mkdtemp
+from shutil import rmtree
+from threading import Thread
+import sqlite3
+import os
 
 
 PaymentArgs = namedtuple('PaymentArgs', ['payment', 'tariff', 'id', 'cost', 'units', 'begin', 'end', 'price'])
@@ -9,25 +25,28 @@ PaymentArgs = namedtuple('PaymentArgs', ['payment', 'tariff', 'id', 'cost', 'uni
 
 class LocalDBMock(LocalDB):
     def __init__(self, operator):
-        super(LocalDBMock, self).__init__(':memory:')
+        super(LocalDBMock, self).__init__(':memory:', initialize=True)
         self.operator = operator
 
     def payments(self):
         return self.query('select Payment, Type, Kassa, Operator, TalonID,'
-                          'Status, TarifType, Tarif, TarifKol, DTIn, DTOut, Summa from payment')
+                          'Status, TarifType, Tarif, TarifKol, DTIn, DTOut, Summa from payment', flush=True)
 
     def session(self, session_id=None):
-        return '1234567890', self.operator, '2013-12-28 13:00', None
+        return '1234567890', self.operator, '1', '2013-12-28 13:00:00', None
 
 
 class MockDB(DB):
     #noinspection PyMissingConstructor
     def __init__(self, operator):
         self.local = LocalDBMock(operator)
+        self.written = Event()
+        self.free_places = FreePlaces(self)
+        self.notify = None
 
-    def query(self, q, local=False):
-        with self.local.connection() as c:
-            c.execute(q)
+    def query(self, q, params=(), local=False):
+        with self.local.transaction() as c:
+            c.execute(q, params)
 
 
 class TestDB(TestCase):
@@ -78,3 +97,232 @@ class TestDB(TestCase):
             'end': '2014-01-08 15:55:10',
             'price': 300
         })
+
+    def test_ticket_create(self):
+        row = ['Ticket', '1', '102516091500000030', 'None', 'None', 'None', 'None',
+               '13-10-25 16:09:15', 'None', '13-10-25 17:00:00', 'None', '1']
+        ticket = Ticket.create([row])
+        self.assertEqual(ticket.time_paid.hour, 17)
+        self.assertIsNone(ticket.time_excess_paid)
+
+        row[9] = 'malformed'
+        self.assertIsNone(Ticket.create([row]))
+
+    def test_outbox(self):
+        db = MockDB('Operator')
+        self.assertTrue(db.write_many([('update card set status = ?', (1,)), ('update card set status = ?', (2,))]))
+
+        # committed before write_many returns
+        head = db.local.outbox_head(10)
+        self.assertEqual([(q, decode_params(params)) for _, _, q, params in head],
+                         [('update card set status = ?', (1,)), ('update card set status = ?', (2,))])
+        self.assertEqual(len(set(key for _, key, _, _ in head)), 2)
+        self.assertTrue(db.written.is_set())
+
+        db.local.outbox_remove(head[0][0])
+        self.assertEqual(db.local.outbox_size(), 1)
+
+        self.assertFalse(db.write_many([('update nowhere set status = ?', (1,))], local=True))
+        self.assertEqual(db.local.outbox_size(), 1)
+
+    def test_outbox_legacy_replay(self):
+        server = FakeDBServer(legacy=True, seed=True)
+        db = MockDB('Operator')
+        db.pool = ConnectionPool()
+        db.addr = ('127.0.0.1', server.start(port=0))
+        db.breaker = CircuitBreaker()
+        try:
+            delta = 'update GStatus set PlaceFree = PlaceFree + ?'
+            db.write_many([(delta, (-1,)), (delta, (-2,)), (delta, (-4,))])
+            db.local.flush()
+
+            request = db.pool.request
+            requests = []
+
+            def failing(*args):
+                requests.append(args)
+                if len(requests) == 2:
+                    raise socket.error('connection reset')
+                return request(*args)
+            db.pool.request = failing
+            outbox = Outbox()
+            self.assertRaises(socket.error, outbox.replay, db)
+            self.assertEqual(db.local.outbox_size(), 2)  # acknowledged statement has left outbox
+
+            self.assertEqual(outbox.replay(db), 2)
+            self.assertEqual(db.local.outbox_size(), 0)
+            self.assertEqual(server.conn.execute('select PlaceFree from GStatus').fetchone()[0], 100 - 7)
+        finally:
+            db.pool.discard()
+            server.stop()
+
+    def test_card_mirror(self):
+        db = MockDB('Operator')
+        card = ['Card', '1', '2', 'E7008D750C', '2014-01-01', '2014-12-31', 'None', 'None',
+                'Ivan', 'Ivanovich', 'Ivanov', 'None', 'AA0001AA', 'None', 'None', '5', '1', '0', '0']
+        other = ['Card', '2', '2', '2A00D146C0'] + card[4:]
+        mirror = CardMirror(db.local)
+
+        remote = [card, other]
+        db.rows = lambda q: iter(remote)
+        self.assertTrue(mirror.sync(db))
+        self.assertEqual(mirror.get('E7008D750C'), card)
+
+        db.write('update card set status = ? where CardID = ?', (6, 'E7008D750C'), local=True)
+        db.local.flush()
+        self.assertEqual(mirror.get('E7008D750C')[15], '6')
+
+        remote = [card]
+        self.assertFalse(mirror.sync(db))
+        self.assertEqual(mirror.get('E7008D750C')[15], '6')
+
+        db.local.outbox_remove(db.local.outbox_head(1)[0][0])
+        self.assertTrue(mirror.sync(db))
+        self.assertEqual(mirror.get('E7008D750C'), card)
+        self.assertIsNone(mirror.get('2A00D146C0'))
+
+        # only cards reported by change feed are received
+        db.rows = lambda q, params: iter(fields for fields in remote if fields[3] in params)
+        remote = [other]
+        self.assertTrue(mirror.sync(db, {'2A00D146C0'}))
+        self.assertEqual(mirror.get('2A00D146C0'), other)
+        self.assertEqual(mirror.get('E7008D750C'), card)
+        remote = []
+        self.assertTrue(mirror.sync(db, {'2A00D146C0'}))
+        self.assertIsNone(mirror.get('2A00D146C0'))
+        self.assertEqual(mirror.get('E7008D750C'), card)
+
+    def test_options(self):
+        local = LocalDBMock('Operator')
+        changes = []
+        local.subscribe_options(lambda key, value: changes.append((key, value)))
+
+        local.set_option('apb', '2')
+        local.set_option('apb', '2')
+        self.assertEqual(local.option('apb'), '2')
+        self.assertEqual(local.query('select value from opt where key = "apb"')[0][0], '2')
+        self.assertEqual(changes, [('apb', '2')])
+        self.assertIsNone(local.option('unknown'))
+
+    def test_gather(self):
+        db = MockDB('Operator')
+        db.notify = None
+
+        started, running = [], []
+
+        def call(value, delay):
+            def f():
+                started.append(value)
+                sleep(delay)
+                running.append(len(started))
+                return value
+            return f
+
+        self.assertEqual(db.gather(call(1, 0.1), call(2, 0.1), call(3, 0.1)), [1, 2, 3])
+        # every call has started before any of them finished, so they have overlapped
+        self.assertEqual(running, [3, 3, 3])
+
+        self.assertEqual(db.gather(call(1, 0), call(2, 1), timeout=0.1), [1, False])
+
+    def test_free_places(self):
+        db = MockDB('Operator')
+        db.free_places.FLUSH_INTERVAL = 0.01
+        changes = []
+        db.free_places.subscribe(changes.append)
+
+        db.register_passes(1, 2, 0)
+        db.register_passes(2, 0, 1)
+        db.register_passes(3, 0, 0)
+        self.assertEqual(db.free_places.get(), 99)
+        db.local.flush()
+        self.assertEqual(db.local.get_free_places(), 100)
+        # pass events don't wait for delta
+        self.assertEqual(db.local.outbox_size(), 3)
+
+        sleep(0.05)
+        db.local.flush()
+        self.assertEqual(db.local.get_free_places(), 99)
+        self.assertEqual(db.local.outbox_size(), 4)
+        self.assertEqual(db.local.query('select count(*) from events')[0][0], 3)
+        self.assertEqual(changes, [99])
+
+        # delta in outbox has not been replayed to remote database, the new one has not been flushed yet
+        db.register_passes(1, 1, 0)
+        db.free_places.refresh(50)
+        self.assertEqual(db.free_places.get(), 48)
+        sleep(0.05)
+        db.local.flush()
+        self.assertEqual(db.local.get_free_places(), 48)
+        self.assertEqual(changes, [99, 48])
+
+    def test_session_counters(self):
+        db = MockDB('Operator')
+        db.generate_pass_event(1, inside=True)
+        db.generate_pass_event(2, inside=False)
+        db.generate_pass_event(2, inside=False, sn='E7008D750C')
+        db.generate_pass_event(2, inside=False)  # card pass is registered twice
+        db.generate_payment({'payment': 'Talon payment', 'tariff': 1, 'id': '', 'cost': 10, 'units': 3,
+                             'begin': '', 'end': '', 'price': 30})
+        db.generate_payment({'payment': 'Card payment', 'tariff': 1, 'id': '', 'cost': 5, 'units': 1,
+                             'begin': '', 'end': '', 'price': 5})
+
+        report = Report(db)
+        self.assertEqual((report.moved_in, report.moved_out, report.card_moved_out, report.ticket_moved_out),
+                         (1, 2, 1, 1))
+        self.assertEqual(report.sum, 35)
+
+        db.local.session_end()
+        report = Report(db)
+        self.assertEqual((report.moved_in, report.moved_out, report.sum), (0, 0, 0))
+
+    def test_concurrent_writes(self):
+        directory = mkdtemp()
+        try:
+            filename = os.path.join(directory, 'db')
+            LocalDB(filename, initialize=True)
+            errors = []
+
+            def writer():
+                local = LocalDB(filename)
+                try:
+                    for i in range(50):
+                        local.outbox_append([('update GStatus set PlaceFree = PlaceFree + ?', (1,))], local=True)
+                except sqlite3.Error as e:
+                    errors.append(e)
+
+            threads = [Thread(target=writer) for _ in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+            local = LocalDB(filename)
+            self.assertEqual(errors, [])
+            self.assertEqual(local.outbox_size(), 200)
+            self.assertEqual(local.get_free_places(), 300)
+        finally:
+            rmtree(directory)
+
+    def test_local_writer(self):
+        local = LocalDBMock('Operator')
+        local.writer.FLUSH_INTERVAL = 10
+        local.writer.append([('update GStatus set PlaceFree = ?', (1,))], outbox=False)
+        self.assertEqual(local.get_free_places(), 100)
+        self.assertEqual(local.query('select PlaceFree from GStatus', flush=True)[0][0], 1)
+        self.assertEqual(local.outbox_size(), 0)
+
+        local.writer.append([('insert into nowhere values(?)', (1,))])
+        local.writer.append([('update GStatus set PlaceFree = ?', (2,))])
+        self.assertFalse(local.flush())
+        self.assertEqual(local.get_free_places(), 2)
+        self.assertEqual(local.outbox_size(), 1)
+        self.assertEqual(local.writer.failed_size(), 1)
+
+        # failed group is retried, while statements committed by caller are not
+        local.execute([('create table nowhere(value integer)', ())])
+        self.assertFalse(local.writer.commit([('insert into elsewhere values(?)', (1,))]))
+        self.assertEqual(local.query('select count(*) from nowhere')[0][0], 1)
+        self.assertEqual(local.writer.failed_size(), 0)
+        self.assertTrue(local.writer.commit([('update GStatus set PlaceFree = ?', (3,))]))
+        self.assertEqual(local.get_free_places(), 3)
+        self.assertEqual(local.outbox_size(), 3)
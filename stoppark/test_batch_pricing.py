@@ -0,0 +1,61 @@
+from unittest import TestCase, skipIf
+from datetime import datetime, timedelta
+from random import Random
+from tariff import Tariff
+import batch_pricing
+
+DYNAMIC_COST = ' '.join(str(i) for i in range(1, 25))
+
+
+class TestBatchPricing(TestCase):
+    tariffs = [
+        ['1', 'Hourly', '1', '1', '11', 'None', 'None', 'None'],
+        ['1', 'Hourly + max_per_day', '1', '1', '7', 'None', '100', 'None'],
+        ['1', 'Daily', '1', '2', '100', 'None', 'None', 'None'],
+        ['1', 'Special daily', '1', '2', '100', '09:00', 'None', 'None'],
+        ['1', 'Monthly', '1', '3', '1000', 'None', 'None', 'None'],
+        ['2', 'Dynamic', '2', '1', DYNAMIC_COST, 'None', 'None', 'None'],
+        ['2', 'Dynamic + max_per_day', '2', '1', DYNAMIC_COST, 'None', '100', 'None'],
+        ['2', 'Dynamic + zero time', '2', '1', DYNAMIC_COST, '00:00', 'None', 'None'],
+        ['2', 'Dynamic + zero time + max_per_day', '2', '1', '5 10 15 20', '07:30', '30', 'None'],
+    ]
+
+    def begins(self, end, count):
+        random = Random(count)
+        begins = [end - timedelta(seconds=random.randint(0, 5 * 24 * 3600)) for _ in range(count)]
+        begins += [end - timedelta(minutes=m) for m in (0, 1, 14, 15, 16, 60, 61, 24 * 60)]
+        begins += [end.replace(hour=7, minute=30, second=0) - timedelta(seconds=s) for s in (0, 1, 15 * 60, 3600)]
+        return begins + [begin.replace(microsecond=random.randint(0, 999999)) for begin in begins]
+
+    def check(self):
+        end = datetime(2014, 2, 1, 10, 20, 30, 500)
+        begins = self.begins(end, 500)
+        for fields in self.tariffs:
+            tariff = Tariff.create(fields)
+            prices, units, paid_times = [getattr(column, 'tolist', lambda: column)()
+                                         for column in tariff.calc_many(begins, end)]
+            for begin, price, unit, paid_time in zip(begins, prices, units, paid_times):
+                result = tariff.calc(begin, end)
+                self.assertEqual((result.price, result.units, result.paid_time), (price, unit, paid_time),
+                                 (fields[1], begin))
+
+    @skipIf(batch_pricing.numpy is None, 'NumPy is not available')
+    def test_vectorized(self):
+        self.check()
+
+    @skipIf(batch_pricing.numpy is None, 'NumPy is not available')
+    def test_datetime64(self):
+        end = datetime(2014, 2, 1, 10, 20, 30, 500)
+        begins = self.begins(end, 100)
+        array = batch_pricing.numpy.array(begins, dtype='datetime64[us]')
+        for fields in self.tariffs:
+            tariff = Tariff.create(fields)
+            for column, expected in zip(tariff.calc_many(array, end), tariff.calc_many(begins, end)):
+                self.assertEqual(column.tolist(), expected.tolist(), fields[1])
+
+    def test_fallback(self):
+        numpy, batch_pricing.numpy = batch_pricing.numpy, None
+        try:
+            self.check()
+        finally:
+            batch_pricing.numpy = numpy
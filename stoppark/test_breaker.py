@@ -0,0 +1,29 @@
+from unittest import TestCase
+from gevent import socket
+from breaker import CircuitBreaker, CircuitOpen
+
+
+class TestCircuitBreaker(TestCase):
+    def test_states(self):
+        breaker = CircuitBreaker()
+        states = []
+        breaker.subscribe(states.append)
+
+        for _ in range(CircuitBreaker.FAILURE_THRESHOLD - 1):
+            breaker.failure()
+        breaker.check()
+        breaker.success()
+        for _ in range(CircuitBreaker.FAILURE_THRESHOLD):
+            breaker.failure()
+        self.assertRaises(CircuitOpen, breaker.check)
+        self.assertTrue(issubclass(CircuitOpen, socket.error))
+
+        def unavailable():
+            raise socket.timeout('timed out')
+
+        self.assertFalse(breaker.probe(unavailable))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(breaker.probe(lambda: None))
+        breaker.check()
+        self.assertEqual(states, [CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN, CircuitBreaker.OPEN,
+                                  CircuitBreaker.HALF_OPEN, CircuitBreaker.CLOSED])
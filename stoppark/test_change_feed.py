@@ -0,0 +1,97 @@
+from unittest import TestCase
+from change_feed import ChangeFeed
+from fake_db_server import FakeDBServer
+from pool import ConnectionPool
+
+
+class Remote(object):
+    def __init__(self, addr):
+        self.addr = addr
+        self.pool = ConnectionPool()
+
+    def request(self, q, params=()):
+        return self.pool.request(self.addr, q, params)
+
+
+class TestChangeFeed(TestCase):
+    def setUp(self):
+        self.server = FakeDBServer(seed=True)
+        self.remote = Remote(('127.0.0.1', self.server.start(port=0)))
+        self.feed = ChangeFeed(self.remote)
+        self.changes = []
+        self.applied = True
+        for table in ('Tariff', 'card'):
+            self.feed.subscribe(table, self.listener(table))
+
+    def tearDown(self):
+        self.remote.pool.discard()
+        self.server.stop()
+
+    def listener(self, table):
+        def changed(keys):
+            self.changes.append((table, keys))
+            return self.applied
+        return changed
+
+    def execute(self, q, params=()):
+        self.server.conn.execute(q, params)
+        self.server.conn.commit()
+
+    def test_changes(self):
+        self.assertTrue(self.feed.poll())
+        self.assertEqual(sorted(self.changes), [('Tariff', None), ('card', None)])
+
+        del self.changes[:]
+        self.assertTrue(self.feed.poll())
+        self.assertEqual(self.changes, [])
+
+        self.execute('update Tariff set cost = ? where id = ?', ('20', 1))
+        self.execute('update card set CardID = ? where CardID = ?', ('0000000001', 'E7008D750C'))
+        self.execute('delete from card where CardID = ?', ('2A00D146C0',))
+        self.execute('update terminal set title = ?', ('Gate',))
+        self.assertTrue(self.feed.poll())
+        self.assertEqual(sorted(self.changes), [('Tariff', {'1'}),
+                                                ('card', {'E7008D750C', '0000000001', '2A00D146C0'})])
+
+    def test_inactive(self):
+        self.execute('drop table change_log')
+        self.assertFalse(self.feed.poll())
+        self.assertEqual(self.changes, [])
+
+    def test_failed_poll(self):
+        self.assertTrue(self.feed.poll())
+        cursor = self.feed.cursor
+        del self.changes[:]
+
+        self.execute('alter table change_log rename to change_log_backup')
+        self.assertTrue(self.feed.poll())
+        self.assertEqual(self.feed.cursor, cursor)
+
+        self.execute('alter table change_log_backup rename to change_log')
+        self.execute('update Tariff set cost = ? where id = ?', ('20', 1))
+        self.assertTrue(self.feed.poll())
+        self.assertEqual(self.changes, [('Tariff', {'1'})])
+
+        # change log is gone for good
+        self.execute('alter table change_log rename to change_log_backup')
+        for _ in range(ChangeFeed.MAX_FAILURES - 1):
+            self.assertTrue(self.feed.poll())
+        self.assertFalse(self.feed.poll())
+        self.assertIsNone(self.feed.cursor)
+
+    def test_failed_listener(self):
+        self.assertTrue(self.feed.poll())
+        del self.changes[:]
+
+        self.applied = False
+        self.execute('update Tariff set cost = ? where id = ?', ('20', 1))
+        self.assertTrue(self.feed.poll())
+        self.assertEqual(self.changes, [('Tariff', {'1'})])
+
+        # table is notified again, until its listener succeeds
+        del self.changes[:]
+        self.assertTrue(self.feed.poll())
+        self.applied = True
+        self.assertTrue(self.feed.poll())
+        self.assertTrue(self.feed.poll())
+        self.assertEqual(self.changes, [('Tariff', None), ('Tariff', None)])
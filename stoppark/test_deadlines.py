@@ -0,0 +1,59 @@
+from unittest import TestCase
+from time import time
+from gevent import socket, spawn, sleep
+from deadlines import deadline, remaining, expired, current, bind, DeadlineExceeded
+from fake_db_server import FakeDBServer
+from pool import ConnectionPool
+from protocol import ROWS
+
+
+class TestDeadlines(TestCase):
+    def test_nesting(self):
+        self.assertIsNone(current())
+        self.assertEqual(remaining(20), 20)
+        with deadline(1):
+            outer = current()
+            self.assertLessEqual(remaining(20), 1)
+            with deadline(10):
+                self.assertEqual(current(), outer)
+            with deadline(None):
+                self.assertEqual(current(), outer)
+            with deadline(0.01):
+                self.assertLess(current(), outer)
+                sleep(0.02)
+                self.assertTrue(expired())
+                self.assertRaises(DeadlineExceeded, remaining, 20)
+            self.assertEqual(current(), outer)
+        self.assertIsNone(current())
+        self.assertTrue(issubclass(DeadlineExceeded, socket.timeout))
+
+    def test_bind(self):
+        with deadline(1):
+            value = current()
+            bound = spawn(bind(current))
+            unbound = spawn(current)
+        self.assertEqual(bound.get(), value)
+        self.assertIsNone(unbound.get())
+
+    def test_pool(self):
+        server = FakeDBServer(seed=True, latency=0.2)
+        addr = ('127.0.0.1', server.start(port=0))
+        pool = ConnectionPool()
+        try:
+            self.assertEqual(pool.request(addr, 'select PlaceFree from GStatus'), (ROWS, [['100']]))
+            begin = time()
+            with deadline(0.05):
+                self.assertRaises(socket.timeout, pool.request, addr, 'select PlaceFree from GStatus')
+                self.assertTrue(expired())
+            self.assertLess(time() - begin, 0.15)
+            self.assertEqual(pool.request(addr, 'select PlaceFree from GStatus'), (ROWS, [['100']]))
+
+            # statement is prepared first, so exchange takes two round trips, every one of them shorter than deadline
+            begin = time()
+            with deadline(0.3):
+                self.assertRaises(DeadlineExceeded, pool.request, addr,
+                                  'select PlaceFree from GStatus where PlaceFree > ?', (1,))
+            self.assertLess(time() - begin, 0.35)
+        finally:
+            pool.discard()
+            server.stop()
@@ -0,0 +1,54 @@
+from unittest import TestCase
+from time import time
+from gevent import socket
+from endpoints import Endpoint, Endpoints
+from breaker import CircuitOpen
+from fake_db_server import FakeDBServer
+from pool import ConnectionPool
+from protocol import ROWS
+
+FREE_PLACES = 'select PlaceFree from GStatus'
+
+
+class TestEndpoints(TestCase):
+    def setUp(self):
+        self.servers = [FakeDBServer(seed=True, latency=0.5), FakeDBServer(seed=True)]
+        self.endpoints = Endpoints([('127.0.0.1', server.start(port=0)) for server in self.servers])
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.discard()
+        for server in self.servers:
+            server.stop()
+
+    def request(self, addr):
+        return self.pool.request(addr, FREE_PLACES)
+
+    def test_hedge(self):
+        slow, fast = self.endpoints.endpoints
+        begin = time()
+        self.assertEqual(self.endpoints.hedge(self.request), (ROWS, [['100']]))
+        self.assertLess(time() - begin, 0.4)
+        self.assertIsNotNone(fast.latency)
+        self.assertEqual(self.endpoints.ordered(), [fast, slow])
+
+        begin = time()
+        self.assertEqual(self.endpoints.hedge(self.request), (ROWS, [['100']]))
+        self.assertLess(time() - begin, Endpoints.HEDGE_DELAY)
+
+    def test_failover(self):
+        slow, fast = self.endpoints.endpoints
+        self.servers[0].latency = 0
+        self.servers[1].stop()
+        self.pool.discard()
+        slow.latency, fast.latency = 0.01, 0.001  # replica goes first
+
+        self.assertEqual(self.endpoints.hedge(self.request), (ROWS, [['100']]))
+        self.assertEqual((slow.failures, fast.failures), (0, 1))
+
+        self.servers[0].stop()
+        self.pool.discard()
+        for _ in range(Endpoint.FAILURE_THRESHOLD):
+            self.assertRaises(socket.error, self.endpoints.hedge, self.request)
+        self.assertEqual(self.endpoints.ordered(), [])
+        self.assertRaises(CircuitOpen, self.endpoints.hedge, self.request)
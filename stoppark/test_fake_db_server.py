@@ -0,0 +1,40 @@
+from unittest import TestCase
+from fake_db_server import FakeDBServer
+from pool import ConnectionPool
+from protocol import NONE, FAIL, ROWS
+
+
+class TestFakeDBServer(TestCase):
+    def start(self, **kw):
+        self.server = FakeDBServer(seed=True, **kw)
+        self.addr = ('127.0.0.1', self.server.start(port=0))
+        self.pool = ConnectionPool()
+
+    def tearDown(self):
+        self.pool.discard()
+        self.server.stop()
+
+    def test_extended(self):
+        self.start()
+        self.assertEqual(self.pool.request(self.addr, 'select PlaceFree from GStatus'), (ROWS, [['100']]))
+        self.assertIn(self.addr, self.pool.framed)
+
+        update = 'update GStatus set PlaceFree = PlaceFree + ?'
+        self.assertEqual(self.pool.request(self.addr, update, (-1,), key='a'), (NONE, []))
+        self.assertEqual(self.pool.request(self.addr, update, (-1,), key='a'), (NONE, []))
+        self.assertIn(self.addr, self.pool.prepares)
+
+        results = self.pool.request_many(self.addr, [(update, (-1,), 'b'),
+                                                     ('select CardID from card where Type = ?', (3,), None),
+                                                     ('select nothing', (), None)])
+        self.assertEqual(results, [(NONE, []), (ROWS, [['2A00D146C0']]), (FAIL, [])])
+        self.assertEqual(self.pool.request(self.addr, 'select PlaceFree from GStatus'), (ROWS, [['98']]))
+        self.assertEqual(self.server.requests, 7)  # including two prepare requests
+
+    def test_legacy(self):
+        self.start(legacy=True)
+        self.assertEqual(self.pool.request(self.addr, 'select title from terminal where terminal_id = ?', (1,)),
+                         (ROWS, [['Entry']]))
+        self.assertEqual(self.pool.request(self.addr, 'delete from terminal'), (NONE, []))
+        self.assertNotIn(self.addr, self.pool.framed)
+        self.assertIsNone(self.pool.request_many(self.addr, [('select 1', (), None)]))
@@ -0,0 +1,32 @@
+from unittest import TestCase
+from latency import Histogram, Latency, bucket_of, bucket_range
+
+
+class TestHistogram(TestCase):
+    def test_buckets(self):
+        for value in [0, 1, 63, 64, 100, 1000, 12345, 10 ** 6, 3600 * 10 ** 6]:
+            low, high = bucket_range(bucket_of(value))
+            self.assertTrue(low <= value <= high)
+            self.assertTrue(high - low <= max(1, value / 32))
+
+    def test_percentile(self):
+        histogram = Histogram()
+        for ms in range(1, 101):
+            histogram.record(ms / 1000.0)
+        histogram.record(5, Histogram.TIMEOUT)
+        histogram.record(0.001, Histogram.ERROR)
+
+        self.assertEqual(histogram.count, 102)
+        self.assertEqual((histogram.errors, histogram.timeouts), (1, 1))
+        self.assertAlmostEqual(histogram.percentile(50), 0.050, delta=0.002)
+        self.assertAlmostEqual(histogram.percentile(99), 0.100, delta=0.002)
+        self.assertEqual(histogram.percentile(100), 5.0)
+
+    def test_report(self):
+        latency = Latency()
+        latency.record('select card', 0.002)
+        latency.record('batch', 0.010, Histogram.ERROR)
+        self.assertEqual(latency.report().split('\n'), [
+            'batch: n=1 p50=10.0ms p99=10.0ms max=10.0ms errors=1 timeouts=0',
+            'select card: n=1 p50=2.0ms p99=2.0ms max=2.0ms errors=0 timeouts=0'
+        ])
@@ -0,0 +1,61 @@
+from unittest import TestCase
+from datetime import datetime, timedelta
+from tariff import Tariff
+from tariff_cache import TariffCache
+from quotes import QuoteCache, quotes
+
+HOURLY = ['1', 'Hourly tariff', '1', '1', '1', 'None', 'None', 'None']
+
+
+class TestQuoteCache(TestCase):
+    def test_quote(self):
+        cache = QuoteCache()
+        tariff = Tariff.create(['1', 'Hourly tariff', '1', '1', '10', 'None', 'None', 'None'])
+        begin = datetime(2013, 10, 28, 9, 0, 0)
+
+        self.assertEqual(cache.quote(tariff, begin, begin + timedelta(minutes=15)).price, 0)
+        result = cache.quote(tariff, begin, begin + timedelta(minutes=15, seconds=30))
+        self.assertEqual((result.price, result.paid_time), (10, timedelta(hours=1)))
+        self.assertEqual(cache.quote(tariff, begin, begin + timedelta(hours=1, minutes=15, seconds=30)).price, 20)
+        self.assertEqual((cache.hits, cache.misses), (0, 3))
+
+        # quote is served until the next unit edge, moved to the actual end
+        result = cache.quote(tariff, begin, begin + timedelta(hours=2, minutes=15))
+        self.assertEqual((result.price, result.minutes), (20, 15))
+        self.assertEqual((cache.hits, cache.misses), (1, 3))
+
+    def test_exact(self):
+        cache = QuoteCache()
+        begin = datetime(2013, 10, 28, 7, 20, 30, 500)
+        for fields in (['1', 'Hourly tariff', '1', '1', '10', 'None', '50', 'None'],
+                       ['1', 'Special daily tariff', '1', '2', '100', '09:00', 'None', 'None'],
+                       ['2', '', '2', '1', '1 2 0 0 3 4 5 6', '09:00', '20', 'None']):
+            tariff = Tariff.create(fields)
+            for seconds in range(0, 3 * 24 * 3600, 7 * 60 + 7):
+                end = begin + timedelta(seconds=seconds)
+                self.assertEqual(cache.quote(tariff, begin, end).state(), tariff.calc(begin, end).state(),
+                                 (fields[1], end))
+        self.assertGreater(cache.hits, cache.misses)
+
+    def test_eviction(self):
+        cache = QuoteCache(capacity=2)
+        tariff = Tariff.create(HOURLY)
+        begin = datetime(2013, 10, 28, 11, 0, 0)
+        end = begin + timedelta(hours=2)
+        for begins in ([begin, begin + timedelta(minutes=1)], [begin + timedelta(minutes=2)], [begin]):
+            for b in begins:
+                cache.quote(tariff, b, end)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual((cache.hits, cache.misses), (0, 4))
+
+    def test_invalidation(self):
+        tariffs = TariffCache()
+        tariffs.update([HOURLY], 15 * 60)
+        begin = datetime(2013, 10, 28, 11, 0, 0)
+        tariffs.tariffs[0].quote(begin, begin + timedelta(hours=1))
+        self.assertNotEqual(len(quotes), 0)
+
+        self.assertFalse(tariffs.update([HOURLY], 15 * 60))
+        self.assertNotEqual(len(quotes), 0)
+        self.assertTrue(tariffs.update([HOURLY[:4] + ['2'] + HOURLY[5:]], 15 * 60))
+        self.assertEqual(len(quotes), 0)
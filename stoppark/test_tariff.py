@@ -1,6 +1,9 @@
 from unittest import TestCase
 from tariff import Tariff, FixedTariff, DynamicTariff
+from tariff_cache import TariffCache
+from tariff_adapter import AdaptedTariffs
 from datetime import datetime, timedelta
+from itertools import islice
 
 
 class TestFixedTariff(TestCase):
@@ -149,6 +152,26 @@ class TestFixedTariff(TestCase):
                          (2, 8, 20, 57, timedelta(2, 32400), 29))
 
 
+class TestTariffAdapter(TestCase):
+    def test_immutable(self):
+        tariff = Tariff.create(['1', 'Hourly tariff', '1', '1', '1', 'None', 'None', 'None'])
+        self.assertRaises(AttributeError, setattr, tariff, 'cost', 2)
+        self.assertFalse(hasattr(tariff, '__dict__'))
+
+    def test_adapted(self):
+        tariffs = [Tariff.create(['1', 'Hourly tariff', '1', '1', '1', 'None', 'None', 'None'])]
+        adapted = AdaptedTariffs()
+        adapters = adapted(tariffs)
+        self.assertIs(adapted(tariffs), adapters)
+        self.assertIsNot(adapted(list(tariffs)), adapters)
+        self.assertIsNone(adapted(None))
+
+        adapter = adapters[0]
+        self.assertEqual((adapter.id, adapter.title, adapter.cost_info), (1, u'Hourly tariff', tariffs[0].cost_info))
+        begin = datetime(2013, 10, 28, 11, 0, 0)
+        self.assertEqual(adapter.calc(begin, begin + timedelta(hours=2)).price, 2)
+
+
 class TestDynamicTariff(TestCase):
     def test_incorrect_init(self):
         self.assertRaises(ValueError, DynamicTariff, ['1', 'Dynamic', '2', '2', '1', 'None', 'None', 'None'])
@@ -190,4 +213,77 @@ class TestDynamicTariff(TestCase):
     def test_dynamic_zero_time_24(self):
         tariff = Tariff.create(['2', '', '2', '1', ' '.join(str(i) for i in range(1, 25)), '24:00', '100', 'None'])
         self.assertEqual(tariff.calc(datetime(2014, 2, 1, 8, 0, 0), datetime(2014, 2, 1, 10, 0, 0)).state(),
-                         (0, 2, 0, 2, timedelta(0, 2*3600), 1+2))
\ No newline at end of file
+                         (0, 2, 0, 2, timedelta(0, 2*3600), 1+2))
+
+    def test_hours_price(self):
+        tariff = Tariff.create(['2', '', '2', '1', '5 10 15 20', 'None', 'None', 'None'])
+        self.assertEqual(tariff.hours_price(0), 0)
+        self.assertEqual(tariff.hours_price(3), 5 + 10 + 15)
+        self.assertEqual(tariff.hours_price(6), 50 + 5 + 10)
+        self.assertEqual(tariff.hours_price(3, skip=2), 15 + 20 + 5)
+        self.assertEqual(tariff.hours_price(7, skip=3), 20 + 50 + 5 + 10)
+        self.assertEqual(tariff.hours_price(2, skip=10), 5 + 10)
+
+
+class TestBreakpoints(TestCase):
+    def assertBreakpoints(self, tariff, begin, now, count):
+        price = tariff.calc(begin, now).price
+        end = now
+        for edge, next_price in islice(tariff.breakpoints(begin, now), count):
+            while end <= edge:
+                self.assertEqual(tariff.calc(begin, end).price, price)
+                end += timedelta(minutes=1)
+            self.assertEqual(tariff.calc(begin, edge).price, price)
+            self.assertNotEqual(next_price, price)
+            self.assertEqual(tariff.calc(begin, edge + timedelta(microseconds=1)).price, next_price)
+            price, end = next_price, edge + timedelta(microseconds=1)
+
+    def test_fixed(self):
+        begin = datetime(2013, 10, 28, 11, 20, 30)
+        tariff = Tariff.create(['1', 'Hourly tariff', '1', '1', '10', 'None', '50', 'None'])
+        self.assertEqual(tariff.next_price_change(begin, begin), begin + timedelta(minutes=15))
+        self.assertEqual(tariff.next_price_change(begin, begin + timedelta(hours=2)),
+                         begin + timedelta(hours=2, minutes=15))
+        # price is capped by max per day from the fifth hour until the next day
+        self.assertEqual(tariff.next_price_change(begin, begin + timedelta(hours=5)),
+                         begin + timedelta(hours=24, minutes=15))
+        self.assertBreakpoints(tariff, begin, begin, 10)
+
+        tariff = Tariff.create(['1', 'Special daily tariff', '1', '2', '100', '09:00', 'None', 'None'])
+        self.assertEqual(tariff.next_price_change(begin, begin + timedelta(hours=1)),
+                         datetime(2013, 10, 29, 9, 15, 0))
+        self.assertBreakpoints(tariff, begin, begin, 5)
+
+        tariff = Tariff.create(['1', 'Free tariff', '1', '1', '0', 'None', 'None', 'None'])
+        self.assertIsNone(tariff.next_price_change(begin, begin))
+
+    def test_dynamic(self):
+        begin = datetime(2013, 10, 28, 7, 20, 30)
+        costs = '1 2 0 0 ' + ' '.join(str(i) for i in range(3, 23))
+        tariff = Tariff.create(['2', '', '2', '1', costs, 'None', 'None', 'None'])
+        # the third and the fourth hours cost nothing
+        self.assertEqual(tariff.next_price_change(begin, begin + timedelta(hours=2)),
+                         begin + timedelta(hours=4, minutes=15))
+        self.assertBreakpoints(tariff, begin, begin, 30)
+
+        tariff = Tariff.create(['2', '', '2', '1', costs, '09:00', '100', 'None'])
+        self.assertBreakpoints(tariff, begin, begin, 30)
+
+
+class TestTariffCache(TestCase):
+    def test_update(self):
+        cache = TariffCache()
+        remote = [['1', 'Hourly tariff', '1', '1', '1', 'None', 'None', 'None']]
+        local = [[1, 'Hourly tariff', 1, 1, 1, 'None', 'None', 'None']]
+
+        self.assertFalse(cache.fresh(60, 15))
+        self.assertTrue(cache.update(remote, 15))
+        tariffs = cache.tariffs
+        self.assertTrue(cache.fresh(60, 15))
+        self.assertFalse(cache.fresh(60, 10))
+
+        self.assertFalse(cache.update(local, 15))
+        self.assertIs(cache.tariffs, tariffs)
+
+        self.assertTrue(cache.update(remote, 10))
+        self.assertEqual(cache.tariffs[0].free_time, 10 * 60)
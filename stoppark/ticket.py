@@ -4,6 +4,7 @@ from datetime import datetime, timedelta
 from config import DATETIME_FORMAT, DATETIME_FORMAT_FULL, DATETIME_FORMAT_USER
 from tariff import Tariff
 from payment import Payment
+from rows import TICKET
 from i18n import language
 _ = language.ugettext
 _n = language.ungettext
@@ -29,6 +30,16 @@ class BaseTicketPayment(Payment):
     def price(self):
         return self.result.price
 
+    @property
+    def next_price_change(self):
+        """
+        @return: datetime, the first moment, when this payment would get another price, or None when it never does
+        """
+        change = self.tariff.next_price_change(self.begin, self.now)
+        if change is None:
+            return None
+        return change + timedelta(microseconds=1)  # price changes right after unit edge
+
     @property
     def check_interval(self):
         return {
@@ -56,7 +67,11 @@ class TicketPayment(BaseTicketPayment):
         BaseTicketPayment.__init__(self, ticket, tariff)
 
         if self._enabled:
-            self.result = tariff.calc(self.ticket.time_in, self.now)
+            self.result = tariff.quote(self.ticket.time_in, self.now)
+
+    @property
+    def begin(self):
+        return self.ticket.time_in
 
     @property
     def paid_until(self):
@@ -81,16 +96,13 @@ class TicketPayment(BaseTicketPayment):
             self.price_info
         ]
 
-    TICKET_QUERY = ('update ticket set typetarif=%i, pricetarif="%s", summ=%i * 100,\
-                    summdopl=0, TimeCount="%s", status = status | %i where bar="%s"')
+    TICKET_QUERY = ('update ticket set typetarif=?, pricetarif=?, summ=? * 100,'
+                    'summdopl=0, TimeCount=?, status = status | ? where bar=?')
 
     def execute(self, db):
         ticket_args = (self.tariff.id, self.tariff.cost_db, self.result.price,
                        self.paid_until.strftime(DATETIME_FORMAT), Ticket.PAID, self.ticket.bar)
-        ret = db.query(self.TICKET_QUERY % ticket_args) is None
-        if not ret:
-            return ret
-
+        db.write(self.TICKET_QUERY, ticket_args)
         return db.generate_payment(self.db_payment_args)
 
     def check(self, db):
@@ -122,7 +134,11 @@ class TicketExcessPayment(BaseTicketPayment):
         if self._enabled:
             self.excess = excess
             self.base_time = self.ticket.time_excess_paid if self.excess else self.ticket.time_paid
-            self.result = tariff.calc(self.base_time, self.now)
+            self.result = tariff.quote(self.base_time, self.now)
+
+    @property
+    def begin(self):
+        return self.base_time
 
     @property
     def paid_until(self):
@@ -149,14 +165,11 @@ class TicketExcessPayment(BaseTicketPayment):
             _('Surcharge: $%i') % (self.price,)
         ]
 
-    TICKET_QUERY = 'update ticket set summdopl = summdopl + %i*100, timedopl="%s", status = status | %i where bar="%s"'
+    TICKET_QUERY = 'update ticket set summdopl = summdopl + ?*100, timedopl=?, status = status | ? where bar=?'
 
     def execute(self, db):
         args = (self.result.price, self.paid_until.strftime(DATETIME_FORMAT), Ticket.PAID, self.ticket.bar)
-        ret = db.query(self.TICKET_QUERY % args) is None
-        if not ret:
-            return ret
-
+        db.write(self.TICKET_QUERY, args)
         return db.generate_payment(self.db_payment_args)
 
     def check(self, db):
@@ -233,17 +246,15 @@ class Ticket(QObject):
 
     @staticmethod
     def remove(db, bar):
-        return db.query('delete from ticket where bar="%s"' % (bar,))
+        return db.query('delete from ticket where bar=?', (bar,))
 
     @staticmethod
     def create(response):
         if response is False:
             return False
         try:
-            fields = response[0]
-            assert (len(fields) >= 12)
-            return Ticket(fields)
-        except (TypeError, AssertionError, IndexError, ValueError):
+            return Ticket(TICKET.record(response[0]))
+        except (TypeError, IndexError, ValueError):
             return None
 
     BAR_FORMAT = '%m%d%H%M%S'
@@ -295,30 +306,38 @@ class Ticket(QObject):
 
     @staticmethod
     def register(db, bar):
-        query = 'insert into ticket values("%s", NULL, "%s", NULL, NULL, NULL, NULL, "%s", NULL, NULL, NULL, 1)'
+        query = 'insert into ticket values(?, NULL, ?, NULL, NULL, NULL, NULL, ?, NULL, NULL, NULL, 1)'
         try:
             ticket_time = Ticket.parse_bar(bar).strftime(DATETIME_FORMAT)
         except ValueError:
             return None
         args = ("Ticket", bar, ticket_time)
-        return db.query(query % args) is None
+        return db.query(query, args) is None
 
-    def __init__(self, fields):
+    def __init__(self, record):
+        """
+        @param record: rows.TICKET record
+        @raise ValueError: when ticket has no correct entry time or any of its timestamps is malformed
+        """
         QObject.__init__(self)
-        self.fields = fields
+        self.record = record
+        self.fields = record.fields
         self.payments = []
 
-        self.id = fields[1]
-        self._bar = fields[2]
-        self.tariff_type = int(fields[3]) if fields[3] != 'None' else -1
-        self.tariff_price = fields[4]
-        self.tariff_sum = fields[5]
-        self.tariff_sum_excess = fields[6]
-        self.time_in = datetime.strptime(fields[7], DATETIME_FORMAT)
-        self.time_out = datetime.strptime(fields[8], DATETIME_FORMAT) if fields[8] != 'None' else None
-        self.time_paid = datetime.strptime(fields[9], DATETIME_FORMAT) if fields[9] != 'None' else None
-        self.time_excess_paid = datetime.strptime(fields[10], DATETIME_FORMAT) if fields[10] != 'None' else None
-        self.status = int(fields[11])
+        self.id = record.id
+        self._bar = record.bar
+        self.tariff_type = record.typetarif if record.typetarif is not None else -1
+        self.tariff_price = record.pricetarif
+        self.tariff_sum = record.summ
+        self.tariff_sum_excess = record.summdopl
+        self.time_in = record.timein
+        if self.time_in is None:
+            raise ValueError('Ticket %s has no entry time' % (record.bar,))
+        # parsed here, so malformed ticket is rejected by create instead of failing payment or check later
+        self.time_out = record.timeout
+        self.time_paid = record.TimeCount
+        self.time_excess_paid = record.timedopl
+        self.status = record.status
 
     def __del__(self):
         print '~Ticket'
@@ -357,10 +376,10 @@ class Ticket(QObject):
 
         return TicketPaymentUndefined(self)
 
-    OUT_QUERY = 'update ticket set timeout="%s", status = status | %i where bar = "%s"'
+    OUT_QUERY = 'update ticket set timeout=?, status = status | ? where bar = ?'
 
     def out(self, db):
-        return db.query(self.OUT_QUERY % (datetime.now().strftime(DATETIME_FORMAT), self.OUT, self.bar)) is None
+        return db.write(self.OUT_QUERY, (datetime.now().strftime(DATETIME_FORMAT), self.OUT, self.bar))
 
     def check(self):
         if self.status == self.IN:
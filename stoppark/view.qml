@@ -58,6 +58,16 @@ Rectangle {
         }
     }
 
+    function refresh_payments() {
+        if(!payable) {
+            return
+        }
+        for(var i=0;i<model.count;i++) {
+            model.setProperty(i, 'payment', payable.pay(model.get(i).tariff))
+        }
+        emit_current_payment()
+    }
+
     function emit_current_payment() {
         if(list.currentIndex != -1) {
             var item = model.get(list.currentIndex)